@@ -0,0 +1,417 @@
+# bench.py
+"""Benchmark suite for the library, persistence and playlist code paths.
+
+    python bench/bench.py [--sizes 1000,10000,100000] [--out bench-results.json]
+    python bench/bench.py --large   # also a 1,000,000-track library
+    python bench/bench.py --compare bench-results.json   # vs. a previous run
+
+Every case runs headless (no display, no audio device) against a synthetic
+library built by synth.py in a temporary directory. Each case reports its
+best wall time over --repeat runs and, from one extra traced run, its peak
+Python heap use. Results go to a JSON file; --compare loads an older file,
+prints the ratios, and exits non-zero if any case got slower than
+--threshold.
+
+The million-track size is the scale the library is meant to handle, but
+generating it writes a million (empty) files and takes a few minutes, so it
+only runs with --large (or when listed in --sizes).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+
+import synth  # noqa: E402
+from engine import NullBackend, PlaybackEngine  # noqa: E402
+from features import FEATURE_DIM, HAS_NUMPY, FeatureStore  # noqa: E402
+from history import PlayHistory  # noqa: E402
+from library import SEARCH_LIMIT, LibraryManager, load_from_folder  # noqa: E402
+from loudness import ANALYSIS_RATE, measure  # noqa: E402
+from metadata import HAS_MUTAGEN, read_metadata  # noqa: E402
+from party import PartyQueue  # noqa: E402
+from persist import Persist  # noqa: E402
+from playlist import PlaylistLinkedList  # noqa: E402
+from playlist_io import PathResolver, read_batches, read_m3u, write_m3u  # noqa: E402
+from search import SearchIndex  # noqa: E402
+from smart import META, SmartPlaylists  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+LARGE_SIZE = 1000000  # added by --large
+LOOKUPS = 10000  # random index lookups per lookup case
+WAVS = 200       # tiny WAVs for the tag-reading case
+SMART_PLAYLISTS = 200  # smart playlists kept current in the smart update case
+SMART_CHANGED = 1000   # songs re-checked per update
+RADIO_QUERIES = 64     # seeds per batched nearest-neighbour search
+LOUDNESS_SECONDS = 600  # audio measured per loudness case run
+SEARCH_QUERIES = ("love", "ar", "artist 4", "track 1234", "lov dre", "artst", "zzzz")
+
+
+class _Widget:
+    """Stands in for a Tk widget: every method is a no-op."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class HeadlessApp:
+    """The parts of MusicApp that LibraryManager and Persist talk to."""
+
+    def __init__(self):
+        self.root = _Widget()
+        self.library_listbox = _Widget()
+        self.playlist_listbox = _Widget()
+        self.library_status = _Widget()
+        self.playlists = {}
+        self.current_playlist_name = None
+        self.current_node = None
+        self.current_length = 0
+        self.party_queue = PartyQueue()
+        self.engine = PlaybackEngine(backend_factory=NullBackend)  # never started
+        self.persist = Persist(self)
+        self.library_manager = LibraryManager(self)
+        self.history = PlayHistory(resolve=self.library_manager.table.find)  # never loaded
+        self.smart_playlists = SmartPlaylists(self)
+
+    def display_playlist_songs(self):
+        pass
+
+    def set_current_length(self, seconds):
+        self.current_length = seconds
+
+    def stop(self):
+        pass
+
+    def close(self):
+        self.persist.close()
+        self.library_manager.cache.close()
+
+
+class Env:
+    """A synthetic library of n tracks on disk, plus its saved JSON files."""
+
+    def __init__(self, n, workdir):
+        self.n = n
+        self.dir = tempfile.mkdtemp(prefix=f"bench-{n}-", dir=workdir)
+        self.music = os.path.join(self.dir, "music")
+        synth.make_tree(self.music, n)
+        self.songs = synth.make_songs(n, root=self.music)
+        synth.write_library_json(os.path.join(self.dir, "library.json"), self.songs)
+        synth.write_playlists_json(os.path.join(self.dir, "playlists.json"), {"All": self.songs})
+        self.wavs = None
+        self.search_index = None  # built once: indexing a large library is slow
+
+    def playlist(self):
+        playlist = PlaylistLinkedList()
+        for song in self.songs:
+            playlist.append(song)
+        return playlist
+
+    def headless_app(self):
+        for name in os.listdir(self.dir):
+            if name.startswith(("journal.log", "metadata.db")):
+                os.remove(os.path.join(self.dir, name))
+        return HeadlessApp()
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# ---------- cases ----------
+# Each case takes an Env and returns (fn, teardown): fn is what gets timed,
+# everything before it is untimed setup. Cases are set up afresh per run.
+
+def case_scan(env):
+    return lambda: load_from_folder(env.music), None
+
+
+def case_load_library(env):
+    app = env.headless_app()
+    return app.persist.load_saved_library, app.close
+
+
+def case_load_playlists(env):
+    app = env.headless_app()
+    app.persist.load_saved_library()  # playlists.json holds song ids from the library
+
+    def run():
+        app.persist.load_saved_playlists()
+        if not all(len(p) for p in app.playlists.values()):
+            raise AssertionError(f"playlists loaded empty: {sorted(app.playlists)}")
+    return run, app.close
+
+
+def case_save_playlists(env):
+    app = env.headless_app()
+    app.playlists["All"] = env.playlist()
+
+    def run():
+        app.persist.save_playlists()
+        app.persist.writer.flush()
+    return run, app.close
+
+
+def case_append(env):
+    def run():
+        playlist = PlaylistLinkedList()
+        for song in env.songs:
+            playlist.append(song)
+    return run, None
+
+
+def case_shuffle(env):
+    playlist = env.playlist()
+    return lambda: playlist.shuffle(seed=1), None
+
+
+def case_shuffle_spread(env):
+    playlist = env.playlist()
+    return lambda: playlist.shuffle(seed=1, spread_artists=True), None
+
+
+def case_to_list(env):
+    playlist = env.playlist()
+    return playlist.to_list, None
+
+
+def case_node_at(env):
+    playlist = env.playlist()
+    indices = [random.Random(2).randrange(env.n) for _ in range(LOOKUPS)]
+
+    def run():
+        node_at = playlist.node_at
+        for i in indices:
+            node_at(i)
+    return run, None
+
+
+def case_index_of(env):
+    playlist = env.playlist()
+    rng = random.Random(3)
+    nodes = [playlist.node_at(rng.randrange(env.n)) for _ in range(LOOKUPS)]
+
+    def run():
+        index_of = playlist.index_of
+        for node in nodes:
+            index_of(node)
+    return run, None
+
+
+def case_import_m3u(env):
+    path = os.path.join(env.dir, "export.m3u8")
+    with open(path, "wb") as f:
+        for _ in write_m3u(f, env.songs, env.dir):
+            pass
+    resolver = PathResolver(s.filepath for s in env.songs)
+
+    def run():
+        with open(path, "rb") as f:
+            for _ in read_batches(f, read_m3u, resolver, env.dir):
+                pass
+    return run, None
+
+
+def case_search(env):
+    if env.search_index is None:
+        env.search_index = SearchIndex()
+        env.search_index.add_many(env.songs)
+    search = env.search_index.search
+
+    def run():
+        for query in SEARCH_QUERIES:
+            search(query, limit=SEARCH_LIMIT + 1)
+    return run, None
+
+
+def case_smart_update(env):
+    app = env.headless_app()
+    app.library_manager.add_songs(env.songs)
+    for i in range(SMART_PLAYLISTS):
+        app.smart_playlists.add(f"smart {i}", f'artist:"Artist {i}" duration:120-360')
+        app.smart_playlists.ensure(f"smart {i}")
+    changed = env.songs[:SMART_CHANGED]
+    return lambda: app.smart_playlists.update(changed, {META}), app.close
+
+
+def case_similar(env):
+    import numpy as np
+    store = FeatureStore(os.path.join(env.dir, "features-bench.npy"))
+    rng = np.random.default_rng(4)
+    store.put_many((s.id, rng.random(FEATURE_DIM, dtype=np.float32)) for s in env.songs)
+    seeds = [s.id for s in env.songs[:RADIO_QUERIES]]
+    store.similar(seeds[0])  # builds the search index outside the timing
+    return lambda: store.similar_many(seeds, 25), None
+
+
+def case_loudness(env):
+    import numpy as np
+    rng = np.random.default_rng(5)
+    samples = rng.uniform(-0.5, 0.5, ANALYSIS_RATE * LOUDNESS_SECONDS).astype(np.float32)
+    return lambda: measure(samples), None
+
+
+def case_read_metadata(env):
+    if env.wavs is None:
+        env.wavs = synth.make_wavs(os.path.join(env.dir, "wav"), min(env.n, WAVS))
+
+    def run():
+        for path in env.wavs:
+            read_metadata(path)
+    return run, None
+
+
+CASES = {
+    "library.load_from_folder": case_scan,
+    "persist.load_saved_library": case_load_library,
+    "persist.load_saved_playlists": case_load_playlists,
+    "persist.save_playlists": case_save_playlists,
+    "playlist.append": case_append,
+    "playlist.shuffle": case_shuffle,
+    "playlist.shuffle_spread_artists": case_shuffle_spread,
+    "playlist.to_list": case_to_list,
+    "playlist.node_at[10k]": case_node_at,
+    "playlist.index_of[10k]": case_index_of,
+    "playlist_io.read_m3u": case_import_m3u,
+    f"search.query[{len(SEARCH_QUERIES)}]": case_search,
+    "smart.update[200x1k]": case_smart_update,
+    "features.similar_many[64]": case_similar,
+    "loudness.measure[10min]": case_loudness,
+    "metadata.read_metadata[wav]": case_read_metadata,
+}
+
+SKIP = {"metadata.read_metadata[wav]": None if HAS_MUTAGEN else "mutagen not installed",
+        "features.similar_many[64]": None if HAS_NUMPY else "numpy not installed",
+        "loudness.measure[10min]": None if HAS_NUMPY else "numpy not installed"}
+
+
+def run_case(setup, env, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        fn, teardown = setup(env)
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if teardown:
+            teardown()
+        best = elapsed if best is None else min(best, elapsed)
+    result = {"seconds": round(best, 6)}
+    if memory:
+        fn, teardown = setup(env)
+        tracemalloc.start()
+        fn()
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if teardown:
+            teardown()
+    return result
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def max_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(",")]
+    if args.large and LARGE_SIZE not in sizes:
+        sizes.append(LARGE_SIZE)
+    selected = [name for name in CASES if not args.only or any(k in name for k in args.only)]
+    results = {}
+    workdir = args.workdir or tempfile.gettempdir()
+    cwd = os.getcwd()
+    for n in sizes:
+        print(f"-- {n} tracks: generating...", flush=True)
+        env = Env(n, workdir)
+        os.chdir(env.dir)  # Persist reads and writes relative to the cwd
+        try:
+            for name in selected:
+                key = f"{name}@{n}"
+                if SKIP.get(name):
+                    results[key] = {"skipped": SKIP[name]}
+                    print(f"{key:48} skipped ({SKIP[name]})")
+                    continue
+                repeat = 1 if n >= 1000000 else args.repeat
+                results[key] = run_case(CASES[name], env, repeat, not args.no_memory)
+                r = results[key]
+                peak = f"{r['peak_bytes'] / 1e6:10.1f} MB" if "peak_bytes" in r else ""
+                print(f"{key:48} {r['seconds'] * 1000:12.2f} ms {peak}", flush=True)
+        finally:
+            os.chdir(cwd)
+            if not args.keep:
+                env.cleanup()
+    report = {
+        "meta": {"when": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_rev(),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "sizes": sizes, "repeat": args.repeat, "max_rss_bytes": max_rss_bytes()},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+    return report
+
+
+def compare(old_path, new, threshold):
+    """Print new/old time ratios; returns the keys that regressed."""
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    regressed = []
+    print(f"\n{'case':48} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for key, r in new["results"].items():
+        before = old.get(key)
+        if "seconds" not in r or not before or "seconds" not in before:
+            continue
+        ratio = r["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+        flag = "  SLOWER" if ratio > threshold else ""
+        if flag:
+            regressed.append(key)
+        print(f"{key:48} {before['seconds'] * 1000:10.2f} {r['seconds'] * 1000:10.2f} {ratio:7.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated track counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--large", action="store_true",
+                        help=f"also run a {LARGE_SIZE:,}-track library (slow to generate)")
+    parser.add_argument("--only", nargs="*", help="run cases whose name contains any of these")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak-memory run")
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="new/old time ratio counted as a regression")
+    parser.add_argument("--workdir", help="where to generate libraries (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated libraries")
+    args = parser.parse_args()
+    args.out = os.path.abspath(args.out)
+
+    report = run(args)
+    if args.compare and compare(args.compare, report, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# party_load.py
+"""Load generator for the party voting server (src/party_server.py).
+
+    python bench/party_load.py --serve [--clients 200] [--seconds 10]
+    python bench/party_load.py --url http://127.0.0.1:8765 [--mode ws|http]
+
+--serve starts a VoteServer in this process, publishes a synthetic
+playlist and checks that every accepted vote comes out of the batches;
+otherwise the target is a running app with guest voting switched on. WS
+clients stream votes over one WebSocket each; HTTP clients POST /vote on
+keep-alive connections and report request latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from party_server import VOTE_BATCH_MS, VoteServer, read_frame, ws_frame  # noqa: E402
+
+SONGS = 200
+WS_BURST = 50  # votes written per WebSocket before yielding to the loop
+
+
+async def fetch_ids(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"GET /state HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    raw = await reader.read()
+    writer.close()
+    state = json.loads(raw.split(b"\r\n\r\n", 1)[1])
+    return [row["id"] for row in state.get("songs", [])]
+
+
+async def http_client(host, port, ids, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    sent = 0
+    try:
+        while time.perf_counter() < deadline:
+            body = b'{"id": %d}' % random.choice(ids)
+            started = time.perf_counter()
+            writer.write(b"POST /vote HTTP/1.1\r\nHost: x\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            sent += head.startswith(b"HTTP/1.1 202")
+    finally:
+        writer.close()
+    return sent
+
+
+async def ws_client(host, port, ids, deadline):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b"GET /ws HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    await reader.readuntil(b"\r\n\r\n")
+
+    async def drain_pushes():
+        while True:
+            await read_frame(reader, limit=1 << 24)
+    pushes = asyncio.ensure_future(drain_pushes())
+    sent = 0
+    try:
+        while time.perf_counter() < deadline:
+            for _ in range(WS_BURST):
+                payload = b'{"vote": %d}' % random.choice(ids)
+                writer.write(ws_frame(payload, mask=os.urandom(4)))
+            sent += WS_BURST
+            await writer.drain()
+        writer.write(ws_frame(b"", 8, mask=os.urandom(4)))
+        await writer.drain()
+    finally:
+        pushes.cancel()
+        writer.close()
+    return sent
+
+
+async def run(host, port, mode, clients, seconds):
+    ids = await fetch_ids(host, port)
+    if not ids:
+        sys.exit("the server lists no songs to vote for (is a playlist playing?)")
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    if mode == "http":
+        jobs = [http_client(host, port, ids, deadline, latencies) for _ in range(clients)]
+    else:
+        jobs = [ws_client(host, port, ids, deadline) for _ in range(clients)]
+    started = time.perf_counter()
+    sent = sum(await asyncio.gather(*jobs))
+    elapsed = time.perf_counter() - started
+    print(f"{mode}: {clients} clients sent {sent} votes in {elapsed:.1f}s ({sent / elapsed:,.0f} votes/s)")
+    if latencies:
+        latencies.sort()
+        print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    return sent
+
+
+def serve_and_run(args):
+    server = VoteServer("127.0.0.1", 0)
+    server.start()
+    server.publish({"now_playing": None, "party": True, "requested": [],
+                    "songs": [{"id": i, "title": f"Song {i}", "artist": "Load", "upvotes": 0,
+                               "duration": 200} for i in range(SONGS)]})
+    time.sleep(0.1)
+    sent = asyncio.run(run("127.0.0.1", server.port, args.mode, args.clients, args.seconds))
+    time.sleep(3 * VOTE_BATCH_MS / 1000)  # let the last batch out
+    batches, counted = 0, 0
+    while not server.batches.empty():
+        _, votes, _ = server.batches.get_nowait()
+        batches += 1
+        counted += sum(votes.values())
+    server.stop()
+    print(f"server accepted {server.received} votes, delivered {counted} in {batches} batches")
+    if counted != server.received or (args.mode == "http" and counted != sent):
+        sys.exit("vote counts do not match")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--serve", action="store_true", help="run against an in-process server")
+    parser.add_argument("--mode", choices=("ws", "http"), default="ws")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    if args.serve:
+        serve_and_run(args)
+    else:
+        url = urlsplit(args.url)
+        asyncio.run(run(url.hostname, url.port or 80, args.mode, args.clients, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
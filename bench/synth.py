@@ -0,0 +1,119 @@
+# synth.py
+"""Synthetic libraries for benchmarks: songs, files on disk and saved JSON.
+
+    python bench/synth.py OUT_DIR --tracks 10000 [--wavs 50]
+
+writes OUT_DIR/music/ (empty .mp3 files, plus a few tiny real WAVs),
+OUT_DIR/library.json and OUT_DIR/playlists.json, the way the app saves them.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import sys
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from persist import FORMAT_VERSION, SONG_FIELDS  # noqa: E402
+from song import Song  # noqa: E402
+
+PER_DIR = 1000  # files per generated directory
+WORDS = ("love", "night", "blue", "fire", "dream", "road", "heart", "rain",
+         "light", "dance", "city", "gold", "river", "echo", "storm", "home")
+
+
+def track_path(root, i):
+    return os.path.join(root, f"artist{i // PER_DIR:04d}", f"track{i:07d}.mp3")
+
+
+def make_songs(n, root="/synthetic", artists=None, seed=0):
+    """n Songs with fake paths under `root` and realistic-ish tag spread."""
+    rng = random.Random(seed)
+    artists = artists or max(1, n // 12)
+    songs = []
+    for i in range(n):
+        a = rng.randrange(artists)
+        songs.append(Song(f"Track {i} {rng.choice(WORDS)}", f"Artist {a}", track_path(root, i),
+                          album=f"Album {a}-{rng.randrange(4)}", track=i % 12 + 1,
+                          duration=rng.randint(90, 420), id=i + 1))
+    return songs
+
+
+def make_tree(root, n):
+    """Create n empty .mp3 files under `root`; returns their paths."""
+    paths = []
+    for i in range(n):
+        path = track_path(root, i)
+        if i % PER_DIR == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        paths.append(path)
+    return paths
+
+
+def write_wav(path, seconds=0.2, rate=8000, freq=440):
+    """A tiny mono 16-bit sine WAV, enough for tag readers and decoders."""
+    frames = int(seconds * rate)
+    step = 2 * math.pi * freq / rate
+    data = struct.pack(f"<{frames}h", *(int(math.sin(i * step) * 12000) for i in range(frames)))
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(data)
+    return path
+
+
+def make_wavs(root, n, seconds=0.2):
+    os.makedirs(root, exist_ok=True)
+    return [write_wav(os.path.join(root, f"tone{i:05d}.wav"), seconds, freq=220 + i % 660)
+            for i in range(n)]
+
+
+def library_doc(songs):
+    """library.json contents with every song in the library."""
+    return {"version": FORMAT_VERSION, "fields": SONG_FIELDS, "next_id": len(songs) + 1,
+            "songs": [[s.id, s.title, s.artist, s.filepath, s.album, s.track, s.duration,
+                       s.upvotes, None, None, s.added] for s in songs],
+            "library": [s.id for s in songs]}
+
+
+def write_library_json(path, songs):
+    with open(path, "w") as f:
+        json.dump(library_doc(songs), f)
+
+
+def write_playlists_json(path, playlists):
+    """`playlists` maps name -> list of Songs (from the same make_songs call)."""
+    with open(path, "w") as f:
+        json.dump({"version": FORMAT_VERSION,
+                   "playlists": {name: [s.id for s in songs] for name, songs in playlists.items()}}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out")
+    parser.add_argument("--tracks", type=int, default=10000)
+    parser.add_argument("--wavs", type=int, default=0, help="also write this many tiny WAVs")
+    parser.add_argument("--playlists", type=int, default=4)
+    args = parser.parse_args()
+
+    music = os.path.join(args.out, "music")
+    make_tree(music, args.tracks)
+    if args.wavs:
+        make_wavs(os.path.join(music, "wav"), args.wavs)
+    songs = make_songs(args.tracks, root=music)
+    write_library_json(os.path.join(args.out, "library.json"), songs)
+    rng = random.Random(1)
+    size = max(1, args.tracks // args.playlists)
+    write_playlists_json(os.path.join(args.out, "playlists.json"),
+                         {f"Playlist {i}": rng.sample(songs, min(size, len(songs)))
+                          for i in range(args.playlists)})
+    print(f"wrote {args.tracks} tracks to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,32 @@
-import os
-import random
+import time
+STARTED = time.perf_counter()  # for the time-to-first-paint report
+
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import *
 from tkinter import filedialog, simpledialog, messagebox
-import pygame
-import json
-from mutagen.mp3 import MP3
-import time
-from song import Song
-from playlist import Node, PlaylistLinkedList
-from persist import Persist
+import queue
+from playlist import PlaylistLinkedList
+from persist import Persist, SMART_COLOR
 from library import LibraryManager
+from listview import VirtualListbox
+from party import PartyQueue
+from engine import PlaybackEngine
+from history import PlayHistory
+from smart import PLAYS, VOTES, QueryError, SmartPlaylists
+from features import HAS_NUMPY, Radio
+from waveform import WaveformLoader, outline
+from party_server import GuestVoting
+from playlist_io import FORMATS, PlaylistFiles
+import perf
 
-# Try to import mutagen to get accurate track length (optional) 
-try: 
-    from mutagen import File as MutagenFile 
-    HAS_MUTAGEN = True 
-except Exception: 
-    HAS_MUTAGEN = False
+ENGINE_POLL_MS = 50   # how often the UI drains playback events
+SLIDER_TICK_MS = 250
+WAVEFORM_WIDTH, WAVEFORM_HEIGHT = 620, 48
 
-LIBRARY_FILE = "library.json"
-PLAYLIST_FILE = "playlists.json"
-SUPPORTED_EXT = (".mp3", ".wav", ".flac", ".ogg")
 
-
-# =====================
-# LIBRARY FUNCTIONS
-# =====================
-def load_from_folder(folder_path):
-    songs = []
-    for file in os.listdir(folder_path):
-        if file.lower().endswith(SUPPORTED_EXT):
-            title = os.path.splitext(file)[0]
-            songs.append(Song(title=title, artist="Unknown", filepath=os.path.join(folder_path, file)))
-    return songs
+def song_row(song):
+    return f"{song.title} - {song.artist}"
 
 # =====================
 # GUI APP
@@ -45,26 +37,37 @@ class MusicApp:
         self.root.title("🎵 Gray Beat Music Player")
         self.root.geometry("1000x900")
         self.root.config(bg="#2B2B2B")
-        pygame.mixer.init()
 
         self.library = []
         self.playlists = {}
         self.current_playlist_name = None
-        self.current_node = None
         
         self.persist = Persist(self)
         self.library_manager = LibraryManager(self)
-        self.is_paused = False
         
         
         # track length in seconds
         self.current_length = 0
 
-        # Stack for history
-        self.history_stack = []
+        # Recent plays and play counts, persisted to history.log + history.json
+        self.history = PlayHistory(resolve=self.library_manager.table.find,
+                                   writer=self.persist.writer)
+
+        # Playlists defined by a query, kept current as songs change
+        self.smart_playlists = SmartPlaylists(self)
+        self.guest_voting = GuestVoting(self)  # party voting from phones
+        self.playlist_files = PlaylistFiles(self)  # M3U/PLS/XSPF import and export
 
-        # Queue for "play next"
-        self.play_next_queue = []
+        # Party mode: upcoming songs ordered by upvotes
+        self.party_queue = PartyQueue()
+
+        # Playback runs on the engine thread; the UI only sends commands and
+        # redraws from the events it reports (see _poll_engine).
+        self.engine = PlaybackEngine(length_of=self._song_length)
+        self.engine.party_queue = self.party_queue
+        self._engine_events = queue.Queue()
+        self.engine.subscribe(lambda event, data: self._engine_events.put((event, data)))
+        self.engine.start()
 
         # ===================== Frames =====================
         library_frame = tk.Frame(root, bg="#2B2B2B")
@@ -75,12 +78,22 @@ class MusicApp:
 
         # ===================== Library Section =====================
         tk.Label(library_frame, text="🎧 Music Library", bg="#2B2B2B", fg="white", font=("Helvetica", 14, "bold")).pack(pady=5)
-        self.library_listbox = tk.Listbox(library_frame, width=40, height=20, selectmode=tk.MULTIPLE, bg="#1E1E1E", fg="white", font=("Helvetica", 11))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.library_manager.set_query(self.search_var.get()))
+        tk.Entry(library_frame, textvariable=self.search_var, width=40, bg="#1E1E1E", fg="white", insertbackground="white").pack(pady=(0, 5))
+        self.library_listbox = VirtualListbox(library_frame, width=40, height=20, selectmode=tk.MULTIPLE, formatter=song_row, bg="#1E1E1E", fg="white", font=("Helvetica", 11))
         self.library_listbox.pack(pady=5)
+        self.library_status = tk.Label(library_frame, text="", bg="#2B2B2B", fg="#AAAAAA", font=("Helvetica", 9))
+        self.library_status.pack()
 
         tk.Button(library_frame, text="📂 Load Folder", command=self.load_folder, bg="#4CAF50", fg="white", width=22, height=2).pack(pady=5)
         tk.Button(library_frame, text="➕ Add to Playlist", command=self.add_to_playlist, bg="#2196F3", fg="white", width=22, height=2).pack(pady=5)
         tk.Button(library_frame, text="🗑 Delete Song", command=self.delete_library_song, bg="#F44336", fg="white", width=22, height=2).pack(pady=5)
+        self.watch_folders = tk.BooleanVar(value=True)
+        tk.Checkbutton(library_frame, text="👁 Watch loaded folders for changes", variable=self.watch_folders, command=self.toggle_watch, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").pack(pady=5)
+        tk.Button(library_frame, text="🧬 Find Duplicates", command=self.library_manager.find_duplicates, bg="#607D8B", fg="white", width=22, height=2).pack(pady=5)
+        self.collapse_dupes = tk.BooleanVar(value=False)
+        tk.Checkbutton(library_frame, text="Show one copy of duplicate tracks", variable=self.collapse_dupes, command=lambda: self.library_manager.set_collapse_dupes(self.collapse_dupes.get()), bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").pack(pady=5)
 
         # ===================== Playlist Section =====================
         tk.Label(playlist_frame, text="🎶 Playlists", bg="#2B2B2B", fg="white", font=("Helvetica", 14, "bold")).pack(pady=5)
@@ -92,9 +105,13 @@ class MusicApp:
         btn_frame_playlist.pack(pady=5)
         tk.Button(btn_frame_playlist, text="🆕 New Playlist", command=self.new_playlist, bg="#FF9800", fg="white", width=15, height=2).grid(row=0, column=0, padx=5)
         tk.Button(btn_frame_playlist, text="🗑 Delete Playlist", command=self.delete_playlist, bg="#F44336", fg="white", width=15, height=2).grid(row=0, column=1, padx=5)
+        tk.Button(btn_frame_playlist, text="🧬 Remove Duplicates", command=self.dedupe_playlist, bg="#607D8B", fg="white", width=15, height=2).grid(row=0, column=2, padx=5)
+        tk.Button(btn_frame_playlist, text="✨ Smart Playlist", command=self.new_smart_playlist, bg="#009688", fg="white", width=15, height=2).grid(row=0, column=3, padx=5)
+        tk.Button(btn_frame_playlist, text="📥 Import Playlist", command=self.import_playlist, bg="#3F51B5", fg="white", width=15).grid(row=1, column=1, padx=5, pady=(5, 0))
+        tk.Button(btn_frame_playlist, text="📤 Export Playlist", command=self.export_playlist, bg="#3F51B5", fg="white", width=15).grid(row=1, column=2, padx=5, pady=(5, 0))
 
         tk.Label(playlist_frame, text="🎵 Songs in Playlist", bg="#2B2B2B", fg="white", font=("Helvetica", 14, "bold")).pack(pady=5)
-        self.playlist_songs_listbox = tk.Listbox(playlist_frame, width=50, height=15, bg="#1E1E1E", fg="white", font=("Helvetica", 11))
+        self.playlist_songs_listbox = VirtualListbox(playlist_frame, width=50, height=15, formatter=song_row, bg="#1E1E1E", fg="white", font=("Helvetica", 11))
         self.playlist_songs_listbox.pack(pady=5)
 
         btn_frame_songs = tk.Frame(playlist_frame, bg="#2B2B2B")
@@ -103,6 +120,16 @@ class MusicApp:
         tk.Button(btn_frame_songs, text="🔀 Shuffle", command=self.shuffle_playlist, bg="#9C27B0", fg="white", width=15, height=2).grid(row=0, column=1, padx=5)
         tk.Button(btn_frame_songs, text="⭐ Upvote", command=self.upvote_song, bg="#FFC107", fg="white", width=15, height=2).grid(row=0, column=2, padx=5)
         tk.Button(btn_frame_songs, text="⏩ Play Next", command=self.queue_play_next, bg="#00BCD4", fg="white", width=15, height=2).grid(row=0, column=3, padx=5)
+        self.spread_artists = tk.BooleanVar(value=False)
+        tk.Checkbutton(btn_frame_songs, text="Spread artists when shuffling", variable=self.spread_artists, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=1, column=0, columnspan=2, pady=(5, 0))
+        self.party_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(btn_frame_songs, text="🎉 Party mode (play by upvotes)", variable=self.party_mode, command=self.toggle_party_mode, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=1, column=2, columnspan=2, pady=(5, 0))
+        self.guest_votes = tk.BooleanVar(value=False)
+        tk.Checkbutton(btn_frame_songs, text="📡 Guests vote from their phones", variable=self.guest_votes, command=self.toggle_guest_voting, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=3, column=0, columnspan=2)
+        self.guest_url = tk.Label(btn_frame_songs, text="", bg="#2B2B2B", fg="#AAAAAA", font=("Helvetica", 9))
+        self.guest_url.grid(row=3, column=2, columnspan=2)
+        self.gapless = tk.BooleanVar(value=True)
+        tk.Checkbutton(btn_frame_songs, text="Gapless playback", variable=self.gapless, command=self.toggle_gapless, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=2, column=0, columnspan=4)
 
         # ===================== Playback Controls =====================
         control_frame = tk.Frame(playlist_frame, bg="#2B2B2B")
@@ -111,6 +138,11 @@ class MusicApp:
         tk.Button(control_frame, text="⏸ Pause/Resume", command=self.toggle_pause, bg="#FFC107", fg="white", width=15, height=2).grid(row=0, column=1, padx=5, pady=5)
         tk.Button(control_frame, text="⏮ Previous", command=self.previous_song, bg="#9C27B0", fg="white", width=15, height=2).grid(row=0, column=2, padx=5, pady=5)
         tk.Button(control_frame, text="⏭ Next", command=self.next_song, bg="#F44336", fg="white", width=15, height=2).grid(row=0, column=3, padx=5, pady=5)
+        self.radio_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="📻 Radio: keep playing songs like this one", variable=self.radio_mode, command=self.toggle_radio, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=1, column=0, columnspan=4)
+        self.level_volume = tk.BooleanVar(value=True)
+        tk.Checkbutton(control_frame, text="🔊 Level loudness across tracks", variable=self.level_volume, command=self.toggle_level_volume, bg="#2B2B2B", fg="white", selectcolor="#1E1E1E", activebackground="#2B2B2B").grid(row=2, column=0, columnspan=2)
+        tk.Button(control_frame, text="📊 Analyze Loudness", command=self.analyze_loudness, bg="#607D8B", fg="white", width=15).grid(row=2, column=2, columnspan=2, padx=5, pady=5)
 
         self.slider_dragging = False
 
@@ -118,6 +150,13 @@ class MusicApp:
         self.slider_frame = tk.Frame(playlist_frame, bg="#2B2B2B")
         self.slider_frame.pack(pady=10)
 
+        # Waveform of the playing track, above the slider; click to seek
+        self.waveform = tk.Canvas(self.slider_frame, width=WAVEFORM_WIDTH, height=WAVEFORM_HEIGHT, bg="#1E1E1E", highlightthickness=0)
+        self.waveform.pack(padx=10)
+        self.waveform.bind("<Button-1>", self.waveform_click)
+        self.waveform.create_line(0, 0, 0, WAVEFORM_HEIGHT, fill="#FFC107", tags="cursor")
+        self.waveform_loader = WaveformLoader(self, self.library_manager.waveforms) if HAS_NUMPY else None
+
         # Slider (on top)
         self.slider = ttk.Scale(self.slider_frame, from_=0, to=100, orient=HORIZONTAL, value=0, length=620)
         self.slider.pack(padx=10, pady=(0,5))  # add small bottom padding
@@ -149,17 +188,63 @@ class MusicApp:
         # Load saved library & playlists if exist
         self.persist.load_saved_library()
         self.persist.load_saved_playlists()
+        self.history.load()
+        self.toggle_watch()
+        self.library_manager.load_gains()
+        self.history_listbox.insert(tk.END, *(song_row(s) for s in self.history.recent))
+        self.history_listbox.see(tk.END)
 
 
         # slider updater id
         self._slider_updater_id = None
 
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(ENGINE_POLL_MS, self._poll_engine)
+        self.root.bind("<Expose>", self._on_first_paint, add="+")
+
+    def _on_first_paint(self, event):
+        # Fires once the window is being drawn; report after that draw finishes
+        self.root.unbind("<Expose>")
+        self.root.after_idle(self._report_first_paint)
+
+    def _report_first_paint(self):
+        elapsed = time.perf_counter() - STARTED
+        perf.record("startup.first_paint", elapsed)
+        self.library_status.config(text=f"Started in {elapsed:.2f}s")
+
+    # Playback state lives in the engine; these keep the old attribute names
+    @property
+    def current_node(self):
+        return self.engine.current_node
+
+    @property
+    def is_paused(self):
+        return self.engine.is_paused
+
+    @property
+    def play_next_queue(self):
+        return self.engine.play_next_queue
+
+    @property
+    def transition_ms(self):
+        return self.engine.transition_ms
+
+    def on_close(self):
+        self.engine.shutdown()
+        self.guest_voting.stop()
+        self.library_manager.stop_watching()
+        self.library_manager.features.flush()
+        self.library_manager.waveforms.close()
+        self.history.close()
+        # Pending saves are written in the background; make sure they land
+        self.persist.close()
+        self.library_manager.cache.close()
+        self.root.destroy()
+
     def start_slider_updater(self):
         # start periodic update (cancels existing)
-        if self._slider_updater_id:
-            self.root.after_cancel(self._slider_updater_id)
-            self._slider_updater_id = None
-        self._slider_updater_id = self.root.after(500, self.update_time)
+        self.stop_slider_updater()
+        self._slider_updater_id = self.root.after(SLIDER_TICK_MS, self.update_time)
 
     def stop_slider_updater(self):
         if self._slider_updater_id:
@@ -167,65 +252,54 @@ class MusicApp:
             self._slider_updater_id = None
             
     def update_time(self):
-        if not pygame.mixer.music.get_busy() and not self.is_paused:
-            self.next_song()
-            return  # stop updating if nothing is playing
-
-        current_time = pygame.mixer.music.get_pos()  # seconds
+        # Display only: the engine tracks the position and advances tracks
+        position = self.engine.position()
         song_length = self.current_length  # seconds
-
-        converted_current_time = time.strftime('%M:%S', time.gmtime(current_time))
-        converted_song_length = time.strftime('%M:%S', time.gmtime(song_length))
-
-        current_time += 1  # simulate next tick
-
-        if int(self.slider.get()) == int(song_length):
-            self.time_label.config(text=f'Time Elapsed: {converted_song_length} of {converted_song_length}')
-        elif self.is_paused:
-            pass
-        elif int(self.slider.get()) == int(current_time) and not self.slider_dragging:
-            # slider hasn't been moved
-            self.slider.config(to=int(song_length), value=int(current_time))
+        if not self.slider_dragging:
+            self.slider.config(value=int(position))
+            self.move_waveform_cursor(position)
+            converted_current_time = time.strftime('%M:%S', time.gmtime(position))
+            converted_song_length = time.strftime('%M:%S', time.gmtime(song_length))
             self.time_label.config(text=f'Time Elapsed: {converted_current_time} of {converted_song_length}')
-        else:
-            # slider has been moved manually
-            self.slider.config(to=int(song_length), value=int(self.slider.get()))
-            converted_current_time = time.strftime('%M:%S', time.gmtime(int(self.slider.get())))
-            self.time_label.config(text=f'Time Elapsed: {converted_current_time} of {converted_song_length}')
-
-            # move slider by 1 second
-            next_time = int(self.slider.get()) + 1
-            self.slider.config(value=next_time)
 
         # schedule next update
-        self._slider_updater_id = self.root.after(1000, self.update_time)
+        self._slider_updater_id = self.root.after(SLIDER_TICK_MS, self.update_time)
     
+    def draw_waveform(self, record):
+        """Show an envelope record (see waveform.py); None clears the canvas."""
+        self.waveform.delete("wave")
+        if record is not None:
+            self.waveform.create_polygon(outline(record, WAVEFORM_WIDTH, WAVEFORM_HEIGHT), fill="#607D8B", outline="", tags="wave")
+            self.waveform.tag_raise("cursor")
+        self.move_waveform_cursor(self.engine.position() if self.current_length else 0)
+
+    def move_waveform_cursor(self, position):
+        x = position / self.current_length * WAVEFORM_WIDTH if self.current_length else 0
+        self.waveform.coords("cursor", x, 0, x, WAVEFORM_HEIGHT)
+
+    def waveform_click(self, event):
+        if self.current_length:
+            self.engine.seek(int(event.x / WAVEFORM_WIDTH * self.current_length))
+
     def slider_press(self, event):
         self.slider_dragging = True
 
     def slider_release(self, event):
         self.slider_dragging = False
-        pos = int(self.slider.get())
-        
-        if self.is_paused or pygame.mixer.music.get_busy(): #if song is paused or playing
-            pygame.mixer.music.set_pos(pos)
-        else:
-            pygame.mixer.music.play(start=pos) #if song is not playing
-            self.start_slider_updater()
+        self.engine.seek(int(self.slider.get()))
             
     def highlight_current_song(self):
+        with perf.span("ui.highlight"):
+            self._highlight_current_song()
+
+    def _highlight_current_song(self):
         self.playlist_songs_listbox.selection_clear(0, tk.END)
         if self.current_node and self.current_playlist_name:
             playlist = self.playlists[self.current_playlist_name]
-            idx = 0
-            node = playlist.head
-            while node:
-                if node == self.current_node:
-                    self.playlist_songs_listbox.selection_set(idx)
-                    self.playlist_songs_listbox.see(idx)  # scroll to it
-                    break
-                node = node.next
-                idx += 1
+            if playlist.find(self.current_node.song.filepath) is self.current_node:
+                idx = playlist.index_of(self.current_node)
+                self.playlist_songs_listbox.selection_set(idx)
+                self.playlist_songs_listbox.see(idx)  # scroll to it
    
     # Small adapter functions 
     def load_folder(self): 
@@ -233,6 +307,9 @@ class MusicApp:
         if folder: 
             self.library_manager.load_folder(folder) 
 
+    def toggle_watch(self):
+        self.library_manager.set_watching(self.watch_folders.get())
+
     def delete_library_song(self): 
         selection = self.library_listbox.curselection() 
         if selection: 
@@ -246,14 +323,72 @@ class MusicApp:
                 return
             self.playlists[name] = PlaylistLinkedList()
             self.playlist_listbox.insert(tk.END, name)
-            self.persist.save_playlists()
+            self.persist.log_playlist_create(name)
+
+    def import_playlist(self):
+        path = filedialog.askopenfilename(title="Import Playlist", filetypes=FORMATS)
+        if not path:
+            return
+        try:
+            self.playlist_files.import_file(path)
+        except (ValueError, RuntimeError) as e:
+            messagebox.showwarning("Import Playlist", str(e))
+
+    def export_playlist(self):
+        if not self.current_playlist_name:
+            messagebox.showwarning("Warning", "Select a playlist first!")
+            return
+        path = filedialog.asksaveasfilename(title="Export Playlist", filetypes=FORMATS, defaultextension=".m3u8",
+                                            initialfile=self.current_playlist_name + ".m3u8")
+        if not path:
+            return
+        try:
+            self.playlist_files.export_file(self.current_playlist_name, path)
+        except (ValueError, RuntimeError) as e:
+            messagebox.showwarning("Export Playlist", str(e))
+
+    def new_smart_playlist(self):
+        name = simpledialog.askstring("Smart Playlist", "Enter playlist name:")
+        if not name:
+            return
+        if name in self.playlists and name not in self.smart_playlists:
+            messagebox.showwarning("Warning", "Playlist already exists!")
+            return
+        old = self.smart_playlists.smart.get(name)
+        query = simpledialog.askstring(
+            "Smart Playlist",
+            "Query, e.g.  artist:\"Daft Punk\" duration:3:00-6:00 upvotes:>=2 plays:>5 added:7d title:love",
+            initialvalue=old.query if old else "")
+        if not query:
+            return
+        try:
+            self.smart_playlists.add(name, query)
+        except QueryError as e:
+            messagebox.showerror("Smart Playlist", f"Bad query: {e}")
+            return
+        if not old:
+            self.playlist_listbox.insert(tk.END, name)
+            self.playlist_listbox.itemconfig(tk.END, fg=SMART_COLOR)
+        self.persist.log_smart_playlist(name, query)
+        if self.current_playlist_name == name:
+            self.smart_playlists.ensure(name)
+            self.display_playlist_songs()
+            self.engine.refresh_upcoming()
+
+    def _is_smart(self, name):
+        if name in self.smart_playlists:
+            messagebox.showinfo("Info", "Smart playlists are filled by their query.")
+            return True
+        return False
 
     def select_playlist(self, event):
         selection = self.playlist_listbox.curselection()
         if selection:
             self.current_playlist_name = self.playlist_listbox.get(selection[0])
+            self.smart_playlists.ensure(self.current_playlist_name)
             self.display_playlist_songs()
-            self.current_node = self.playlists[self.current_playlist_name].head
+            playlist = self.playlists[self.current_playlist_name]
+            self.engine.select(playlist, playlist.head)
 
     def delete_playlist(self):
         selection = self.playlist_listbox.curselection()
@@ -262,186 +397,177 @@ class MusicApp:
         playlist_name = self.playlist_listbox.get(selection[0])
         # Stop if currently playing song belongs to this playlist
         if self.current_playlist_name == playlist_name:
-            pygame.mixer.music.stop()
-            self.stop_slider_updater()
-            self.current_node = None
+            self.stop()
+            self.engine.select(None)
             self.current_playlist_name = None
-            self.current_length = 0
         del self.playlists[playlist_name]
+        self.smart_playlists.remove(playlist_name)
         self.playlist_listbox.delete(selection[0])
-        self.playlist_songs_listbox.delete(0, tk.END)
-        self.persist.save_playlists()
+        self.playlist_songs_listbox.set_items([])
+        self.persist.log_playlist_delete(playlist_name)
 
     def display_playlist_songs(self):
-        self.playlist_songs_listbox.delete(0, tk.END)
         playlist = self.playlists.get(self.current_playlist_name)
-        if playlist:
-            for song in playlist.to_list():
-                self.playlist_songs_listbox.insert(tk.END, f"{song.title} - {song.artist}")
+        self.playlist_songs_listbox.set_items(playlist.songs() if playlist else [])
 
     def add_to_playlist(self):
         if not self.current_playlist_name:
             messagebox.showwarning("Warning", "Select a playlist first!")
             return
+        if self._is_smart(self.current_playlist_name):
+            return
         selections = self.library_listbox.curselection()
         playlist = self.playlists[self.current_playlist_name]
-        added = 0
-        for index in selections:
-            song = self.library_manager.songs[index]
-            if playlist.append(song):
-                added += 1
-        if added == 0:
+        added = []
+        with self.engine.lock:
+            for index in selections:
+                song = self.library_manager.song_at(index)
+                if playlist.append(song):
+                    added.append(song)
+            if added and self.party_mode.get() and playlist is self.engine.playlist:
+                self.party_queue.extend(added)
+        if not added:
             messagebox.showinfo("Info", "All selected songs are already in the playlist.")
+            return
         self.display_playlist_songs()
-        self.persist.save_playlists()
+        self.engine.refresh_upcoming()
+        self.persist.log_playlist_add(self.current_playlist_name, added)
+
+    def dedupe_playlist(self):
+        playlist = self.playlists.get(self.current_playlist_name)
+        if not playlist or self._is_smart(self.current_playlist_name):
+            return
+        # Same track = same audio content once "Find Duplicates" has run
+        with self.engine.lock:
+            keep = self.current_node if self.current_node and playlist.find(self.current_node.song.filepath) is self.current_node else None
+            removed = playlist.dedupe(self.library_manager.content_key, keep=keep)
+            for song in removed:
+                self.party_queue.remove(song.filepath)
+        if not removed:
+            messagebox.showinfo("Info", "No duplicate tracks in this playlist.")
+            return
+        self.display_playlist_songs()
+        self.highlight_current_song()
+        self.engine.refresh_upcoming()
+        self.persist.log_playlist_remove(self.current_playlist_name, [s.filepath for s in removed])
+        messagebox.showinfo("Info", f"Removed {len(removed)} duplicate tracks.")
 
     def delete_playlist_song(self):
         selection = self.playlist_songs_listbox.curselection()
         playlist = self.playlists.get(self.current_playlist_name)
-        if not selection or not playlist:
+        if not selection or not playlist or self._is_smart(self.current_playlist_name):
             return
-        node = playlist.head
-        idx = 0
-        while node:
-            if idx == selection[0]:
+        node = playlist.node_at(selection[0])
+        if node:
+            with self.engine.lock:
                 # Stop if currently playing
-                if self.current_node == node and pygame.mixer.music.get_busy():
-                    pygame.mixer.music.stop()
-                    self.stop_slider_updater()
-                    self.current_length = 0
+                if self.current_node is node and self.engine.is_playing:
+                    self.stop()
                 playlist.remove(node)
-                break
-            node = node.next
-            idx += 1
+                self.party_queue.remove(node.song.filepath)
+            self.engine.refresh_upcoming()
+            self.persist.log_playlist_remove(self.current_playlist_name, [node.song.filepath])
         self.display_playlist_songs()
-        self.persist.save_playlists()
    
 
     # ===================== Playback Functions =====================
-    def _set_current_length_from_file(self, filepath):
-        self.current_length = 0
-        if HAS_MUTAGEN:
-            try:
-                meta = MutagenFile(filepath)
-                if meta and meta.info and getattr(meta.info, "length", None):
-                    self.current_length = int(meta.info.length)
-            except Exception:
-                self.current_length = 0
-                
-    def stop(self):
-        pygame.mixer.music.stop()
-        self.is_playing = False
-        self.is_paused = False
-        self.slider.config(value=0)
-        self.time_label.config(text="Time Elapsed: 00:00 of 00:00")
-
-    def play_song(self):
-        song_to_play = None
-        # Priority: play next queue
-        if self.play_next_queue:
-            song_to_play = self.play_next_queue.pop(0)
-        # Selected node
-        elif self.current_node:
-            song_to_play = self.current_node.song
-        # If nothing selected, play first song in playlist
-        elif self.current_playlist_name:
-            playlist = self.playlists[self.current_playlist_name]
-            self.current_node = playlist.head
-            if self.current_node:
-                song_to_play = self.current_node.song
-
-        if not song_to_play:
-            return
-        try:
-            self.stop()
-            pygame.mixer.music.load(song_to_play.filepath)
-            self.highlight_current_song()
-        except Exception as e:
-            messagebox.showerror("Playback Error", f"Failed to load: {e}")
-            return
-
-        # attempt to get track length (optional)
-        self._set_current_length_from_file(song_to_play.filepath)
-        if self.current_length and self.current_length > 0:
+    def set_current_length(self, seconds):
+        self.current_length = int(seconds or 0)
+        if self.current_length > 0:
             self.slider.config(from_=0, to=self.current_length)
         else:
             self.slider.config(from_=0, to=100)
 
-        pygame.mixer.music.play()
-        self.is_paused = False
-        self.update_history(song_to_play)
-        self.start_slider_updater()
+    def _song_length(self, song):
+        # Called on the engine thread. Prefer the duration the metadata
+        # pipeline already read, then the cache, then the file itself.
+        length = song.duration
+        if not length:
+            meta = self.library_manager.metadata_for(song)
+            length = meta["duration"] if meta else 0
+            song.duration = length
+        return length
+                
+    def stop(self):
+        self.engine.stop()
+
+    def play_song(self):
+        self.engine.play()
 
     def play_selected_song(self, event):
         selection = self.playlist_songs_listbox.curselection()
         playlist = self.playlists.get(self.current_playlist_name)
         if selection and playlist:
-            node = playlist.head
-            for _ in range(selection[0]):
-                node = node.next
-            self.current_node = node
-            self.play_song()
+            if playlist is not self.engine.playlist:
+                self.engine.select(playlist)
+            self.engine.play(playlist.node_at(selection[0]))
 
     def toggle_pause(self):
-        # Maintain explicit paused state
-        if pygame.mixer.music.get_busy():
-            pygame.mixer.music.pause()
-            self.is_paused = True
-        else:
-            # If paused, unpause; else nothing to unpause
-            if self.is_paused:
-                pygame.mixer.music.unpause()
-                self.is_paused = False
+        self.engine.toggle_pause()
 
     def next_song(self):
-        if not self.current_node or not self.current_playlist_name:
-            return
-        if self.current_node.next:
-            self.current_node = self.current_node.next
-            self.play_song()
-        else:
-            # If at last song, loop back to first song
-            playlist = self.playlists[self.current_playlist_name]
-            self.current_node = playlist.head
-            self.play_song()
-
+        self.engine.next()
 
     def previous_song(self):
-        if not self.current_node or not self.current_playlist_name:
-            return
-        if self.current_node.prev:
-            self.current_node = self.current_node.prev
-            self.play_song()
-        else:
-            playlist = self.playlists[self.current_playlist_name]
-            self.current_node = playlist.tail
-            self.play_song()
+        self.engine.previous()
+
+    def toggle_gapless(self):
+        self.engine.set_gapless(self.gapless.get())
+
+    def _poll_engine(self):
+        """Apply playback events from the engine thread on the Tk thread."""
+        while True:
+            try:
+                event, data = self._engine_events.get_nowait()
+            except queue.Empty:
+                break
+            if event == "track_started":
+                with perf.span("ui.track_started"):
+                    self._show_track(data)
+            elif event == "upcoming":
+                if self.waveform_loader:
+                    self.waveform_loader.prefetch(data["song"])
+            elif event == "stopped":
+                self.stop_slider_updater()
+                self.set_current_length(0)
+                self.slider.config(value=0)
+                self.draw_waveform(None)
+                self.time_label.config(text="Time Elapsed: 00:00 of 00:00")
+            elif event == "error":
+                messagebox.showerror("Playback Error", data["message"])
+        self.root.after(ENGINE_POLL_MS, self._poll_engine)
 
     # ===================== History & Queue =====================
+    def _show_track(self, data):
+        self.set_current_length(data["length"])
+        self.slider.config(value=0)
+        if self.waveform_loader:
+            self.waveform_loader.show(data["song"])
+        self.highlight_current_song()
+        if data["source"] != "history":
+            self.update_history(data["song"])
+        self.start_slider_updater()
+
     def update_history(self, song):
-        self.history_stack.append(song)
-        self.history_listbox.insert(tk.END, f"{song.title} - {song.artist}")
+        self.history.record(song)
+        self.smart_playlists.update([song], {PLAYS})
+        self.history_listbox.insert(tk.END, song_row(song))
+        # The list mirrors the store's ring buffer: drop the oldest row
+        if self.history_listbox.size() > self.history.size:
+            self.history_listbox.delete(0)
+        self.history_listbox.see(tk.END)
 
     def play_history_song(self, event):
         selection = self.history_listbox.curselection()
         if selection:
-            song = self.history_stack[selection[0]]
-            try:
-                pygame.mixer.music.load(song.filepath)
-                pygame.mixer.music.play()
-                self._set_current_length_from_file(song.filepath)
-                self.start_slider_updater()
-            except Exception:
-                messagebox.showerror("Playback Error", "Failed to play that history item.")
+            self.engine.play_song(self.history.recent[selection[0]], source="history")
 
     def queue_play_next(self):
         selection = self.playlist_songs_listbox.curselection()
         playlist = self.playlists.get(self.current_playlist_name)
         if selection and playlist:
-            node = playlist.head
-            for _ in range(selection[0]):
-                node = node.next
-            self.play_next_queue.insert(0, node.song)
+            node = playlist.node_at(selection[0])
+            self.engine.queue_next(node.song)
             messagebox.showinfo("Info", f"{node.song.title} queued to play next.")
 
     def shuffle_playlist(self):
@@ -449,54 +575,92 @@ class MusicApp:
         if not playlist:
             return
 
-        # Save currently playing song
-        current_song = self.current_node.song if self.current_node else None
-
-        # Save queue song filepaths
-        queue_filepaths = [song.filepath for song in self.play_next_queue]
-
-        # Shuffle the playlist
-        playlist.shuffle()
+        with self.engine.lock, perf.span("shuffle"):
+            # Shuffle relinks the existing nodes, so current_node stays valid
+            playlist.shuffle(spread_artists=self.spread_artists.get())
+            # Keep queued songs that are still in the playlist (O(1) per song)
+            self.play_next_queue[:] = [song for song in self.play_next_queue if song.filepath in playlist]
         self.display_playlist_songs()
-        self.persist.save_playlists()
-
-        # Restore current node
-        if current_song:
-            node = playlist.head
-            while node:
-                if node.song.filepath == current_song.filepath:
-                    self.current_node = node
-                    break
-                node = node.next
-
-        # Rebuild the play next queue using shuffled playlist nodes
-        new_queue = []
-        for filepath in queue_filepaths:
-            node = playlist.head
-            while node:
-                if node.song.filepath == filepath:
-                    new_queue.append(node.song)
-                    break
-                node = node.next
-        self.play_next_queue = new_queue
+        if self.current_playlist_name not in self.smart_playlists:
+            self.persist.log_playlist_order(self.current_playlist_name)
 
         # Highlight current song in UI
         self.highlight_current_song()
+        self.engine.refresh_upcoming()
 
 
     def upvote_song(self):
         selection = self.playlist_songs_listbox.curselection()
         playlist = self.playlists.get(self.current_playlist_name)
         if selection and playlist:
-            node = playlist.head
-            for _ in range(selection[0]):
-                node = node.next
-            node.song.upvotes += 1
+            node = playlist.node_at(selection[0])
+            with self.engine.lock:
+                node.song.upvotes += 1
+                self.party_queue.update(node.song)
+            self.engine.refresh_upcoming()
+            self.persist.log_vote(node.song)
+            self.smart_playlists.update([node.song], {VOTES})
             messagebox.showinfo("Info", f"{node.song.title} now has {node.song.upvotes} upvotes!")
 
+    def toggle_guest_voting(self):
+        if not self.guest_votes.get():
+            self.guest_voting.stop()
+            self.guest_url.config(text="")
+            return
+        try:
+            self.guest_voting.start()
+        except OSError as e:
+            messagebox.showerror("Guest Voting", f"Could not start the voting server: {e}")
+            self.guest_votes.set(False)
+            return
+        self.guest_url.config(text=self.guest_voting.url())
+
+    # ===================== Radio =====================
+    def toggle_radio(self):
+        if not self.radio_mode.get():
+            self.engine.set_radio(None)
+            return
+        if not HAS_NUMPY:
+            messagebox.showwarning("Radio", "Radio mode needs NumPy (pip install numpy).")
+            self.radio_mode.set(False)
+            return
+        seed = self.engine.current_song
+        selection = self.playlist_songs_listbox.curselection()
+        playlist = self.playlists.get(self.current_playlist_name)
+        if seed is None and selection and playlist:
+            seed = playlist.node_at(selection[0]).song
+        if seed is None:
+            messagebox.showwarning("Radio", "Play or select a song first!")
+            self.radio_mode.set(False)
+            return
+        # Tracks without features are analysed in the background; the
+        # station finds them as their vectors arrive
+        pending = self.library_manager.analyze_features()
+        if pending:
+            messagebox.showinfo("Radio", f"Analysing {pending} tracks in the background; "
+                                         "suggestions improve as they finish.")
+        self.engine.set_radio(Radio(self.library_manager.features, self.library_manager.library_song, seed))
+
+    # ===================== Loudness =====================
+    def toggle_level_volume(self):
+        # takes effect from the next track
+        self.engine.level_volume = self.level_volume.get()
+
+    def analyze_loudness(self):
+        if not HAS_NUMPY:
+            messagebox.showwarning("Loudness", "Loudness analysis needs NumPy (pip install numpy).")
+            return
+        pending = self.library_manager.analyze_loudness()
+        if not pending:
+            messagebox.showinfo("Loudness", "Every track has already been analysed.")
+
+    # ===================== Party Mode =====================
+    def toggle_party_mode(self):
+        # The engine refills the queue from its playlist and plays from it
+        self.engine.set_party_mode(self.party_mode.get())
+
 # ===================== MAIN =====================
 if __name__ == "__main__":
     root = tk.Tk()
     app = MusicApp(root)
     root.mainloop()
-
@@ -0,0 +1,154 @@
+# dupes.py
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PARTIAL = 64 * 1024  # bytes hashed from each end of the audio for the prefilter
+BLOCK = 4 << 20      # bytes per update() when hashing a whole file
+
+
+def audio_span(path):
+    """(offset, length) of the audio in a file, skipping ID3v2/ID3v1 tags.
+
+    Only the tag headers are read, so this is the cheap first pass: copies
+    of one track that were tagged differently still get the same length.
+    """
+    with open(path, "rb", buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size
+        head = f.read(10)
+        if len(head) == 10 and head[:3] == b"ID3":
+            # syncsafe size: 7 bits per byte, plus the header and optional footer
+            tag = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+            start = min(size, 10 + tag + (10 if head[5] & 0x10 else 0))
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b"TAG":
+                end -= 128
+        return start, end - start
+
+
+def _digest(path, offset, length, partial):
+    """blake2b of the audio bytes, read through mmap (no copies into Python).
+
+    With `partial`, only the first and last PARTIAL bytes are hashed; for
+    short files that is already the whole content.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if not partial and hasattr(m, "madvise"):
+            m.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(m) as view, view[offset:offset + length] as audio:
+            if partial and length > 2 * PARTIAL:
+                h.update(audio[:PARTIAL])
+                h.update(audio[-PARTIAL:])
+            else:
+                # hashlib drops the GIL on large buffers, so threads hash in parallel
+                for i in range(0, length, BLOCK):
+                    h.update(audio[i:i + BLOCK])
+    return h.hexdigest()
+
+
+def _groups(keys):
+    """{key: [paths]} for keys shared by more than one path."""
+    by_key = {}
+    for path, key in keys.items():
+        if key is not None:
+            by_key.setdefault(key, []).append(path)
+    return {key: paths for key, paths in by_key.items() if len(paths) > 1}
+
+
+def find_duplicates(entries, cache=None, workers=8):
+    """Group files with identical audio content.
+
+    `entries` is [(path, mtime, size), ...]. Three passes, each only over the
+    files the previous one could not tell apart: audio size (read from the
+    tag headers, not the file size, so retagged copies still match), hash of
+    the first and last 64 KB of audio, then the full hash. Results per file are
+    cached in `cache` (a MetadataCache) and reused while mtime and size match.
+    Returns ({digest: [paths]}, stats).
+    """
+    started = time.perf_counter()
+    entries = [e for e in entries if e[2]]  # empty files match nothing
+    stats = {"files": len(entries), "probed": 0, "partial": 0, "full": 0}
+    known = cache.get_hashes(entries) if cache else {}
+    rows = {path: [mtime, size] + known.get(path, [None, None, None])
+            for path, mtime, size in entries}
+
+    def fill(paths, column, fn, counter):
+        todo = [p for p in paths if rows[p][column] is None]
+        stats[counter] += len(todo)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for path, value in zip(todo, pool.map(fn, todo)):
+                rows[path][column] = value
+
+    def probe(path):
+        try:
+            return audio_span(path)
+        except OSError:
+            return None
+
+    def hasher(partial):
+        def run(path):
+            span = rows[path][2]
+            try:
+                return _digest(path, span[0], span[1], partial)
+            except (OSError, ValueError):
+                return None
+        return run
+
+    # rows[path] = [mtime, size, (offset, length), partial, full]
+    fill(list(rows), 2, probe, "probed")
+    by_length = _groups({p: row[2][1] if row[2] and row[2][1] else None
+                         for p, row in rows.items()})
+    candidates = [p for paths in by_length.values() for p in paths]
+    fill(candidates, 3, hasher(True), "partial")
+    by_partial = _groups({p: (rows[p][2][1], rows[p][3]) for p in candidates})
+    suspects = [p for paths in by_partial.values() for p in paths]
+    for p in suspects:
+        if rows[p][2][1] <= 2 * PARTIAL:
+            rows[p][4] = rows[p][3]  # the partial hash covered the whole audio
+    fill(suspects, 4, hasher(False), "full")
+    groups = _groups({p: rows[p][4] for p in suspects})
+
+    if cache:
+        cache.put_hashes([(path, *row) for path, row in rows.items()
+                          if row[2] is not None and known.get(path) != row[2:]])
+    stats["seconds"] = time.perf_counter() - started
+    return groups, stats
+
+
+class DuplicateFinder:
+    """Runs find_duplicates on a background thread.
+
+    The result is posted as ("dupes", {digest: [paths]}, stats) on `results`
+    (the scanner's queue), so the Tk loop applies it with the scan batches.
+    If the run fails, ("dupes_error", message) is posted instead.
+    """
+
+    def __init__(self, cache, results):
+        self.cache = cache
+        self.results = results
+        self._thread = None
+
+    def is_busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, entries):
+        if self.is_busy():
+            return False
+        entries = list(entries)
+        self._thread = threading.Thread(target=self._run, args=(entries,), daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, entries):
+        try:
+            groups, stats = find_duplicates(entries, self.cache)
+        except Exception as e:  # e.g. the cache database failing; report, don't just die
+            self.results.put(("dupes_error", str(e) or type(e).__name__))
+            return
+        self.results.put(("dupes", groups, stats))
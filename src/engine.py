@@ -0,0 +1,534 @@
+# engine.py
+import queue
+import threading
+import time
+from collections import deque
+
+import perf
+from loudness import volume
+
+TICK = 0.02  # seconds between end-of-track checks when idle
+
+
+class PygameBackend:
+    """pygame.mixer.music behind the handful of calls the engine makes.
+
+    Built on the engine thread when the first command arrives, so pygame is
+    imported and the mixer initialised then, off the UI thread and out of
+    startup.
+    """
+
+    def __init__(self):
+        import pygame
+        self.pygame = pygame
+        pygame.mixer.init()
+        self.end_event = pygame.USEREVENT + 1
+        # The end-of-track event needs SDL's event queue (video subsystem);
+        # without it the engine watches get_busy() instead.
+        try:
+            pygame.display.init()
+            pygame.mixer.music.set_endevent(self.end_event)
+            self.has_end_event = True
+        except pygame.error:
+            self.has_end_event = False
+
+    def load(self, path):
+        self.pygame.mixer.music.load(path)
+
+    def play(self, start=0.0):
+        self.pygame.mixer.music.play(start=start)
+
+    def queue(self, path):
+        self.pygame.mixer.music.queue(path)
+
+    def clear_queue(self, path, position, paused):
+        # The mixer only drops a queued file when it stops, so stop and pick
+        # the current one (`path`) up again where it was.
+        self.stop()
+        self.load(path)
+        self.play(start=position)
+        if paused:
+            self.pause()
+
+    def stop(self):
+        self.pygame.mixer.music.stop()
+        if self.has_end_event:
+            self.pygame.event.clear(self.end_event)  # stop() posts one; it is not a track end
+
+    def pause(self):
+        self.pygame.mixer.music.pause()
+
+    def unpause(self):
+        self.pygame.mixer.music.unpause()
+
+    def seek(self, seconds):
+        self.pygame.mixer.music.set_pos(seconds)
+
+    def set_volume(self, volume):
+        self.pygame.mixer.music.set_volume(volume)
+
+    def ended(self):
+        """Track ends since the last call, or None if only get_busy() can tell."""
+        if self.has_end_event:
+            return len(self.pygame.event.get(self.end_event))
+        return None
+
+    def busy(self):
+        return self.pygame.mixer.music.get_busy()
+
+
+class NullBackend:
+    """Silent backend for headless runs (tests, benchmarks).
+
+    "Plays" each file for `length_of(path)` seconds of wall-clock time and
+    honours queue() the way the mixer does, so engine logic runs unchanged.
+    """
+
+    has_end_event = True
+
+    def __init__(self, length_of=lambda path: 0.0):
+        self.length_of = length_of
+        self.loaded = None
+        self.queued = None
+        self.volume = 1.0
+        self._ends_at = None
+        self._left = None  # remaining time while paused
+
+    def load(self, path):
+        self.loaded = path
+
+    def play(self, start=0.0):
+        self._ends_at = time.monotonic() + max(0.0, self.length_of(self.loaded) - start)
+        self._left = None
+
+    def queue(self, path):
+        self.queued = path
+
+    def clear_queue(self, path, position, paused):
+        self.queued = None
+
+    def stop(self):
+        self._ends_at = self._left = self.queued = None
+
+    def pause(self):
+        if self._ends_at is not None:
+            self._left = self._ends_at - time.monotonic()
+            self._ends_at = None
+
+    def unpause(self):
+        if self._left is not None:
+            self._ends_at = time.monotonic() + self._left
+            self._left = None
+
+    def seek(self, seconds):
+        self.play(start=seconds)
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def ended(self):
+        if self._ends_at is None or time.monotonic() < self._ends_at:
+            return 0
+        if self.queued:
+            # mixer behaviour: the queued file starts the moment this one ends
+            self.loaded, self.queued = self.queued, None
+            self._ends_at += self.length_of(self.loaded)
+        else:
+            self._ends_at = None
+        return 1
+
+    def busy(self):
+        return self._ends_at is not None
+
+
+class PlaybackEngine:
+    """Owns playback state and drives the mixer from its own thread.
+
+    Control methods (play, next, toggle_pause, seek, ...) only enqueue a
+    command, so they are safe to call from the Tk thread. The engine thread
+    runs commands, watches for the end of the track (end event, or get_busy()
+    without one), preloads the next track for gapless playback, and reports
+    every change to subscribers as (event, data) calls made *on the engine
+    thread*; UIs should hand them to their own loop.
+
+    Events: "track_started" (song, node, length, source, gapless), "upcoming"
+    (song: what plays next, for prefetching), "paused", "resumed", "seeked"
+    (position), "stopped", "error" (message).
+
+    Position comes from a monotonic clock started at play() and adjusted for
+    seeks and pauses. Hold `lock` while mutating the active playlist, the
+    play-next queue or the party queue from another thread.
+    """
+
+    def __init__(self, backend_factory=PygameBackend, length_of=None):
+        self.backend = None
+        self._backend_factory = backend_factory
+        self.length_of = length_of or (lambda song: song.duration)
+        self.lock = threading.RLock()
+
+        self.playlist = None
+        self.current_node = None
+        self.current_song = None
+        self.is_playing = False
+        self.is_paused = False
+        self.length = 0.0
+        self.play_next_queue = []
+        self.party_queue = None
+        self.party_mode = False
+        self.radio = None  # features.Radio while radio mode is on
+        self.level_volume = True  # apply each song's analysed gain
+        self.gapless = True
+        # ms from noticing a track end to the next track playing: the load
+        # a non-gapless change adds, or how late a gapless one is caught up
+        # with (the mixer has already started the queued file by then)
+        self.transition_ms = deque(maxlen=100)
+
+        self._queued = None  # (song, node, source) handed to backend.queue
+        self._end_detected_at = None
+        self._started_at = None
+        self._offset = 0.0
+        self._paused_at = None
+        self._commands = queue.Queue()
+        self._subscribers = []
+        self._thread = None
+        self.ready = threading.Event()
+
+    # ---------- lifecycle ----------
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        self._commands.put(None)
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def _emit(self, event, **data):
+        for callback in list(self._subscribers):
+            callback(event, data)
+
+    # ---------- commands (any thread) ----------
+    def _submit(self, fn, *args):
+        self._commands.put((fn, args))
+
+    def play(self, node=None):
+        self._submit(self._play, node)
+
+    def play_song(self, song, source="direct"):
+        """Play a song that need not be in the current playlist (e.g. history)."""
+        self._submit(self._start, song, source)
+
+    def next(self):
+        self._submit(self._next)
+
+    def previous(self):
+        self._submit(self._previous)
+
+    def toggle_pause(self):
+        self._submit(self._toggle_pause)
+
+    def stop(self):
+        self._submit(self._stop)
+
+    def seek(self, seconds):
+        self._submit(self._seek, seconds)
+
+    def set_gapless(self, enabled):
+        self.gapless = enabled
+        self.refresh_upcoming()  # queues the next track, or drops the queued one
+
+    def refresh_upcoming(self):
+        """Re-pick the preloaded track after the queue/playlist changed."""
+        self._submit(self._queue_upcoming)
+
+    def select(self, playlist, node=None):
+        with self.lock:
+            self.playlist = playlist
+            self.current_node = node
+            if self.party_mode:
+                self._refill_party(clear=True)
+
+    def queue_next(self, song, front=True):
+        """Play `song` next (`front`) or after the songs already queued."""
+        with self.lock:
+            if front:
+                self.play_next_queue.insert(0, song)
+            else:
+                self.play_next_queue.append(song)
+        self.refresh_upcoming()
+
+    def set_party_mode(self, enabled):
+        with self.lock:
+            self.party_mode = enabled
+            self._refill_party(clear=True)
+        self.refresh_upcoming()
+
+    def set_radio(self, radio):
+        """Draw upcoming songs from `radio` (None: back to the playlist)."""
+        with self.lock:
+            self.radio = radio
+        self.refresh_upcoming()
+
+    def position(self):
+        """Seconds into the current track."""
+        if self._started_at is None:
+            return 0.0
+        end = self._paused_at if self._paused_at is not None else time.monotonic()
+        pos = self._offset + end - self._started_at
+        return min(pos, self.length) if self.length else pos
+
+    # ---------- engine thread ----------
+    def _run(self):
+        while True:
+            try:
+                # idle until the first command; then tick to watch for track ends
+                cmd = self._commands.get(timeout=TICK if self.backend else None)
+            except queue.Empty:
+                cmd = False
+            if cmd is None:
+                break
+            if self.backend is None:
+                try:
+                    self.backend = self._backend_factory()
+                except Exception as e:
+                    self._emit("error", message=f"Audio unavailable: {e}")
+                    continue
+                finally:
+                    self.ready.set()
+            with self.lock:
+                if cmd:
+                    fn, args = cmd
+                    try:
+                        fn(*args)
+                    except Exception as e:
+                        self._emit("error", message=str(e))
+                self._check_end()
+        if self.backend:
+            self.backend.stop()
+
+    def _mark_started(self, offset):
+        self._offset = offset
+        self._started_at = time.monotonic()
+        self._paused_at = None
+
+    def _play(self, node=None):
+        if node is not None:
+            self.current_node = node
+        # Priority: play next queue, then the selected node, then the first song
+        if self.play_next_queue:
+            self._start(self.play_next_queue.pop(0), "queue")
+            return
+        if self.current_node is None and self.playlist is not None:
+            self.current_node = self.playlist.head
+        if self.current_node:
+            self._start(self.current_node.song, "playlist")
+
+    def _start(self, song, source):
+        with perf.span("play.start"):
+            self._start_track(song, source)
+
+    def _start_track(self, song, source):
+        self.backend.stop()
+        self._queued = None
+        try:
+            with perf.span("play.load"):
+                self.backend.load(song.filepath)
+        except Exception as e:
+            self._emit("error", message=f"Failed to load: {e}")
+            return
+        with perf.span("play.length"):
+            self.length = float(self.length_of(song) or 0)
+        self._apply_gain(song)
+        self.backend.play()
+        self._mark_started(0.0)
+        self._record_transition()
+        self.current_song = song
+        self.is_playing = True
+        self.is_paused = False
+        if self.radio is not None and source != "radio":
+            self.radio.played(song)  # the station follows what the user picks
+        self._emit("track_started", song=song, node=self.current_node, length=self.length,
+                   source=source, gapless=False)
+        self._queue_upcoming()
+
+    def _next(self):
+        if self.radio is not None and not self.play_next_queue:
+            song = self.radio.pop()
+            if song:
+                self._start(song, "radio")
+                return
+        if not self.current_node or self.playlist is None:
+            self._stop()
+            return
+        if self.party_mode and not self.play_next_queue:
+            node = self._next_party_node()
+            if node:
+                self.current_node = node
+                self._play()
+                return
+        # At the last song, loop back to the first
+        self.current_node = self.current_node.next or self.playlist.head
+        self._play()
+
+    def _previous(self):
+        if not self.current_node or self.playlist is None:
+            return
+        self.current_node = self.current_node.prev or self.playlist.tail
+        self._play()
+
+    def _toggle_pause(self):
+        if self.is_paused:
+            self.backend.unpause()
+            self._started_at += time.monotonic() - self._paused_at
+            self._paused_at = None
+            self.is_paused = False
+            self._emit("resumed")
+        elif self.is_playing:
+            self.backend.pause()
+            self._paused_at = time.monotonic()
+            self.is_paused = True
+            self._emit("paused")
+
+    def _stop(self):
+        self.backend.stop()
+        self._queued = None
+        self.is_playing = self.is_paused = False
+        self._started_at = None
+        self.length = 0.0
+        self._emit("stopped")
+
+    def _seek(self, seconds):
+        if self.is_playing:
+            self.backend.seek(seconds)
+        elif self.current_song:
+            self.backend.play(start=seconds)  # track had finished: restart there
+            self.is_playing = True
+        else:
+            return
+        paused = self.is_paused
+        self._mark_started(seconds)
+        if paused:
+            self._paused_at = self._started_at
+        self._emit("seeked", position=seconds)
+
+    def _check_end(self):
+        if not self.is_playing:
+            return
+        ended = self.backend.ended()
+        if ended is None:
+            # no end event: a mixer that stopped while we are not paused has finished
+            ended = 0 if (self.is_paused or self.backend.busy()) else 1
+        if not ended:
+            return
+        self._end_detected_at = time.perf_counter()
+        if self._queued:
+            self._advance_queued()
+        else:
+            self._next()
+
+    # ---------- gapless ----------
+    def _upcoming(self):
+        """(song, node, source) that _next would play, without consuming it."""
+        if self.play_next_queue:
+            return self.play_next_queue[0], None, "queue"
+        if self.radio is not None:
+            song = self.radio.peek()
+            if song:
+                return song, None, "radio"
+        if not self.current_node or self.playlist is None:
+            return None
+        if self.party_mode and self.party_queue is not None:
+            if not self.party_queue:
+                self._refill_party()
+            song = self.party_queue.peek()
+            node = self.playlist.find(song.filepath) if song else None
+            if node:
+                return song, node, "party"
+        node = self.current_node.next or self.playlist.head
+        return (node.song, node, "playlist") if node else None
+
+    def _queue_upcoming(self):
+        if not self.is_playing:
+            self._queued = None  # nothing is playing, so the mixer holds no queue
+            return
+        upcoming = self._upcoming()
+        if upcoming:
+            self._emit("upcoming", song=upcoming[0])
+        # without end events a queued track starts unnoticed, so don't queue
+        if upcoming and self.gapless and self.backend.has_end_event:
+            try:
+                self.backend.queue(upcoming[0].filepath)  # replaces any queued file
+            except Exception:
+                pass
+            else:
+                self._queued = upcoming
+                # Have the length ready before the transition
+                self.length_of(upcoming[0])
+                return
+        self._drop_queued()
+
+    def _drop_queued(self):
+        """Forget the preloaded track, in the mixer too, or it would still play."""
+        if self._queued is None:
+            return
+        self._queued = None
+        if self.current_song is not None:
+            self.backend.clear_queue(self.current_song.filepath, self.position(), self.is_paused)
+
+    def _advance_queued(self):
+        # The mixer already started the queued file; catch the state up
+        song, node, source = self._queued
+        self._queued = None
+        if source == "queue":
+            self.play_next_queue.pop(0)
+        elif source == "party":
+            self.party_queue.remove(song.filepath)
+        elif source == "radio" and self.radio is not None:
+            self.radio.pop()
+        if node:
+            self.current_node = node
+        self.current_song = song
+        # the mixer has one volume for both tracks, so this lands a tick late
+        self._apply_gain(song)
+        self.length = float(self.length_of(song) or 0)
+        self._mark_started(0.0)
+        self._record_transition()
+        self._emit("track_started", song=song, node=self.current_node, length=self.length,
+                   source=source, gapless=True)
+        self._queue_upcoming()
+
+    def _apply_gain(self, song):
+        # the gain is already on the Song: no lookup on the play path
+        gain = song.gain if self.level_volume else None
+        self.backend.set_volume(volume(gain) if gain is not None else 1.0)
+
+    def _record_transition(self):
+        if self._end_detected_at is not None:
+            elapsed = time.perf_counter() - self._end_detected_at
+            self.transition_ms.append(elapsed * 1000)
+            perf.record("play.transition", elapsed)
+            self._end_detected_at = None
+
+    # ---------- party mode ----------
+    def _refill_party(self, clear=False):
+        if self.party_queue is None:
+            return
+        if clear:
+            self.party_queue.clear()
+        if self.party_mode and self.playlist is not None:
+            current = self.current_node.song if self.current_node else None
+            self.party_queue.extend(s for s in self.playlist.to_list() if s is not current)
+
+    def _next_party_node(self):
+        # Once every song has had its turn, start a new round
+        if not self.party_queue:
+            self._refill_party()
+        while self.party_queue:
+            node = self.playlist.find(self.party_queue.pop().filepath)
+            if node:
+                return node
+        return None
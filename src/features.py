@@ -0,0 +1,370 @@
+# features.py
+"""Audio feature vectors and nearest-neighbour search for radio mode.
+
+Each track is summarised by a FEATURE_DIM float32 vector: spectral centroid
+(mean, spread), RMS energy (mean, spread), a tempo estimate and its
+strength, and a 12-bin chroma profile. Vectors live in one memory-mapped
+matrix (features.npy) whose row number is the song's stable id, so the
+file is valid across runs and never rewritten as a whole except to grow.
+
+NumPy is optional: without it HAS_NUMPY is False and radio mode is off.
+Files are decoded with the wave module, or by ffmpeg when it is on PATH.
+"""
+import importlib.util
+import os
+import random
+import shutil
+import subprocess
+import threading
+import wave
+from collections import deque
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+FEATURES_FILE = "features.npy"  # lives next to library.json
+FEATURE_DIM = 18
+SAMPLE_RATE = 22050
+MAX_SECONDS = 90      # decoded per track, from the start
+N_FFT = 2048
+HOP = 512
+QUERY_BLOCK = 16      # queries per matrix product in similar_many
+# Per-dimension weights after standardising: the 12 chroma bins together
+# count about as much as tempo or timbre, not twelve times as much.
+WEIGHTS = (1.0, 0.5, 1.0, 0.5, 1.0, 0.5) + (0.35,) * 12
+
+
+def _to_mono(raw, width, channels):
+    import numpy as np
+    if width == 1:
+        samples = (np.frombuffer(raw, np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(raw, "<i2").astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(raw, "<i4").astype(np.float32) / 2147483648
+    else:
+        return None
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def decode(path, rate=SAMPLE_RATE, seconds=MAX_SECONDS):
+    """Up to `seconds` of mono float32 samples at `rate`, or None."""
+    import numpy as np
+    if path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as w:
+                source_rate = w.getframerate()
+                raw = w.readframes(int(seconds * source_rate))
+                samples = _to_mono(raw, w.getsampwidth(), w.getnchannels())
+        except (wave.Error, EOFError, OSError):
+            samples = None  # compressed WAV: let ffmpeg try
+        if samples is not None:
+            if source_rate != rate and len(samples):
+                # linear resampling is plenty for these features
+                t = np.arange(0, len(samples), source_rate / rate)
+                samples = np.interp(t, np.arange(len(samples)), samples).astype(np.float32)
+            return samples
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    try:
+        out = subprocess.run([ffmpeg, "-v", "quiet", "-i", path, "-t", str(seconds),
+                              "-ac", "1", "-ar", str(rate), "-f", "f32le", "-"],
+                             capture_output=True, timeout=120).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return np.frombuffer(out, np.float32) if out else None
+
+
+def decode_blocks(path, frames=65536):
+    """Mono float32 sample blocks of a whole file at its own rate, streamed.
+
+    Only one block is in memory at a time; yields nothing if the file
+    cannot be decoded.
+    """
+    import numpy as np
+    if path.lower().endswith(".wav"):
+        try:
+            w = wave.open(path, "rb")
+        except (wave.Error, EOFError, OSError):
+            w = None  # compressed WAV: let ffmpeg try
+        if w is not None:
+            with w:
+                width, channels = w.getsampwidth(), w.getnchannels()
+                while True:
+                    try:
+                        raw = w.readframes(frames)
+                    except (wave.Error, EOFError, OSError):
+                        return
+                    samples = _to_mono(raw, width, channels) if raw else None
+                    if samples is None:
+                        return
+                    yield samples
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return
+    try:
+        proc = subprocess.Popen([ffmpeg, "-v", "quiet", "-i", path, "-ac", "1", "-f", "f32le", "-"],
+                                stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    except OSError:
+        return
+    try:
+        while True:
+            raw = proc.stdout.read(frames * 4)
+            if len(raw) < 4:
+                return
+            yield np.frombuffer(raw[:len(raw) - len(raw) % 4], np.float32)
+    finally:
+        proc.kill()
+        proc.wait()
+        proc.stdout.close()
+
+
+def compute(samples, rate=SAMPLE_RATE):
+    """Feature vector (float32, FEATURE_DIM) for mono samples, or None if too short."""
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    if samples is None or len(samples) < N_FFT * 4:
+        return None
+    frames = sliding_window_view(samples, N_FFT)[::HOP]  # a view, no copy
+    spec = np.abs(np.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1)).astype(np.float32)
+    freqs = np.fft.rfftfreq(N_FFT, 1 / rate).astype(np.float32)
+
+    energy = spec.sum(axis=1) + 1e-9
+    centroid = (spec @ freqs) / energy / (rate / 2)
+    rms = np.sqrt(np.einsum("ij,ij->i", frames, frames) / N_FFT)
+
+    # tempo: autocorrelation of the onset envelope (positive spectral flux)
+    flux = np.maximum(np.diff(spec, axis=0), 0).sum(axis=1)
+    flux -= flux.mean()
+    n = len(flux)
+    ac = np.fft.irfft(np.abs(np.fft.rfft(flux, 2 * n)) ** 2)[:n]
+    fps = rate / HOP
+    lags = np.arange(int(fps * 60 / 200), min(n - 1, int(fps * 60 / 60)) + 1)
+    if len(lags) and ac[0] > 0:
+        best = lags[np.argmax(ac[lags])]
+        bpm, strength = 60 * fps / best, ac[best] / ac[0]
+    else:
+        bpm, strength = 0.0, 0.0
+
+    # chroma: fold the spectrum from A1 to ~5 kHz onto the 12 pitch classes
+    band = (freqs >= 55) & (freqs <= 5000)
+    pitch = np.rint(12 * np.log2(freqs[band] / 440) + 69).astype(int) % 12
+    chroma = np.bincount(pitch, weights=spec[:, band].sum(axis=0), minlength=12)
+    chroma /= chroma.sum() or 1
+
+    return np.array([centroid.mean(), centroid.std(), rms.mean(), rms.std(),
+                     bpm / 200, strength, *chroma], dtype=np.float32)
+
+
+def extract(path):
+    try:
+        return compute(decode(path))
+    except (ValueError, MemoryError):
+        return None
+
+
+def extract_chunk(paths):
+    # runs in a worker process (see MetadataExtractor's `reader`)
+    return [(path, extract(path)) for path in paths]
+
+
+class FeatureStore:
+    """Feature vectors in a memory-mapped float32 matrix, row = song id.
+
+    Rows never computed (or forgotten) are NaN. Search works on a
+    standardised, weighted copy of the valid rows plus their squared norms,
+    rebuilt lazily after writes, so k-NN is one matrix-vector product and an
+    argpartition. The lock makes it safe to search from the playback thread
+    while the Tk thread stores new vectors.
+    """
+
+    def __init__(self, path=FEATURES_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self._matrix = None
+        self._index = None  # (ids, row of each id or -1, weighted standardised rows, squared norms)
+        self._buf = None    # distance rows for one block of queries
+
+    def _open(self, create=True):
+        """The mapped matrix; None if there is no file yet and `create` is off."""
+        import numpy as np
+        if self._matrix is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            try:
+                matrix = np.load(self.path, mmap_mode="r+")
+            except (OSError, ValueError):
+                matrix = None
+            if matrix is not None and (matrix.ndim != 2 or matrix.shape[1] != FEATURE_DIM
+                                       or matrix.dtype != np.float32):
+                del matrix  # unmap before _create replaces the file
+                matrix = None
+            if matrix is None:
+                matrix = self._create(1024)
+            self._matrix = matrix
+        return self._matrix
+
+    def _create(self, rows, old=None):
+        import numpy as np
+        tmp = self.path + ".tmp"
+        matrix = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(rows, FEATURE_DIM))
+        matrix[:] = np.nan
+        if old is not None:
+            matrix[:len(old)] = old
+        matrix.flush()
+        del matrix
+        os.replace(tmp, self.path)
+        return np.load(self.path, mmap_mode="r+")
+
+    def has(self, song_id):
+        with self.lock:
+            matrix = self._open(create=False)
+            return matrix is not None and song_id < len(matrix) and matrix[song_id, 0] == matrix[song_id, 0]  # not NaN
+
+    def missing(self, songs):
+        """The songs that have no feature vector yet."""
+        import numpy as np
+        with self.lock:
+            matrix = self._open(create=False)
+            known = ~np.isnan(matrix[:, 0]) if matrix is not None else ()
+            return [s for s in songs if s.id is not None and not (s.id < len(known) and known[s.id])]
+
+    def put_many(self, items):
+        """Store [(song_id, vector), ...]."""
+        import numpy as np
+        items = [(i, v) for i, v in items if v is not None]
+        if not items:
+            return
+        with self.lock:
+            matrix = self._open()
+            top = max(i for i, _ in items)
+            if top >= len(matrix):
+                # copy the rows out and unmap the old file before _create
+                # replaces it (Windows refuses to replace a mapped file)
+                rows = max(top + 1, len(matrix) * 2)
+                old = np.array(matrix)
+                matrix.flush()
+                self._matrix = None
+                del matrix
+                matrix = self._matrix = self._create(rows, old=old)
+                del old
+            ids = np.fromiter((i for i, _ in items), dtype=np.int64, count=len(items))
+            matrix[ids] = np.stack([v for _, v in items])
+            self._index = None
+
+    def forget(self, song_ids):
+        import numpy as np
+        with self.lock:
+            matrix = self._open(create=False)
+            if matrix is None:
+                return
+            ids = [i for i in song_ids if i is not None and i < len(matrix)]
+            if ids:
+                matrix[ids] = np.nan
+                self._index = None
+
+    def flush(self):
+        with self.lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+
+    def _search_index(self):
+        import numpy as np
+        if self._index is None:
+            matrix = self._open(create=False)
+            if matrix is None:
+                matrix = np.empty((0, FEATURE_DIM), dtype=np.float32)
+            ids = np.flatnonzero(~np.isnan(matrix[:, 0]))
+            rows = np.asarray(matrix[ids], dtype=np.float32)
+            if len(rows):
+                std = rows.std(axis=0)
+                std[std == 0] = 1
+                rows = (rows - rows.mean(axis=0)) / std * np.asarray(WEIGHTS, dtype=np.float32)
+            rows = np.ascontiguousarray(rows, dtype=np.float32)
+            position = np.full(len(matrix), -1, dtype=np.int64)
+            position[ids] = np.arange(len(ids))
+            self._index = (ids, position, rows, np.einsum("ij,ij->i", rows, rows))
+        return self._index
+
+    def similar(self, song_id, k=25):
+        """[(song_id, distance)] of the k nearest tracks, nearest first."""
+        return self.similar_many([song_id], k)[0]
+
+    def similar_many(self, song_ids, k=25):
+        """similar() for many seeds at once, in blocks of QUERY_BLOCK queries."""
+        import numpy as np
+        with self.lock:
+            ids, position, rows, norms = self._search_index()
+            results = [[] for _ in song_ids]
+            wanted = [(n, int(position[s])) for n, s in enumerate(song_ids)
+                      if s is not None and 0 <= s < len(position) and position[s] >= 0]
+            k = min(k, len(ids) - 1)
+            if k <= 0:
+                return results
+            block_size = min(QUERY_BLOCK, len(wanted))
+            if self._buf is None or len(self._buf) < block_size or self._buf.shape[1] != len(rows):
+                # reused across calls: fresh multi-MB temporaries cost more than the math
+                self._buf = np.empty((block_size, len(rows)), dtype=np.float32)
+            for start in range(0, len(wanted), QUERY_BLOCK):
+                block = wanted[start:start + QUERY_BLOCK]
+                q = rows[[p for _, p in block]]
+                dist = self._buf[:len(block)]
+                # |r - q|^2 = |r|^2 - 2 r.q + |q|^2; the last term is constant per query
+                np.matmul(q, rows.T, out=dist)
+                dist *= -2
+                dist += norms
+                for (n, p), d, qn in zip(block, dist, np.einsum("ij,ij->i", q, q)):
+                    d[p] = np.inf  # not the seed itself
+                    nearest = np.argpartition(d, k)[:k]
+                    nearest = nearest[np.argsort(d[nearest])]
+                    results[n] = [(int(ids[i]), float(d[i] + qn)) for i in nearest]
+            return results
+
+
+class Radio:
+    """Endless "more like this" queue for the playback engine.
+
+    Starting from a seed song, each refill takes the nearest neighbours of
+    the song playing now (so the station drifts), skips anything played
+    recently, and queues a few of them picked at random from the closest.
+    peek/pop are called on the engine thread.
+    """
+
+    def __init__(self, store, resolve, seed, k=25, batch=4, memory=100):
+        self.store = store
+        self.resolve = resolve  # song id -> Song in the library, or None
+        self.k = k
+        self.batch = batch
+        self.recent = deque([seed.id], maxlen=memory)
+        self.last = seed
+        self._queue = deque()
+        self._rng = random.Random()
+
+    def _refill(self):
+        played = set(self.recent)
+        found = [self.resolve(i) for i, _ in self.store.similar(self.last.id, self.k + len(played))
+                 if i not in played]
+        found = [s for s in found if s is not None][:self.k]
+        if not found:
+            return
+        # mostly the very closest, with a little variety
+        picks = self._rng.sample(found[:self.batch * 2], min(self.batch, len(found)))
+        self._queue.extend(picks)
+
+    def peek(self):
+        if not self._queue:
+            self._refill()
+        return self._queue[0] if self._queue else None
+
+    def pop(self):
+        song = self.peek()
+        if song is not None:
+            self._queue.popleft()
+            self.played(song)
+        return song
+
+    def played(self, song):
+        self.last = song
+        self.recent.append(song.id)
@@ -0,0 +1,181 @@
+# history.py
+import heapq
+import json
+import time
+from collections import Counter, deque
+
+from journal import Journal
+from song import Song
+from writer import write_json_atomic
+
+HISTORY_FILE = "history.log"
+SNAPSHOT_FILE = "history.json"
+COMPACT_AFTER = 5000  # plays logged before they are folded into the snapshot
+RECENT_SIZE = 200   # plays kept in memory / shown in the history list
+KEEP_DAYS = 31      # per-day counts older than this are dropped
+DAY = 86400
+
+
+class PlayHistory:
+    """Bounded recent plays plus running aggregates over an append-only log.
+
+    Every play is one JSON line in history.log. In memory only the last
+    `size` plays are kept (a ring buffer, for the history list), along with
+    counters that each play bumps in O(1): plays per track and per artist,
+    last-played time, and per-day counts for the last KEEP_DAYS days. Those
+    answer "most played this week" without rereading the log.
+
+    Every COMPACT_AFTER plays the log is sealed into a journal segment and
+    the ring plus the counters are written to history.json, which records
+    the segment it covers; the segment is deleted once the snapshot is on
+    disk. Startup reads the snapshot and replays only the plays logged
+    since, instead of the whole history. `writer` (a PersistWriter) writes
+    the snapshot off the caller's thread; without one it is written inline.
+    """
+
+    def __init__(self, path=HISTORY_FILE, size=RECENT_SIZE, resolve=None,
+                 snapshot_path=SNAPSHOT_FILE, writer=None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.writer = writer
+        self.size = size
+        # filepath -> Song, so history entries share the library's objects
+        self.resolve = resolve or (lambda path: None)
+        self.recent = deque(maxlen=size)  # Song objects, oldest first
+        self.track_counts = Counter()     # filepath -> plays
+        self.artist_counts = Counter()    # artist -> plays
+        self.last_played = {}             # filepath -> unix time
+        self._days = {}                   # day number -> (track Counter, artist Counter)
+        self._info = {}                   # filepath -> (title, artist) as last played
+        self._recent_paths = None         # filled while replaying the log
+        self._log = None
+        self._seq = 0                     # last log segment a snapshot covers
+
+    def load(self):
+        """Rebuild the aggregates from the snapshot and the log, and open it for appending."""
+        self._recent_paths = deque(maxlen=self.size)
+        self._load_snapshot()
+        self._log = Journal(self.path)
+        # segments sealed before the snapshot on disk are already counted in it
+        self._log.discard_through(self._seq)
+        for entry in self._log.entries():
+            self._count(entry["path"], entry["title"], entry["artist"], entry["t"])
+        self.recent.extend(self._song(path) for path in self._recent_paths)
+        self._recent_paths = None
+        if self._log.count >= COMPACT_AFTER:
+            self.compact()  # e.g. a long log from before snapshots existed
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._seq = data["seq"]
+        self.track_counts.update(data["tracks"])
+        self.artist_counts.update(data["artists"])
+        self.last_played.update(data["last"])
+        self._info = {path: tuple(info) for path, info in data["info"].items()}
+        self._days = {int(day): (Counter(tracks), Counter(artists))
+                      for day, (tracks, artists) in data["days"].items()}
+        self._recent_paths.extend(data["recent"])
+
+    def snapshot(self):
+        """The ring and the counters as plain JSON data (copied, safe to hand to a writer)."""
+        return {
+            "seq": self._seq,
+            "tracks": dict(self.track_counts),
+            "artists": dict(self.artist_counts),
+            "last": dict(self.last_played),
+            "info": {path: list(info) for path, info in self._info.items()},
+            "days": {day: [dict(tracks), dict(artists)]
+                     for day, (tracks, artists) in self._days.items()},
+            "recent": [song.filepath for song in self.recent],
+        }
+
+    def compact(self):
+        """Fold the log into a fresh snapshot; the sealed segment goes once it is on disk."""
+        self._seq = seq = self._log.rotate(after=self._seq)
+        log = self._log
+
+        def written(path):
+            log.discard_through(seq)
+
+        if self.writer:
+            self.writer.request(self.snapshot_path, self.snapshot(), on_written=written)
+        else:
+            write_json_atomic(self.snapshot_path, self.snapshot())
+            written(self.snapshot_path)
+
+    def record(self, song, when=None):
+        """Log one play of `song`."""
+        when = time.time() if when is None else when
+        self._count(song.filepath, song.title, song.artist, when)
+        self.recent.append(song)
+        if self._log:
+            self._log.append("play", path=song.filepath, title=song.title,
+                             artist=song.artist, t=when)
+            if self._log.count >= COMPACT_AFTER:
+                self.compact()
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    def _count(self, path, title, artist, when):
+        self.track_counts[path] += 1
+        self.artist_counts[artist] += 1
+        self.last_played[path] = when
+        self._info[path] = (title, artist)
+        day = int(when // DAY)
+        bucket = self._days.get(day)
+        if bucket is None:
+            bucket = self._days[day] = (Counter(), Counter())
+            for old in [d for d in self._days if d <= day - KEEP_DAYS]:
+                del self._days[old]
+        bucket[0][path] += 1
+        bucket[1][artist] += 1
+        if self._recent_paths is not None:
+            self._recent_paths.append(path)
+
+    def _song(self, path):
+        song = self.resolve(path)
+        if song is None:
+            title, artist = self._info[path]
+            song = Song(title, artist, path)
+        return song
+
+    # ---------- queries ----------
+    def play_count(self, song):
+        return self.track_counts[song.filepath]
+
+    def artist_play_count(self, artist):
+        return self.artist_counts[artist]
+
+    def last_played_at(self, song):
+        return self.last_played.get(song.filepath)
+
+    def _window(self, days):
+        today = int(time.time() // DAY)
+        tracks, artists = Counter(), Counter()
+        for day in range(today - days + 1, today + 1):
+            bucket = self._days.get(day)
+            if bucket:
+                tracks.update(bucket[0])
+                artists.update(bucket[1])
+        return tracks, artists
+
+    def most_played(self, n=10, days=None):
+        """[(Song, plays)] for the top tracks, all-time or over the last `days` days."""
+        counts = self.track_counts if days is None else self._window(min(days, KEEP_DAYS))[0]
+        return [(self._song(path), plays)
+                for path, plays in heapq.nlargest(n, counts.items(), key=lambda kv: kv[1])]
+
+    def most_played_this_week(self, n=10):
+        return self.most_played(n, days=7)
+
+    def top_artists(self, n=10, days=None):
+        """[(artist, plays)], all-time or over the last `days` days."""
+        counts = self.artist_counts if days is None else self._window(min(days, KEEP_DAYS))[1]
+        return heapq.nlargest(n, counts.items(), key=lambda kv: kv[1])
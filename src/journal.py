@@ -0,0 +1,82 @@
+# journal.py
+import glob
+import json
+import os
+
+JOURNAL_FILE = "journal.log"
+
+
+class Journal:
+    """Append-only log of library/playlist edits, one JSON object per line.
+
+    `rotate` moves the live log to a numbered segment (journal.log.1, .2, ...)
+    so a snapshot can be written while new edits keep appending; once the
+    snapshot is safely on disk `discard_through` deletes the covered segments.
+    Replay reads the segments in order and then the live log. Every op is
+    written to be idempotent, so replaying a segment that a finished snapshot
+    already contains is harmless.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.count = 0  # entries in the live log
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell():
+            with open(path, "r", encoding="utf-8") as f:
+                self.count = sum(1 for _ in f)
+
+    def append(self, op, **fields):
+        fields["op"] = op
+        self._file.write(json.dumps(fields) + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def _segments(self):
+        segments = []
+        for path in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = path.rsplit(".", 1)[1]
+            if suffix.isdigit():
+                segments.append((int(suffix), path))
+        return sorted(segments)
+
+    def entries(self):
+        """Yield every logged op, oldest first."""
+        for _, path in self._segments():
+            yield from self._read(path)
+        yield from self._read(self.path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except OSError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # torn write from a crash: the rest of this line is lost
+                    continue
+
+    def rotate(self, after=0):
+        """Seal the live log into a new segment; returns its sequence number.
+
+        Numbers keep rising past `after` too, so a caller can tell segments
+        sealed later from ones an older snapshot already covered.
+        """
+        self._file.close()
+        segments = self._segments()
+        seq = max(segments[-1][0] if segments else 0, after) + 1
+        os.replace(self.path, f"{self.path}.{seq}")
+        self._file = open(self.path, "a", encoding="utf-8")
+        self.count = 0
+        return seq
+
+    def discard_through(self, seq):
+        for n, path in self._segments():
+            if n <= seq:
+                os.remove(path)
+
+    def close(self):
+        self._file.close()
@@ -1,42 +1,532 @@
 # library.py
 import os
-from song import Song
+import queue
+import sys
+import threading
+import time
+from itertools import filterfalse
+from song import Song, SongTable
+from scanner import LibraryScanner, walk
+from metadata import MetadataExtractor, read_metadata
+from features import HAS_NUMPY, FeatureStore, extract_chunk
+from loudness import analyze_chunk
+from waveform import WaveformStore
+from metacache import MetadataCache
+from search import SearchIndex
+from dupes import DuplicateFinder
+from smart import ALL, META
+import perf
+import watcher
+
+SCAN_POLL_MS = 50
+MAX_BATCHES_PER_TICK = 4
+INDEX_CHUNK = 500  # songs search-indexed per idle tick after startup
+SEARCH_LIMIT = 500      # rows a search shows; more matches ask for a longer query
+SEARCH_DEBOUNCE_MS = 120  # typing pause before the search runs
+WATCH_POLL_MS = 250  # how often the UI checks for filesystem watch events
+
+
+def song_from_path(filepath):
+    title = os.path.splitext(os.path.basename(filepath))[0]
+    return Song(title=title, artist="Unknown", filepath=filepath)
 
-SUPPORTED_EXT = (".mp3", ".wav", ".flac", ".ogg")
 
 def load_from_folder(folder_path):
-    """Load songs from a folder (returns list of Song)."""
-    songs = []
-    for file in os.listdir(folder_path):
-        if file.lower().endswith(SUPPORTED_EXT):
-            title = os.path.splitext(file)[0]
-            songs.append(Song(title=title, artist="Unknown", filepath=os.path.join(folder_path, file)))
-    return songs
+    """Load songs from a folder tree (returns list of Song)."""
+    return [song_from_path(path) for path, _, _ in walk(folder_path)]
 
 
 class LibraryManager:
     def __init__(self, app):
         self.app = app  # keep reference to MusicApp for UI + persistence
         self.songs = []
+        self.by_path = {}       # library membership; filepath -> Song
+        self.table = SongTable()  # every song the library or a playlist refers to
+        self.scanner = LibraryScanner()
+        self.metadata = MetadataExtractor()
+        self.cache = MetadataCache()
+        self.search = SearchIndex()
+        self.query = ""
+        self.displayed = self.songs  # what the library view currently shows
+        self._scan_poll_id = None
+        self._unindexed = []  # added with index_later, not yet searchable
+        self._index_id = None
+        self._query_id = None
+        self.folders = []     # every folder loaded, kept across runs
+        self.watching = False
+        self._watchers = {}   # folder -> running watcher
+        self._watch_poll_id = None
+        self.dupes = DuplicateFinder(self.cache, self.scanner.results)
+        self.features = FeatureStore()  # audio feature vectors for radio mode
+        self.waveforms = WaveformStore()  # seek bar overviews
+        self.analyzer = MetadataExtractor(chunk_size=4, reader=extract_chunk, tag="features")
+        self.loudness = MetadataExtractor(chunk_size=2, reader=analyze_chunk, tag="loudness")
+        self._loudness_total = 0  # files queued in the current loudness run
+        self.dupe_groups = {}   # content digest -> [filepaths], first one is kept
+        self.content_of = {}    # filepath -> content digest, for duplicates only
+        self.collapse_dupes = False
 
-    def load_folder(self, folder):
-        self.songs = load_from_folder(folder)
-        self.display_library()
-        self.app.persist.save_library()
+    def add_songs(self, songs, index_later=False):
+        """Add new songs; `index_later` defers search indexing to idle time.
 
-    def display_library(self, songs=None):
-        self.app.library_listbox.delete(0, "end")
-        songs = songs or self.songs
+        Returns the songs that were not in the library yet.
+        """
+        new = []
+        now = time.time()
         for song in songs:
-            self.app.library_listbox.insert("end", f"{song.title} - {song.artist}")
+            song = self.table.add(song)  # reuse the Song a playlist may already hold
+            if song.filepath not in self.by_path:
+                self.by_path[song.filepath] = song
+                self.songs.append(song)
+                new.append(song)
+                if song.added is None:
+                    song.added = now
+        self.app.smart_playlists.update(new, ALL)
+        if index_later:
+            self._unindexed.extend(new)
+            if not self._index_id:
+                self._index_id = self.app.root.after_idle(self._index_some)
+        else:
+            self.search.add_many(new)
+        return new
+
+    def _index_some(self, limit=INDEX_CHUNK):
+        chunk = self._unindexed[-limit:]
+        del self._unindexed[-limit:]
+        # skip songs removed since they were queued
+        self.search.add_many(s for s in chunk if self.by_path.get(s.filepath) is s)
+        self._index_id = None
+        if self._unindexed:
+            self._index_id = self.app.root.after(1, self._index_some)
+        elif self.query:
+            self.display_library(keep_selection=True)  # the search now covers everything
+
+    def verify_exists(self, paths):
+        """Drop songs whose files are gone, streaming removals into the view."""
+        self.scanner.check_exists(paths)
+        self._schedule_poll()
+
+    def remove_paths(self, paths):
+        """Drop songs from the library by filepath in one pass; returns them as a set."""
+        gone = set()
+        for path in set(paths):
+            song = self.by_path.pop(path, None)
+            if song:
+                self.search.remove(song)
+                gone.add(song)
+        if not gone:
+            return gone
+        self._forget_dupes(song.filepath for song in gone)
+        self.app.smart_playlists.remove_songs(gone)
+        # one pass in C however many songs go (list.remove would rescan per song)
+        self.songs[:] = filterfalse(gone.__contains__, self.songs)
+        return gone
+
+    # ---------- audio features ----------
+    def analyze_features(self, songs=None):
+        """Compute feature vectors for songs that have none; returns how many were queued."""
+        if not HAS_NUMPY:
+            return 0
+        todo = self.features.missing(self.songs if songs is None else songs)
+        self.analyzer.submit(s.filepath for s in todo)
+        self._schedule_poll()
+        return len(todo)
+
+    # ---------- loudness ----------
+    def analyze_loudness(self):
+        """Measure every library song without a gain; returns how many were queued.
+
+        Results go to the cache as they arrive, so an interrupted run picks up
+        where it stopped.
+        """
+        if not HAS_NUMPY:
+            return 0
+        todo = [s.filepath for s in self.songs if s.gain is None]
+        if not self.loudness.is_busy():
+            self._loudness_total = 0
+        self._loudness_total += len(todo)
+        self.loudness.submit(todo)
+        self._schedule_poll()
+        return len(todo)
+
+    def load_gains(self):
+        """Read cached gains on a background thread; applied via the scan queue."""
+        def run():
+            self.scanner.results.put(("gains", self.cache.all_loudness()))
+        threading.Thread(target=run, daemon=True).start()
+        self._schedule_poll()
+
+    def _apply_gains(self, rows):
+        index = self.scanner.index
+        for path, (mtime, size, gain) in rows.items():
+            song = self.by_path.get(path)
+            # stale rows (file changed since it was measured) are left for the next run
+            if song is not None and index.get(path) == (mtime, size):
+                song.gain = gain if gain is not None else 0.0
+        self.app.engine.refresh_upcoming()
+
+    def library_song(self, song_id):
+        """The library's Song with this id, or None if it is not in the library."""
+        song = self.table.get(song_id)
+        return song if song is not None and self.by_path.get(song.filepath) is song else None
+
+    # ---------- duplicates ----------
+    def find_duplicates(self):
+        """Hash the library's files in the background and group identical audio."""
+        entries = [(path, *stat) for path, stat in self.scanner.index.items() if path in self.by_path]
+        if self.dupes.start(entries):
+            self.app.library_status.config(text=f"Checking {len(entries)} files for duplicates...")
+            self._schedule_poll()
+
+    def set_collapse_dupes(self, enabled):
+        """Show one row per group of identical tracks in the library view."""
+        self.collapse_dupes = enabled
+        self.display_library()
+
+    def content_key(self, song):
+        """What makes two songs the same track: their audio, if hashed, else the path."""
+        return self.content_of.get(song.filepath, song.filepath)
+
+    def _apply_duplicates(self, groups, stats):
+        self.dupe_groups, self.content_of = {}, {}
+        for digest, paths in groups.items():
+            # keep the copy that was in the library first
+            paths.sort(key=lambda p: self.by_path[p].id if p in self.by_path else 0)
+            self.dupe_groups[digest] = paths
+            for path in paths:
+                self.content_of[path] = digest
+        extra = sum(len(paths) - 1 for paths in groups.values())
+        self.app.library_status.config(
+            text=f"{len(groups)} duplicated tracks ({extra} extra copies) in {stats['files']} files, "
+                 f"{stats['full']} fully hashed, {stats['seconds']:.1f}s")
+
+    def _forget_dupes(self, paths):
+        for path in paths:
+            digest = self.content_of.pop(path, None)
+            if digest is None:
+                continue
+            group = self.dupe_groups[digest]
+            group.remove(path)
+            if len(group) < 2:
+                del self.dupe_groups[digest]
+                self.content_of.pop(group[0], None)
+
+    def set_query(self, text):
+        """Search for `text` once typing pauses for SEARCH_DEBOUNCE_MS."""
+        self.query = text
+        if self._query_id:
+            self.app.root.after_cancel(self._query_id)
+        self._query_id = self.app.root.after(SEARCH_DEBOUNCE_MS, self._run_query)
+
+    def _run_query(self):
+        self._query_id = None
+        self.display_library()
+
+    def load_folder(self, folder):
+        """Scan (or rescan) a folder in the background and merge the results."""
+        folder = os.path.abspath(folder)
+        if folder not in self.folders:
+            self.folders.append(folder)
+            self.app.persist.log_library_folder(folder)
+        self.scanner.start(folder)
+        self._schedule_poll()
+        if self.watching:
+            self._start_watch(folder)
+
+    # ---------- watch mode ----------
+    def set_watching(self, enabled):
+        """Follow changes under every loaded folder (inotify, else polling)."""
+        self.watching = enabled
+        if enabled:
+            for folder in self.folders:
+                self._start_watch(folder)
+            if not self._watch_poll_id:
+                self._watch_poll_id = self.app.root.after(WATCH_POLL_MS, self._poll_watch)
+        else:
+            self.stop_watching()
+
+    def stop_watching(self):
+        for w in self._watchers.values():
+            w.stop()
+        self._watchers.clear()
+        if self._watch_poll_id:
+            self.app.root.after_cancel(self._watch_poll_id)
+            self._watch_poll_id = None
+
+    def _start_watch(self, folder):
+        if folder not in self._watchers and os.path.isdir(folder):
+            # watchers feed the scanner's queue, so _poll_scan applies their batches
+            self._watchers[folder] = watcher.watch(folder, self.scanner.results)
+
+    def _poll_watch(self):
+        if not self.scanner.results.empty():
+            self._schedule_poll()
+        self._watch_poll_id = self.app.root.after(WATCH_POLL_MS, self._poll_watch)
+
+    def refresh_metadata(self, songs=None):
+        """Re-read tags for `songs` (default: whole library) in the background."""
+        songs = self.songs if songs is None else songs
+        self.metadata.submit(s.filepath for s in songs)
+        self._schedule_poll()
+
+    def metadata_for(self, song):
+        """Cached metadata for one song, parsing (and caching) the tags on a miss."""
+        meta = self.cache.get(song.filepath)
+        if meta is None:
+            meta = read_metadata(song.filepath)
+            if meta:
+                self.cache.put(song.filepath, meta)
+        return meta
+
+    def _schedule_poll(self):
+        if not self._scan_poll_id:
+            self._scan_poll_id = self.app.root.after(SCAN_POLL_MS, self._poll_scan)
+
+    def _poll_scan(self):
+        self._scan_poll_id = None
+        with perf.span("scan.tick"):
+            self._drain_results()
+        if (self.scanner.is_scanning() or self.metadata.is_busy() or self.dupes.is_busy()
+                or self.analyzer.is_busy() or not self.analyzer.results.empty()
+                or self.loudness.is_busy() or not self.loudness.results.empty()
+                or not self.scanner.results.empty() or not self.metadata.results.empty()):
+            self._scan_poll_id = self.app.root.after(SCAN_POLL_MS, self._poll_scan)
+
+    def _drain_results(self):
+        changed = False   # rows may show new text
+        regroup = False   # duplicate groups changed: the collapsed view is rebuilt
+        new, gone = [], set()
+        for _ in range(MAX_BATCHES_PER_TICK):
+            try:
+                msg = self.scanner.results.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "batch":
+                _, _, added, updated, removed = msg
+                if any(path not in self.by_path for path, _, _ in updated):
+                    # the watcher reports every rewrite as an update; files
+                    # the library never had are new to it
+                    added = added + [e for e in updated if e[0] not in self.by_path]
+                    updated = [e for e in updated if e[0] in self.by_path]
+                self.scanner.apply(added, updated, removed)
+                batch_new, batch_gone, touched = self._apply_scan_batch(added, updated, removed)
+                new += batch_new
+                gone |= batch_gone
+                if removed:
+                    self.cache.delete_many(removed)
+                    self.app.persist.log_library_remove(removed)
+                if updated and HAS_NUMPY:
+                    # the audio may have changed; features are recomputed on demand
+                    self.features.forget(self.by_path[path].id for path, _, _ in updated
+                                         if path in self.by_path)
+                for path, _, _ in updated:
+                    if path in self.by_path:
+                        self.by_path[path].gain = None
+                self.waveforms.forget(self.by_path[path].id for path, _, _ in updated
+                                      if path in self.by_path)
+                # Only files the cache has not seen at this mtime/size get parsed
+                hits, misses = self.cache.get_many(added + updated)
+                self._apply_metadata(hits.items())
+                self.metadata.submit(misses)
+                if touched:
+                    self.app.persist.log_library_put(touched)
+                changed = True
+            elif msg[0] == "done":
+                self.scanner.start_next()
+            elif msg[0] == "rename":
+                self._apply_renames(msg[2])
+                changed = True
+            elif msg[0] == "remove_tree":
+                prefix = os.path.join(msg[2], "")
+                gone = [p for p in self.scanner.index if p.startswith(prefix)]
+                if gone:
+                    self.scanner.results.put(("batch", msg[1], [], [], gone))
+            elif msg[0] == "rescan":
+                self.scanner.start(msg[1])
+            elif msg[0] == "dupes":
+                self._apply_duplicates(msg[1], msg[2])
+                regroup = True
+            elif msg[0] == "dupes_error":
+                self.app.library_status.config(text=f"Duplicate check failed: {msg[1]}")
+            elif msg[0] == "gains":
+                self._apply_gains(msg[1])
+        for _ in range(MAX_BATCHES_PER_TICK):
+            try:
+                msg = self.metadata.results.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "meta":
+                songs = self._apply_metadata(msg[1])
+                self.cache.put_many((path, meta, self.scanner.index.get(path))
+                                    for path, meta in msg[1])
+                if songs:
+                    self.app.persist.log_library_put(songs)
+                changed = True
+            self._show_metadata_status()
+        for _ in range(MAX_BATCHES_PER_TICK):
+            try:
+                msg = self.analyzer.results.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "features":
+                self.features.put_many((self.by_path[path].id, vector)
+                                       for path, vector in msg[1] if path in self.by_path)
+            self.app.library_status.config(
+                text=f"Audio analysis: {self.analyzer.processed} files, {self.analyzer.throughput():.1f} files/s")
+        for _ in range(MAX_BATCHES_PER_TICK):
+            try:
+                msg = self.loudness.results.get_nowait()
+            except queue.Empty:
+                break
+            if msg[0] == "loudness":
+                rows = []
+                for path, result in msg[1]:
+                    song = self.by_path.get(path)
+                    if song is not None:
+                        # unmeasurable files (silent, undecodable) play at 0 dB
+                        song.gain = result[2] if result else 0.0
+                    rows.append((path, self.scanner.index.get(path), result))
+                self.cache.put_loudness(rows)
+            self.app.library_status.config(
+                text=f"Loudness: {self.loudness.processed}/{self._loudness_total} files, "
+                     f"{self.loudness.throughput():.1f} files/s")
+        if regroup:
+            self.display_library(keep_selection=True)
+        elif changed:
+            self._update_view(new, gone)
+
+    def _apply_renames(self, pairs):
+        """Move songs to new paths in place: library, search, cache, playlists."""
+        moved, added, retitled = [], [], []
+        with self.app.engine.lock:
+            for old, new in pairs:
+                song = self.table.find(old)
+                if song is None or self.table.find(new) is not None:
+                    added.append(new)  # unknown before, or replaces a known file
+                    continue
+                self.table.rename(song, new)
+                if self.by_path.pop(old, None) is song:
+                    self.by_path[new] = song
+                stat = self.scanner.index.pop(old, None)
+                if stat:
+                    self.scanner.index[new] = stat
+                digest = self.content_of.pop(old, None)
+                if digest:
+                    self.content_of[new] = digest
+                    group = self.dupe_groups[digest]
+                    group[group.index(old)] = new
+                for playlist in self.app.playlists.values():
+                    playlist.rename(old, new)
+                self.app.party_queue.rename(old, new)
+                # an untagged song is titled after its file
+                if song.title == os.path.splitext(os.path.basename(old))[0]:
+                    song.title = os.path.splitext(os.path.basename(new))[0]
+                    if new in self.by_path:
+                        self.search.update(song)
+                        retitled.append(song)
+                moved.append((old, new))
+        self.app.smart_playlists.update(retitled, {META})
+        if moved:
+            self.cache.rename_many(moved)
+            self.app.persist.log_rename(moved)
+        if added:
+            entries = [e for e in map(watcher.stat_entry, added) if e]
+            self.scanner.results.put(("batch", None, entries, [], []))
+
+    def _apply_metadata(self, batch):
+        """Copy metadata dicts onto library songs; returns the songs updated."""
+        current = self.app.current_node.song if self.app.current_node else None
+        updated = []
+        for path, meta in batch:
+            song = self.by_path.get(path)
+            if not song or not meta:
+                continue
+            song.title = meta["title"]
+            song.artist = sys.intern(meta["artist"])
+            song.album = sys.intern(meta["album"])
+            song.track = meta["track"]
+            song.duration = meta["duration"]
+            updated.append(song)
+            if song is current and not self.app.current_length:
+                self.app.set_current_length(song.duration)
+        self.search.add_many(updated)  # re-index under the real tags
+        self.app.smart_playlists.update(updated, {META})
+        return updated
+
+    def _show_metadata_status(self):
+        self.app.library_status.config(
+            text=f"Metadata: {self.metadata.processed} files, {self.metadata.throughput():.0f} files/s")
+
+    def _apply_scan_batch(self, added, updated, removed):
+        """Merge one scanner batch.
+
+        Returns the songs added, the set of songs removed, and every added or
+        changed song still in the library.
+        """
+        new = self.add_songs(song_from_path(path) for path, _, _ in added)
+        gone = self.remove_paths(removed) if removed else set()
+        touched = [self.by_path[path] for path, _, _ in added + updated if path in self.by_path]
+        return new, gone, touched
+
+    def _update_view(self, new, gone):
+        """Bring the library view up to date after songs came and went.
+
+        A search is re-run (it is bounded), and the unfiltered view is the
+        song list itself, so neither re-filters the library. Only a view with
+        duplicates collapsed that lost songs is rebuilt, since a removal can
+        bring a hidden copy back.
+        """
+        displayed = self.displayed
+        if self.query or (gone and displayed is not self.songs):
+            self.display_library(keep_selection=True)
+            return
+        if displayed is not self.songs:
+            # collapsed view: new songs are not grouped yet, so all of them show
+            displayed.extend(new)
+        self.app.library_listbox.set_items(displayed, keep_selection=True)
+
+    def display_library(self, songs=None, keep_selection=False):
+        # The view is virtual: this only formats the rows currently on screen
+        if songs is None:
+            results = self._search() if self.query else None
+            songs = results if results is not None else self.songs
+            if self.collapse_dupes and self.content_of:
+                hidden = self.content_of
+                groups = self.dupe_groups
+                songs = [s for s in songs if s.filepath not in hidden
+                         or groups[hidden[s.filepath]][0] == s.filepath]
+        self.displayed = songs
+        self.app.library_listbox.set_items(songs, keep_selection=keep_selection)
+
+    def _search(self):
+        with perf.span("search.query"):
+            results = self.search.search(self.query, limit=SEARCH_LIMIT + 1)
+        if results is None:
+            return None
+        if len(results) > SEARCH_LIMIT:
+            del results[SEARCH_LIMIT:]
+            text = f"Search: showing the first {SEARCH_LIMIT} matches, type more to narrow it down"
+        else:
+            text = f"Search: {len(results)} matches"
+        if self._unindexed:
+            # indexing finishes in idle time; the results refresh when it does
+            text += f" (still indexing {len(self._unindexed)} songs)"
+        self.app.library_status.config(text=text)
+        return results
+
+    def song_at(self, index):
+        """Song behind a row of the library view (which may be filtered)."""
+        return self.displayed[index]
 
     def delete_song(self, indices):
-        for index in reversed(indices):
-            song = self.songs[index]
-            if (self.app.current_node and 
+        removed = []
+        for index in indices:
+            song = self.song_at(index)
+            if (self.app.current_node and
                 self.app.current_node.song.filepath == song.filepath):
-                self.app.player.stop()
-            del self.songs[index]
+                self.app.stop()
+            self.scanner.index.pop(song.filepath, None)
+            removed.append(song.filepath)
+        self.remove_paths(removed)
         self.display_library()
-        self.app.persist.save_library()
-
+        self.app.persist.log_library_remove(removed)
@@ -0,0 +1,160 @@
+# listview.py
+import tkinter as tk
+
+import perf
+
+
+class VirtualListbox(tk.Frame):
+    """A Listbox look-alike that only materialises the visible rows.
+
+    `set_items` takes any sequence (a list, or a view with __len__ and
+    __getitem__) and `formatter` turns an item into its row text; only the
+    `height` rows in view are ever formatted or inserted into Tk, and a redraw
+    only touches rows whose text changed. Selection is tracked by absolute
+    index, so curselection()/selection_set()/see() work like tk.Listbox.
+    """
+
+    def __init__(self, master, height=20, selectmode=tk.BROWSE, formatter=str, **kwargs):
+        bg = master.cget("bg")
+        super().__init__(master, bg=bg)
+        self.rows = height
+        self.selectmode = selectmode
+        self.formatter = formatter
+        self.items = []
+        self.top = 0
+        self._selected = set()
+        self._rendered = []  # row texts currently in the Tk listbox
+
+        self.listbox = tk.Listbox(self, height=height, selectmode=tk.BROWSE,
+                                  exportselection=False, **kwargs)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.listbox.bind("<Button-1>", self._on_click)
+        self.listbox.bind("<B1-Motion>", lambda e: "break")
+        self.listbox.bind("<MouseWheel>", self._on_wheel)
+        self.listbox.bind("<Button-4>", lambda e: self._scroll(-3))
+        self.listbox.bind("<Button-5>", lambda e: self._scroll(3))
+
+    # ---------- data ----------
+    def set_items(self, items, keep_selection=False):
+        self.items = items
+        if keep_selection:
+            self._selected = {i for i in self._selected if i < len(items)}
+        else:
+            self._selected.clear()
+        self.top = max(0, min(self.top, len(items) - self.rows))
+        self.refresh()
+
+    def refresh(self):
+        """Redraw the visible window, rewriting only rows whose text changed."""
+        with perf.span("ui.redraw"):
+            self._refresh()
+
+    def _refresh(self):
+        end = min(len(self.items), self.top + self.rows)
+        texts = [self.formatter(self.items[i]) for i in range(self.top, end)]
+        lb = self.listbox
+        if len(self._rendered) > len(texts):
+            lb.delete(len(texts), tk.END)
+            del self._rendered[len(texts):]
+        for row, text in enumerate(texts):
+            if row < len(self._rendered):
+                if self._rendered[row] == text:
+                    continue
+                lb.delete(row)
+                self._rendered[row] = text
+            else:
+                self._rendered.append(text)
+            lb.insert(row, text)
+        lb.selection_clear(0, tk.END)
+        for i in self._selected:
+            if self.top <= i < end:
+                lb.selection_set(i - self.top)
+        self._update_scrollbar()
+
+    def refresh_rows(self, indices):
+        """Redraw specific rows if they are on screen."""
+        if any(self.top <= i < self.top + self.rows for i in indices):
+            self.refresh()
+
+    def size(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.formatter(self.items[index])
+
+    # ---------- selection ----------
+    def curselection(self):
+        return tuple(sorted(self._selected))
+
+    def selection_clear(self, first=0, last=None):
+        if last is None and first != 0:
+            self._selected.discard(first)
+        else:
+            self._selected.clear()
+        self.refresh()
+
+    def selection_set(self, index):
+        if self.selectmode != tk.MULTIPLE:
+            self._selected.clear()
+        self._selected.add(index)
+        self.refresh()
+
+    def see(self, index):
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.rows:
+            self.top = index - self.rows + 1
+        else:
+            return
+        self.refresh()
+
+    def bind(self, sequence=None, func=None, add=None):
+        # Selection events are generated on the frame; mouse/key events
+        # (e.g. double-click) come from the inner listbox.
+        if sequence == "<<ListboxSelect>>":
+            return super().bind(sequence, func, add)
+        return self.listbox.bind(sequence, func, add)
+
+    # ---------- events ----------
+    def _on_click(self, event):
+        self.listbox.focus_set()
+        index = self.top + self.listbox.nearest(event.y)
+        if index >= len(self.items):
+            return "break"
+        if self.selectmode == tk.MULTIPLE:
+            self._selected ^= {index}
+        else:
+            self._selected = {index}
+        self.refresh()
+        self.event_generate("<<ListboxSelect>>")
+        return "break"
+
+    def _on_wheel(self, event):
+        self._scroll(-1 if event.delta > 0 else 1)
+        return "break"
+
+    def _scroll(self, rows):
+        top = max(0, min(self.top + rows, len(self.items) - self.rows))
+        if top != self.top:
+            self.top = top
+            self.refresh()
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.items))
+            self.top = max(0, min(self.top, len(self.items) - self.rows))
+            self.refresh()
+        elif action == "scroll":
+            step = self.rows if unit == "pages" else 1
+            self._scroll(int(amount) * step)
+
+    def _update_scrollbar(self):
+        n = len(self.items)
+        if n <= self.rows:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.top / n, (self.top + self.rows) / n)
@@ -0,0 +1,166 @@
+# metacache.py
+import os
+import sqlite3
+import threading
+
+CACHE_FILE = "metadata.db"  # lives next to library.json
+
+FIELDS = ("title", "artist", "album", "track", "duration")
+
+
+class MetadataCache:
+    """SQLite cache of parsed tags keyed by (path, mtime, size).
+
+    A row is only trusted while the file's mtime and size still match what was
+    stored; a mismatch deletes the row, so stale entries invalidate themselves.
+    One connection is shared behind a lock so the scanner, metadata pipeline
+    and play path can all use the same cache.
+    """
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            " path TEXT PRIMARY KEY, mtime REAL, size INTEGER,"
+            " title TEXT, artist TEXT, album TEXT, track INTEGER, duration REAL)")
+        # content hashes for duplicate detection (see dupes.py), same invalidation
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY, mtime REAL, size INTEGER,"
+            " offset INTEGER, length INTEGER, partial TEXT, full TEXT)")
+        # loudness analysis (see loudness.py); gain is NULL for files that could not be measured
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS loudness ("
+            " path TEXT PRIMARY KEY, mtime REAL, size INTEGER,"
+            " lufs REAL, peak REAL, gain REAL)")
+        self._conn.commit()
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def get(self, path, stat=None):
+        """Return the cached metadata dict for `path`, or None on a miss."""
+        stat = stat or self._stat(path)
+        if stat is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime, size, title, artist, album, track, duration FROM meta WHERE path=?",
+                (path,)).fetchone()
+            if row is None:
+                return None
+            if (row[0], row[1]) != tuple(stat):
+                self._conn.execute("DELETE FROM meta WHERE path=?", (path,))
+                self._conn.commit()
+                return None
+        return dict(zip(FIELDS, row[2:]))
+
+    def get_many(self, entries):
+        """Look up [(path, mtime, size), ...]; returns ({path: meta}, [missed paths])."""
+        hits, misses, stale = {}, [], []
+        with self._lock:
+            for path, mtime, size in entries:
+                row = self._conn.execute(
+                    "SELECT mtime, size, title, artist, album, track, duration FROM meta WHERE path=?",
+                    (path,)).fetchone()
+                if row is not None and (row[0], row[1]) == (mtime, size):
+                    hits[path] = dict(zip(FIELDS, row[2:]))
+                else:
+                    if row is not None:
+                        stale.append((path,))
+                    misses.append(path)
+            if stale:
+                self._conn.executemany("DELETE FROM meta WHERE path=?", stale)
+                self._conn.commit()
+        return hits, misses
+
+    def put(self, path, meta, stat=None):
+        self.put_many([(path, meta, stat)])
+
+    def put_many(self, entries):
+        """Store [(path, meta, (mtime, size) or None), ...]."""
+        rows = []
+        for path, meta, stat in entries:
+            stat = stat or self._stat(path)
+            if stat is None or not meta:
+                continue
+            rows.append((path, stat[0], stat[1]) + tuple(meta[f] for f in FIELDS))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def get_hashes(self, entries):
+        """Cached hashes for [(path, mtime, size), ...] whose stat still matches.
+
+        Returns {path: [(offset, length), partial or None, full or None]}.
+        """
+        found = {}
+        with self._lock:
+            for path, mtime, size in entries:
+                row = self._conn.execute(
+                    "SELECT mtime, size, offset, length, partial, full FROM hashes WHERE path=?",
+                    (path,)).fetchone()
+                if row is not None and (row[0], row[1]) == (mtime, size):
+                    found[path] = [(row[2], row[3]), row[4], row[5]]
+        return found
+
+    def put_hashes(self, rows):
+        """Store [(path, mtime, size, (offset, length), partial, full), ...]."""
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(path, mtime, size, span[0], span[1], partial, full)
+                 for path, mtime, size, span, partial, full in rows])
+            self._conn.commit()
+
+    def all_loudness(self):
+        """{path: (mtime, size, gain)} for every analysed file (one table scan)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, mtime, size, gain FROM loudness").fetchall()
+        return {path: (mtime, size, gain) for path, mtime, size, gain in rows}
+
+    def put_loudness(self, rows):
+        """Store [(path, (mtime, size), (lufs, peak, gain) or None), ...]."""
+        values = []
+        for path, stat, result in rows:
+            stat = stat or self._stat(path)
+            if stat is not None:
+                values.append((path, stat[0], stat[1]) + tuple(result or (None, None, None)))
+        if not values:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?, ?)", values)
+            self._conn.commit()
+
+    def delete_many(self, paths):
+        with self._lock:
+            for table in ("meta", "hashes", "loudness"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE path=?", [(p,) for p in paths])
+            self._conn.commit()
+
+    def rename_many(self, pairs):
+        """Carry cached tags, hashes and gains over to moved files ([(old, new), ...])."""
+        with self._lock:
+            for table in ("meta", "hashes", "loudness"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE path=?", [(new,) for _, new in pairs])
+                self._conn.executemany(f"UPDATE {table} SET path=? WHERE path=?",
+                                       [(new, old) for old, new in pairs])
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,170 @@
+# metadata.py
+import importlib.util
+import itertools
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# mutagen is optional; without it every file falls back to filename metadata.
+# It is imported on first use, so startup does not pay for it.
+HAS_MUTAGEN = importlib.util.find_spec("mutagen") is not None
+
+
+def _first(tags, key):
+    value = tags.get(key) if tags else None
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value).strip() if value else None
+
+
+def _track_number(value):
+    # "3", "3/12" and "03" all mean track 3
+    try:
+        return int(str(value).split("/")[0])
+    except (TypeError, ValueError):
+        return 0
+
+
+def read_metadata(filepath):
+    """Read tags + duration for one file. Returns a dict or None."""
+    if not HAS_MUTAGEN:
+        return None
+    from mutagen import File as MutagenFile
+    try:
+        meta = MutagenFile(filepath, easy=True)
+    except Exception:
+        return None
+    if meta is None:
+        return None
+    tags = meta.tags
+    info = getattr(meta, "info", None)
+    return {
+        "title": _first(tags, "title") or os.path.splitext(os.path.basename(filepath))[0],
+        "artist": _first(tags, "artist") or "Unknown",
+        "album": _first(tags, "album") or "",
+        "track": _track_number(_first(tags, "tracknumber")),
+        "duration": float(getattr(info, "length", 0) or 0),
+    }
+
+
+def _read_chunk(paths):
+    return [(path, read_metadata(path)) for path in paths]
+
+
+class MetadataExtractor:
+    """Runs read_metadata over a process pool.
+
+    Paths are submitted in chunks from any number of `submit` calls; one
+    feeder thread owns the pool and streams ("meta", [(path, dict|None), ...])
+    messages onto `results` as chunks complete, so the Tk loop can apply them
+    incrementally. `throughput()` reports files/s over the current run.
+
+    Other per-file work can share the machinery: pass a module-level `reader`
+    (paths -> [(path, result), ...]) and the `tag` its messages carry.
+
+    A chunk whose reader raised comes back as ("failed", paths, error). If
+    the pool itself breaks (a worker killed, out of memory), everything in
+    flight or queued is reported that way and the run ends with "done" as
+    usual, so the next submit() starts a fresh pool.
+    """
+
+    def __init__(self, workers=None, chunk_size=64, reader=None, tag="meta"):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.chunk_size = chunk_size
+        self.reader = reader or _read_chunk
+        self.tag = tag
+        self.results = queue.Queue()
+        self.processed = 0
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._running = False
+        self._feeding = iter(())  # chunks the feeder thread is working through
+
+    def submit(self, paths):
+        paths = list(paths)
+        if not paths:
+            return
+        with self._lock:
+            self._jobs.put(paths)
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, daemon=True).start()
+
+    def is_busy(self):
+        return self._running
+
+    def throughput(self):
+        if not self._started_at:
+            return 0.0
+        elapsed = time.perf_counter() - self._started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def _chunks(self):
+        while True:
+            try:
+                paths = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            for i in range(0, len(paths), self.chunk_size):
+                yield paths[i:i + self.chunk_size]
+
+    def _run(self):
+        self._started_at = time.perf_counter()
+        self.processed = 0
+        in_flight = {}  # future -> its chunk of paths
+        try:
+            self._feed(in_flight)
+        except Exception as e:  # BrokenProcessPool, or the pool would not start
+            with self._lock:
+                lost = [path for chunk in in_flight.values() for path in chunk]
+                for chunk in itertools.chain(self._feeding, self._chunks()):
+                    lost.extend(chunk)
+                self.results.put(("failed", lost, e))
+                self.results.put(("done", self.processed, self.throughput()))
+                self._running = False
+
+    def _feed(self, in_flight):
+        # spawn, not fork: the parent is a threaded Tk process
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+            chunks = self._feeding = self._chunks()
+            pending = set()
+            while True:
+                # keep a bounded number of chunks in flight
+                while len(pending) < self.workers * 4:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        chunks = self._feeding = self._chunks()  # pick up newly submitted jobs
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                    future = pool.submit(self.reader, chunk)
+                    in_flight[future] = chunk
+                    pending.add(future)
+                if not pending:
+                    with self._lock:
+                        if self._jobs.empty():
+                            self.results.put(("done", self.processed, self.throughput()))
+                            self._running = False
+                            break
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = in_flight[future]
+                    try:
+                        batch = future.result()
+                    except BrokenProcessPool:
+                        raise  # every other future fails too; _run reports them
+                    except Exception as e:
+                        del in_flight[future]
+                        self.processed += len(chunk)
+                        self.results.put(("failed", chunk, e))
+                        continue
+                    del in_flight[future]
+                    self.processed += len(batch)
+                    self.results.put((self.tag, batch))
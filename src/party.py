@@ -0,0 +1,126 @@
+# party.py
+import heapq
+import itertools
+
+
+class PartyQueue:
+    """Indexed max-heap of upcoming songs ordered by upvotes.
+
+    Ties go to whichever song entered the queue first. `_pos` maps filepath to
+    heap slot, so a vote (`update`) or removal re-sifts one entry in O(log n)
+    instead of rebuilding the queue.
+    """
+
+    def __init__(self):
+        self._heap = []  # [-upvotes, seq, song]
+        self._pos = {}   # filepath -> index in _heap
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, filepath):
+        return filepath in self._pos
+
+    def clear(self):
+        self._heap = []
+        self._pos = {}
+
+    def extend(self, songs):
+        """Add many songs in O(n) with a single heapify."""
+        for song in songs:
+            if song.filepath not in self._pos:
+                self._pos[song.filepath] = len(self._heap)
+                self._heap.append([-song.upvotes, next(self._seq), song])
+        for i in reversed(range(len(self._heap) // 2)):
+            self._sift_down(i)
+
+    def push(self, song):
+        if song.filepath in self._pos:
+            return self.update(song)
+        self._heap.append([-song.upvotes, next(self._seq), song])
+        self._pos[song.filepath] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def peek(self):
+        return self._heap[0][2] if self._heap else None
+
+    def pop(self):
+        if not self._heap:
+            return None
+        song = self._heap[0][2]
+        self._remove_at(0)
+        return song
+
+    def remove(self, filepath):
+        i = self._pos.get(filepath)
+        if i is not None:
+            self._remove_at(i)
+
+    def rename(self, old, new):
+        i = self._pos.pop(old, None)
+        if i is not None:
+            self._pos[new] = i
+
+    def update(self, song):
+        """Re-position a song after its upvotes changed."""
+        i = self._pos.get(song.filepath)
+        if i is None:
+            return
+        entry = self._heap[i]
+        old = entry[0]
+        entry[0] = -song.upvotes
+        if entry[0] < old:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def ordered(self):
+        """Songs in play order (sorted copy, for display)."""
+        return [entry[2] for entry in sorted(self._heap, key=lambda e: (e[0], e[1]))]
+
+    def top(self, n):
+        """The first `n` songs in play order, without sorting the whole queue."""
+        return [entry[2] for entry in heapq.nsmallest(n, self._heap, key=lambda e: (e[0], e[1]))]
+
+    # ---------- heap internals ----------
+    def _remove_at(self, i):
+        heap = self._heap
+        del self._pos[heap[i][2].filepath]
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            self._pos[last[2].filepath] = i
+            self._sift_up(i)
+            self._sift_down(self._pos[last[2].filepath])
+
+    def _less(self, a, b):
+        return (a[0], a[1]) < (b[0], b[1])
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i][2].filepath] = i
+        self._pos[heap[j][2].filepath] = j
+
+    def _sift_up(self, i):
+        heap = self._heap
+        while i:
+            parent = (i - 1) // 2
+            if not self._less(heap[i], heap[parent]):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        heap = self._heap
+        n = len(heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._less(heap[child], heap[smallest]):
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
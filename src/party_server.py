@@ -0,0 +1,423 @@
+# party_server.py
+"""Guest voting for party mode: a small HTTP/WebSocket server on the LAN.
+
+Guests open http://<host>:8765/ on their phones, see what is playing and
+what is coming up, and vote or ask for a song to play next. Standard
+library asyncio only; the server runs on its own thread.
+
+    GET  /        the voting page
+    GET  /state   now playing, guest requests and upcoming songs (JSON)
+    POST /vote    {"id": song_id}
+    POST /next    {"id": song_id}: play it after the current song
+    GET  /ws      WebSocket: state is pushed on every change; send
+                  {"vote": song_id} or {"next": song_id}
+
+Votes are only counted on the server thread. Every VOTE_BATCH_MS the
+counts go to the Tk thread as one batch, so a flood of votes costs the UI
+one update per song per batch rather than one per vote.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import queue
+import socket
+import threading
+from collections import Counter
+
+import perf
+from smart import VOTES
+
+PORT = 8765
+VOTE_BATCH_MS = 200          # votes reach the queue at most this often
+STATE_REFRESH_MS = 2000      # state is also re-sent this often (host-side edits)
+STATE_SONGS = 200            # upcoming songs shown to guests
+MAX_GUEST_NEXT = 20          # guest play-next requests waiting at once
+MAX_HEADER = 8192
+MAX_BODY = 4096
+SEND_BUFFER_LIMIT = 1 << 20  # WebSocket clients this far behind are dropped
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+JSON = "application/json"
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+def lan_address():
+    """This machine's address on the local network, for the guest URL."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("10.255.255.255", 1))  # UDP: picks a route, sends nothing
+            return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+
+
+def _response(status, content_type, payload, keep_alive):
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Cache-Control: no-store\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + payload
+
+
+def ws_frame(payload, opcode=1, mask=None):
+    """One unfragmented WebSocket frame; clients must pass a 4-byte `mask`."""
+    n = len(payload)
+    bit = 0x80 if mask else 0
+    if n < 126:
+        head = bytes((0x80 | opcode, bit | n))
+    elif n < 1 << 16:
+        head = bytes((0x80 | opcode, bit | 126)) + n.to_bytes(2, "big")
+    else:
+        head = bytes((0x80 | opcode, bit | 127)) + n.to_bytes(8, "big")
+    if mask:
+        return head + mask + _unmask(payload, mask)
+    return head + payload
+
+
+def _unmask(payload, mask):
+    # XOR as one big integer: far faster than a byte loop
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(n, "big")
+
+
+async def read_frame(reader, limit=MAX_BODY):
+    """(opcode, payload) of the next WebSocket frame."""
+    b0, b1 = await reader.readexactly(2)
+    length = b1 & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    if length > limit:
+        raise ValueError("frame too large")
+    mask = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(length)
+    return b0 & 0x0F, _unmask(payload, mask) if mask else payload
+
+
+class VoteServer:
+    """The asyncio server, on its own thread.
+
+    Accepted votes and requests are handed over on `batches` as
+    ("votes", {song_id: count}, [song_id, ...]). publish() replaces the
+    state guests see; only songs in it can be voted for.
+    """
+
+    def __init__(self, host="0.0.0.0", port=PORT):
+        self.host = host
+        self.port = port
+        self.batches = queue.Queue()
+        self.received = 0   # votes and requests accepted so far
+        self._votes = Counter()
+        self._next = []
+        self._state = b"{}"
+        self._allowed = set()
+        self._clients = set()  # WebSocket writers
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def start(self):
+        """Start serving; raises OSError if the port cannot be bound."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def stop(self):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=2)
+
+    def publish(self, state):
+        """Show `state` (a JSON-able dict with a "songs" list) to guests."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._set_state, state)
+
+    def _run(self):
+        loop = self._loop = asyncio.new_event_loop()
+        try:
+            server = loop.run_until_complete(asyncio.start_server(
+                self._handle, self.host, self.port, limit=MAX_HEADER, reuse_address=True))
+        except OSError as e:
+            self._error = e
+            self._loop = None
+            self._ready.set()
+            loop.close()
+            return
+        self.port = server.sockets[0].getsockname()[1]  # port 0 picks a free one
+        loop.create_task(self._flush_votes())
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            for writer in list(self._clients):
+                writer.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    async def _flush_votes(self):
+        while True:
+            await asyncio.sleep(VOTE_BATCH_MS / 1000)
+            if self._votes or self._next:
+                self.batches.put(("votes", dict(self._votes), self._next))
+                self._votes = Counter()
+                self._next = []
+
+    def _set_state(self, state):
+        self._state = json.dumps(state, separators=(",", ":")).encode()
+        self._allowed = {row["id"] for row in state.get("songs", ())}
+        frame = ws_frame(self._state)
+        for writer in list(self._clients):
+            if writer.transport.get_write_buffer_size() > SEND_BUFFER_LIMIT:
+                self._clients.discard(writer)
+                writer.close()
+            else:
+                writer.write(frame)
+
+    def _accept(self, kind, song_id):
+        if type(song_id) is not int or song_id not in self._allowed:
+            return False
+        if kind == "vote":
+            self._votes[song_id] += 1
+        elif song_id not in self._next:
+            self._next.append(song_id)
+        self.received += 1
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            while await self._request(reader, writer):
+                pass
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _request(self, reader, writer):
+        """Serve one request; False when the connection should close."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return False  # client went away between requests
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = (lines[0].split(" ", 2) + ["", ""])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY:
+            writer.write(_response(413, JSON, b'{"error":"body too large"}', False))
+            return False
+        body = await reader.readexactly(length) if length else b""
+        path = target.split("?", 1)[0]
+        if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+            await self._websocket(reader, writer, headers)
+            return False
+        status, content_type, payload = self._route(method, path, body)
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        writer.write(_response(status, content_type, payload, keep_alive))
+        await writer.drain()
+        return keep_alive
+
+    def _route(self, method, path, body):
+        if path == "/" and method == "GET":
+            return 200, "text/html; charset=utf-8", PAGE
+        if path == "/state" and method == "GET":
+            return 200, JSON, self._state
+        if path in ("/vote", "/next"):
+            if method != "POST":
+                return 405, JSON, b'{"error":"use POST"}'
+            try:
+                song_id = json.loads(body)["id"]
+            except (ValueError, KeyError, TypeError):
+                return 400, JSON, b'{"error":"expected {\\"id\\": song id}"}'
+            if not self._accept(path[1:], song_id):
+                return 404, JSON, b'{"error":"not in the upcoming songs"}'
+            return 202, JSON, b'{"ok":true}'
+        return 404, JSON, b'{"error":"not found"}'
+
+    async def _websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "").encode()
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        writer.write(ws_frame(self._state))
+        self._clients.add(writer)
+        while True:
+            opcode, payload = await read_frame(reader)
+            if opcode == 8:    # close
+                writer.write(ws_frame(b"", 8))
+                return
+            if opcode == 9:    # ping
+                writer.write(ws_frame(payload, 10))
+            elif opcode == 1:  # text
+                try:
+                    message = json.loads(payload)
+                except ValueError:
+                    continue
+                if isinstance(message, dict):
+                    for kind in ("vote", "next"):
+                        if kind in message:
+                            self._accept(kind, message[kind])
+
+
+def song_info(song):
+    return {"id": song.id, "title": song.title, "artist": song.artist,
+            "upvotes": song.upvotes, "duration": song.duration}
+
+
+class GuestVoting:
+    """Runs a VoteServer for the app and applies what guests send.
+
+    Each poll applies the waiting vote batches under one engine lock, then
+    republishes the state if anything guests can see has changed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.server = None
+        self._poll_id = None
+        self._shown = None     # (current song, party mode, playlist) last published
+        self._since_publish = 0
+
+    @property
+    def running(self):
+        return self.server is not None
+
+    def url(self):
+        return f"http://{lan_address()}:{self.server.port}/" if self.server else None
+
+    def start(self, host="0.0.0.0", port=PORT):
+        """Start the server; raises OSError if the port is taken."""
+        if self.server:
+            return
+        server = VoteServer(host, port)
+        server.start()
+        self.server = server
+        self._shown = None
+        self._poll()
+
+    def stop(self):
+        if self._poll_id:
+            self.app.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+    def _poll(self):
+        self._poll_id = None
+        changed = False
+        with perf.span("party.votes"):
+            while True:
+                try:
+                    _, votes, requests = self.server.batches.get_nowait()
+                except queue.Empty:
+                    break
+                self._apply(votes, requests)
+                changed = True
+        engine = self.app.engine
+        shown = (engine.current_song, engine.party_mode, engine.playlist)
+        self._since_publish += VOTE_BATCH_MS
+        if changed or shown != self._shown or self._since_publish >= STATE_REFRESH_MS:
+            self._shown = shown
+            self._since_publish = 0
+            self.server.publish(self.state())
+        self._poll_id = self.app.root.after(VOTE_BATCH_MS, self._poll)
+
+    def _apply(self, votes, requests):
+        table = self.app.library_manager.table
+        engine = self.app.engine
+        voted = []
+        with engine.lock:
+            for song_id, count in votes.items():
+                song = table.get(song_id)
+                if song is not None:
+                    song.upvotes += count
+                    self.app.party_queue.update(song)
+                    voted.append(song)
+            for song_id in requests:
+                song = table.get(song_id)
+                if (song is not None and song not in engine.play_next_queue
+                        and len(engine.play_next_queue) < MAX_GUEST_NEXT):
+                    engine.queue_next(song, front=False)
+        engine.refresh_upcoming()
+        for song in voted:
+            self.app.persist.log_vote(song)
+        self.app.smart_playlists.update(voted, {VOTES})
+
+    def state(self):
+        """What guests see: now playing, requests, then the next STATE_SONGS songs."""
+        engine = self.app.engine
+        with engine.lock:
+            current = engine.current_song
+            requested = list(engine.play_next_queue)
+            if engine.party_mode:
+                upcoming = self.app.party_queue.top(STATE_SONGS)
+            else:
+                upcoming = []
+                node = engine.current_node.next if engine.current_node else None
+                node = node or (engine.playlist.head if engine.playlist else None)
+                while node and len(upcoming) < STATE_SONGS and node.song is not current:
+                    upcoming.append(node.song)
+                    node = node.next
+        return {"now_playing": song_info(current) if current else None,
+                "party": engine.party_mode,
+                "requested": [song_info(s) for s in requested],
+                "songs": [song_info(s) for s in upcoming]}
+
+
+PAGE = b"""<!doctype html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Party Voting</title>
+<style>
+body{font-family:Helvetica,sans-serif;background:#1E1E1E;color:#fff;margin:0;padding:12px}
+h1{font-size:18px}#now{color:#FFC107;margin-bottom:12px}
+li{display:flex;align-items:center;gap:8px;padding:6px 0;border-bottom:1px solid #333}
+ul{list-style:none;padding:0}.t{flex:1}.v{color:#FFC107;min-width:2em;text-align:right}
+button{background:#2B2B2B;color:#fff;border:1px solid #555;border-radius:6px;padding:6px 10px;font-size:16px}
+</style></head><body>
+<h1>&#127881; Party Voting</h1><div id="now">Connecting&hellip;</div>
+<ul id="req"></ul><ul id="songs"></ul>
+<script>
+let ws;
+function row(s, actions){
+  const li=document.createElement("li");
+  const t=document.createElement("span");t.className="t";t.textContent=s.title+" \\u2014 "+s.artist;
+  const v=document.createElement("span");v.className="v";v.textContent=s.upvotes;
+  li.append(t,v);
+  if(actions){
+    for(const [label,kind] of [["\\u2b50","vote"],["\\u23e9","next"]]){
+      const b=document.createElement("button");b.textContent=label;
+      b.onclick=()=>ws.send(JSON.stringify({[kind]:s.id}));li.append(b);
+    }
+  }
+  return li;
+}
+function show(st){
+  document.getElementById("now").textContent=st.now_playing?
+    "Now playing: "+st.now_playing.title+" \\u2014 "+st.now_playing.artist:"Nothing playing";
+  document.getElementById("req").replaceChildren(...(st.requested||[]).map(s=>row(s,false)));
+  document.getElementById("songs").replaceChildren(...(st.songs||[]).map(s=>row(s,true)));
+}
+function connect(){
+  ws=new WebSocket((location.protocol=="https:"?"wss://":"ws://")+location.host+"/ws");
+  ws.onmessage=e=>show(JSON.parse(e.data));
+  ws.onclose=()=>setTimeout(connect,2000);
+}
+connect();
+</script></body></html>
+"""
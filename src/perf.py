@@ -0,0 +1,218 @@
+# perf.py
+"""Opt-in timing spans, histograms and a sampling profiler.
+
+Off by default. Turn it on with environment variables before starting:
+
+    MUSIC_PERF=1              record spans, print p50/p95/p99 at exit
+    MUSIC_PERF=perf.txt       ... and write them to perf.txt instead
+    MUSIC_PERF_SAMPLE=prof.txt  also sample all threads' stacks and write
+                              collapsed stacks (flamegraph.pl / speedscope input)
+    MUSIC_PERF_INTERVAL=5     sampling interval in ms
+
+MUSIC_PERF=0 (or false, no, off) leaves it off.
+
+While disabled, `span()` returns a shared no-op context manager and
+`record()` returns at once, so instrumented code pays one global lookup.
+"""
+import atexit
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+enabled = False
+_histograms = {}
+
+# Log-scale buckets: 8 per doubling, from 1 µs to ~1 hour
+_PER_OCTAVE = 8
+_MIN = 1e-6
+_BUCKETS = _PER_OCTAVE * 32
+
+
+class Histogram:
+    """Fixed-size log-bucketed histogram of durations in seconds (~9% resolution)."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds > _MIN:
+            i = min(_BUCKETS - 1, int(math.log2(seconds / _MIN) * _PER_OCTAVE))
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper edge of the bucket holding the p-th percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.max, _MIN * 2 ** ((i + 1) / _PER_OCTAVE))
+        return self.max
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """`with perf.span("play.start"):` times the block when enabled."""
+    return _Span(name) if enabled else _NO_SPAN
+
+
+def record(name, seconds):
+    """Add one measured duration (for spans that cross threads or callbacks)."""
+    if not enabled:
+        return
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms.setdefault(name, Histogram())
+    hist.add(seconds)
+
+
+def stats():
+    """{name: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}."""
+    out = {}
+    for name, h in sorted(_histograms.items()):
+        if h.count:
+            out[name] = {"count": h.count, "mean_ms": h.total / h.count * 1000,
+                         "p50_ms": h.percentile(50) * 1000, "p95_ms": h.percentile(95) * 1000,
+                         "p99_ms": h.percentile(99) * 1000, "max_ms": h.max * 1000}
+    return out
+
+
+def dump(dest=None):
+    """Write a percentile table to `dest` (a path) or stdout."""
+    lines = [f"{'span':32} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)"]
+    for name, s in stats().items():
+        lines.append(f"{name:32} {s['count']:7d} {s['mean_ms']:9.2f} {s['p50_ms']:9.2f} "
+                     f"{s['p95_ms']:9.2f} {s['p99_ms']:9.2f} {s['max_ms']:9.2f}")
+    text = "\n".join(lines) + "\n"
+    if dest:
+        with open(dest, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def reset():
+    _histograms.clear()
+
+
+class Sampler:
+    """Sampling profiler: every `interval` seconds, record each thread's stack.
+
+    Stacks are counted in collapsed form ("thread;outer;...;inner count"),
+    which flamegraph.pl and speedscope read directly. `on_sample`, if given,
+    is called with the {thread_id: frame} dict of every sample instead.
+    """
+
+    def __init__(self, interval=0.005, on_sample=None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="perf-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frames.pop(me, None)
+            if self.on_sample:
+                self.on_sample(frames)
+                continue
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+def enable(dump_to=None, sample_to=None, interval=0.005):
+    """Start recording; dump percentiles (and samples) when the process exits."""
+    global enabled
+    enabled = True
+    sampler = Sampler(interval).start() if sample_to else None
+
+    def at_exit():
+        dump(dump_to)
+        if sampler:
+            sampler.stop()
+            sampler.write(sample_to)
+    atexit.register(at_exit)
+    return sampler
+
+
+_OFF = ("", "0", "false", "no", "off")
+_ON = ("1", "true", "yes", "on")
+
+
+def _from_env():
+    setting = os.environ.get("MUSIC_PERF", "").strip()
+    sample_to = os.environ.get("MUSIC_PERF_SAMPLE")
+    off = setting.lower() in _OFF
+    if not off or sample_to:
+        interval = float(os.environ.get("MUSIC_PERF_INTERVAL", "5")) / 1000
+        enable(dump_to=None if off or setting.lower() in _ON else setting,
+               sample_to=sample_to, interval=interval)
+
+
+_from_env()
@@ -1,49 +1,325 @@
 import os
+import sys
 import json
 from song import Song
-from playlist import Node, PlaylistLinkedList
+from playlist import PlaylistLinkedList
+from journal import Journal
+from writer import PersistWriter
+import perf
 import tkinter as tk
 
 LIBRARY_FILE = "library.json"
 PLAYLIST_FILE = "playlists.json"
+COMPACT_AFTER = 5000  # journal entries before folding them into the snapshots
+FORMAT_VERSION = 2
+SMART_COLOR = "#80CBC4"  # smart playlists' names in the playlist list
+# columns of a library.json song row
+SONG_FIELDS = ("id", "title", "artist", "filepath", "album", "track", "duration", "upvotes",
+               "mtime", "size", "added")
+
+
+def playlist_song_dict(s):
+    return {"id": s.id, "title": s.title, "artist": s.artist, "filepath": s.filepath,
+            "upvotes": s.upvotes}
+
 
 class Persist:
     # ===================== Persistent Library & Playlists =====================
+    # library.json / playlists.json are snapshots; every edit in between is a
+    # small append to the journal, replayed on load and compacted away in the
+    # background once it grows past COMPACT_AFTER entries. All snapshot
+    # writes go through a coalescing background writer.
+    #
+    # library.json is the song table: one row per song that the library or
+    # any playlist refers to, plus the ids in the library. playlists.json
+    # only stores id arrays. Journal entries carry full song dicts (with
+    # ids), so replay never depends on which snapshot made it to disk.
     def __init__(self, musicplayer):
-        self.library = []
         self.musicplayer = musicplayer
+        self.journal = Journal()
+        self.writer = PersistWriter()
+        self._moved = {}  # old path -> new path, while replaying "rename" entries
 
-    def save_library(self):
-        data = [{"title": s.title, "artist": s.artist, "filepath": s.filepath} for s in self.library]
-        with open(LIBRARY_FILE, "w") as f:
-            json.dump(data, f)
+    # ---------- snapshots ----------
+    def library_snapshot(self):
+        manager = self.musicplayer.library_manager
+        index = manager.scanner.index
+        rows = {}
 
-    def load_saved_library(self):
-        if os.path.exists(LIBRARY_FILE):
-            with open(LIBRARY_FILE, "r") as f:
-                data = json.load(f)
-                for item in data:
-                    if os.path.exists(item["filepath"]):
-                        self.library.append(Song(item["title"], item["artist"], item["filepath"]))
-                self.musicplayer.library_manager.display_library()
+        def add(s):
+            if s.id not in rows:
+                mtime, size = index.get(s.filepath) or (None, None)
+                rows[s.id] = [s.id, s.title, s.artist, s.filepath, s.album, s.track,
+                              s.duration, s.upvotes, mtime, size, s.added]
 
-    def save_playlists(self):
+        for s in manager.songs:
+            add(s)
+        for playlist in self.musicplayer.playlists.values():
+            for s in playlist.to_list():
+                add(s)
+        return {"version": FORMAT_VERSION, "fields": SONG_FIELDS, "next_id": manager.table.next_id,
+                "songs": list(rows.values()), "library": [s.id for s in manager.songs],
+                "folders": manager.folders}
+
+    def library_song_dict(self, s):
+        item = {"id": s.id, "title": s.title, "artist": s.artist, "filepath": s.filepath,
+                "album": s.album, "track": s.track, "duration": s.duration, "added": s.added}
+        stat = self.musicplayer.library_manager.scanner.index.get(s.filepath)
+        if stat:
+            item["mtime"], item["size"] = stat
+        return item
+
+    def playlists_snapshot(self):
+        smart = self.musicplayer.smart_playlists
         data = {}
         for name, playlist in self.musicplayer.playlists.items():
-            data[name] = [{"title": s.title, "artist": s.artist, "filepath": s.filepath, "upvotes": s.upvotes} for s in playlist.to_list()]
-        with open(PLAYLIST_FILE, "w") as f:
-            json.dump(data, f)
+            if name not in smart:  # smart playlists are rebuilt from their query
+                data[name] = [s.id for s in playlist.to_list()]
+        return {"version": FORMAT_VERSION, "playlists": data, "smart": smart.queries()}
+
+    def save_library(self):
+        with perf.span("persist.snapshot"):
+            data = self.library_snapshot()
+        self.writer.request(LIBRARY_FILE, data)
+
+    def save_playlists(self):
+        with perf.span("persist.snapshot"):
+            data = self.playlists_snapshot()
+        self.writer.request(PLAYLIST_FILE, data)
+
+    def close(self):
+        """Flush pending writes; call on shutdown."""
+        self.writer.close()
+        self.journal.close()
+
+    # ---------- journal ----------
+    def log_library_put(self, songs):
+        self._log("lib_put", songs=[self.library_song_dict(s) for s in songs])
+
+    def log_library_remove(self, filepaths):
+        self._log("lib_remove", paths=list(filepaths))
+
+    def log_library_folder(self, folder):
+        self._log("lib_folder", folder=folder)
+
+    def log_rename(self, pairs):
+        # files moved on disk; applies to the library and every playlist
+        self._log("rename", pairs=[list(p) for p in pairs])
+
+    def log_playlist_create(self, name):
+        self._log("pl_create", name=name)
+
+    def log_smart_playlist(self, name, query):
+        self._log("smart_put", name=name, query=query)
+
+    def log_playlist_delete(self, name):
+        self._log("pl_delete", name=name)
+
+    def log_playlist_add(self, name, songs):
+        self._log("pl_add", name=name, songs=[playlist_song_dict(s) for s in songs])
+
+    def log_playlist_remove(self, name, filepaths):
+        self._log("pl_remove", name=name, paths=list(filepaths))
+
+    def log_vote(self, song):
+        # absolute count, so replaying the entry twice is harmless
+        self._log("vote", path=song.filepath, upvotes=song.upvotes)
+
+    def log_playlist_order(self, name):
+        playlist = self.musicplayer.playlists[name]
+        self._log("pl_order", name=name, paths=[s.filepath for s in playlist.to_list()])
+
+    def _log(self, op, **fields):
+        with perf.span("persist.journal"):
+            self.journal.append(op, **fields)
+        if self.journal.count >= COMPACT_AFTER:
+            self.compact()
+
+    def compact(self):
+        """Fold the journal into fresh snapshots without blocking the UI.
+
+        The snapshot is captured here (on the Tk thread, so it is consistent);
+        the writer encodes and replaces both files, and the sealed journal
+        segment is deleted once both are on disk.
+        """
+        seq = self.journal.rotate()
+        remaining = {LIBRARY_FILE, PLAYLIST_FILE}
+
+        def written(path):
+            remaining.discard(path)
+            if not remaining:
+                self.journal.discard_through(seq)
+
+        self.writer.request(LIBRARY_FILE, self.library_snapshot(), on_written=written)
+        self.writer.request(PLAYLIST_FILE, self.playlists_snapshot(), on_written=written)
+
+    # ---------- loading ----------
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _register(self, item, update=False):
+        """Canonical Song for a saved song dict, creating it on first sight."""
+        table = self.musicplayer.library_manager.table
+        song = self._find(item["filepath"])
+        if song is None:
+            song = table.add(Song(item["title"], item["artist"], item["filepath"],
+                                  album=item.get("album") or "", track=item.get("track") or 0,
+                                  duration=item.get("duration") or 0, id=item.get("id")))
+        elif update:
+            song.title = item["title"]
+            song.artist = sys.intern(item["artist"])
+            song.album = sys.intern(item.get("album") or "")
+            song.track = item.get("track") or 0
+            song.duration = item.get("duration") or 0
+        if "upvotes" in item:
+            song.upvotes = item["upvotes"]
+        if song.added is None:
+            song.added = item.get("added") or 0
+        return song
+
+    def _find(self, path):
+        # Renames are applied to the table during the library pass, so the
+        # playlist pass can meet entries logged under a file's older path.
+        table = self.musicplayer.library_manager.table
+        song = table.find(path)
+        seen = 0
+        while song is None and path in self._moved and seen < 100:
+            path = self._moved[path]
+            song = table.find(path)
+            seen += 1
+        return song
+
+    def load_saved_library(self):
+        with perf.span("persist.load_library"):
+            self._load_saved_library()
+
+    def _load_saved_library(self):
+        manager = self.musicplayer.library_manager
+        library = {}  # filepath -> Song, in library order
+        stats = {}    # filepath -> (mtime, size) as of the last scan
+        self._moved = {}
+        data = self._read(LIBRARY_FILE)
+        if isinstance(data, dict):
+            # song table + library ids
+            manager.folders.extend(data.get("folders", []))
+            fields = data["fields"]
+            manager.table.next_id = max(manager.table.next_id, data.get("next_id", 1))
+            for row in data["songs"]:
+                item = dict(zip(fields, row))
+                self._register(item)
+                if item.get("mtime") is not None:
+                    stats[item["filepath"]] = (item["mtime"], item["size"])
+            for song_id in data["library"]:
+                song = manager.table.get(song_id)
+                if song:
+                    library[song.filepath] = song
+        elif data:
+            # older format: a list of song dicts, converted on the next compaction
+            for item in data:
+                library[item["filepath"]] = self._register(item)
+                if "mtime" in item:
+                    stats[item["filepath"]] = (item["mtime"], item["size"])
+        for entry in self.journal.entries():
+            if entry["op"] == "lib_put":
+                for item in entry["songs"]:
+                    library[item["filepath"]] = self._register(item, update=True)
+                    if "mtime" in item:
+                        stats[item["filepath"]] = (item["mtime"], item["size"])
+            elif entry["op"] == "lib_remove":
+                for path in entry["paths"]:
+                    library.pop(path, None)
+            elif entry["op"] == "lib_folder":
+                if entry["folder"] not in manager.folders:
+                    manager.folders.append(entry["folder"])
+            elif entry["op"] == "rename":
+                for old, new in entry["pairs"]:
+                    self._moved[old] = new
+                    song = manager.table.find(old)
+                    if song is None or manager.table.find(new) is not None:
+                        continue
+                    manager.table.rename(song, new)
+                    if library.pop(old, None) is song:
+                        library[new] = song
+                    if old in stats:
+                        stats[new] = stats.pop(old)
+
+        # Seed the scanner so the next rescan is incremental
+        for path in library:
+            stat = stats.get(path)
+            if stat:
+                manager.scanner.index[path] = stat
+        # Show the cached library at once; files that disappeared since the
+        # last run are found and removed in the background.
+        manager.add_songs(library.values(), index_later=True)
+        manager.display_library()
+        manager.verify_exists(library)
 
     def load_saved_playlists(self):
-        if os.path.exists(PLAYLIST_FILE):
-            with open(PLAYLIST_FILE, "r") as f:
-                data = json.load(f)
+        with perf.span("persist.load_playlists"):
+            self._load_saved_playlists()
+
+    def _load_saved_playlists(self):
+        table = self.musicplayer.library_manager.table
+        data = {}  # name -> {filepath: Song}
+        smart = {}  # name -> query
+        raw = self._read(PLAYLIST_FILE)
+        if raw and isinstance(raw.get("version"), int):
+            smart.update(raw.get("smart", {}))
+            for name, ids in raw["playlists"].items():
+                songs = data[name] = {}
+                for song_id in ids:
+                    song = table.get(song_id)
+                    if song:
+                        songs[song.filepath] = song
+        elif raw:
+            # older format: full song dicts per playlist entry
+            for name, items in raw.items():
+                data[name] = {s["filepath"]: self._register(s) for s in items}
+        for entry in self.journal.entries():
+            op = entry["op"]
+            if op == "pl_create":
+                data.setdefault(entry["name"], {})
+            elif op == "pl_delete":
+                data.pop(entry["name"], None)
+                smart.pop(entry["name"], None)
+            elif op == "smart_put":
+                smart[entry["name"]] = entry["query"]
+            elif op == "pl_add":
+                songs = data.setdefault(entry["name"], {})
+                for s in entry["songs"]:
+                    if s["filepath"] not in songs:
+                        songs[s["filepath"]] = self._register(s)
+            elif op == "pl_remove":
+                songs = data.get(entry["name"], {})
+                for path in entry["paths"]:
+                    songs.pop(path, None)
+            elif op == "pl_order" and entry["name"] in data:
+                songs = data[entry["name"]]
+                ordered = {p: songs[p] for p in entry["paths"] if p in songs}
+                ordered.update(songs)  # anything added after the order was logged
+                data[entry["name"]] = ordered
+            elif op == "vote":
+                song = self._find(entry["path"])
+                if song:
+                    song.upvotes = entry["upvotes"]
+            elif op == "rename":
+                moved = dict(entry["pairs"])
                 for name, songs in data.items():
-                    playlist = PlaylistLinkedList()
-                    for s in songs:
-                        song = Song(s["title"], s["artist"], s["filepath"])
-                        song.upvotes = s.get("upvotes", 0)
-                        playlist.append(song)
-                    self.musicplayer.playlists[name] = playlist
-                    self.musicplayer.playlist_listbox.insert(tk.END, name)
+                    if not moved.keys().isdisjoint(songs):
+                        data[name] = {moved.get(p, p): s for p, s in songs.items()}
 
+        for name, songs in data.items():
+            playlist = PlaylistLinkedList()
+            for song in songs.values():
+                playlist.append(song)
+            self.musicplayer.playlists[name] = playlist
+            self.musicplayer.playlist_listbox.insert(tk.END, name)
+        for name, query in smart.items():
+            # filled from the library the first time they are shown or played
+            self.musicplayer.smart_playlists.add(name, query)
+            self.musicplayer.playlist_listbox.insert(tk.END, name)
+            self.musicplayer.playlist_listbox.itemconfig(tk.END, fg=SMART_COLOR)
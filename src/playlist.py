@@ -1,3 +1,4 @@
+import heapq
 import random
 
 class Node:
@@ -5,27 +6,155 @@ class Node:
         self.song = song
         self.next = None
         self.prev = None
+        self.slot = -1  # position key in the playlist's order index
+
+
+class OrderIndex:
+    """Order-statistic index over the nodes of a linked list.
+
+    Every node gets a slot number in list order; a Fenwick tree counts the
+    live slots, so index -> node and node -> index are both O(log n).
+    Appends take the next free slot and removals leave a hole; when the slots
+    run out the live nodes are compacted into a tree twice their count, so
+    appends stay amortised O(log n). Anything that reorders the list calls
+    `rebuild`.
+    """
+
+    def __init__(self):
+        self.rebuild([])
+
+    def rebuild(self, nodes, capacity=None):
+        n = len(nodes)
+        self.capacity = max(capacity or 0, 16, n * 2)
+        self.tree = [0] * (self.capacity + 1)
+        self.slots = list(nodes) + [None] * (self.capacity - n)
+        self.next_slot = n
+        self.live = n
+        for i, node in enumerate(nodes):
+            node.slot = i
+        # O(n) Fenwick construction
+        tree = self.tree
+        for i in range(1, self.capacity + 1):
+            if i <= n:
+                tree[i] += 1
+            parent = i + (i & -i)
+            if parent <= self.capacity:
+                tree[parent] += tree[i]
+        self.top_bit = 1 << (self.capacity.bit_length() - 1)
+
+    def _add(self, slot, delta):
+        i = slot + 1
+        tree = self.tree
+        while i <= self.capacity:
+            tree[i] += delta
+            i += i & -i
+
+    def append(self, node, compact_from=None):
+        if self.next_slot == self.capacity:
+            # out of slots: compact live nodes (and grow if mostly live)
+            self.rebuild(list(compact_from()), capacity=self.live * 2)
+        node.slot = self.next_slot
+        self.slots[node.slot] = node
+        self.next_slot += 1
+        self.live += 1
+        self._add(node.slot, 1)
+
+    def remove(self, node):
+        self._add(node.slot, -1)
+        self.slots[node.slot] = None
+        node.slot = -1
+        self.live -= 1
+
+    def index_of(self, node):
+        i = node.slot + 1
+        total = 0
+        tree = self.tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total - 1
+
+    def node_at(self, index):
+        if index < 0 or index >= self.live:
+            return None
+        # Fenwick descent: find the slot holding the (index + 1)-th live node
+        pos = 0
+        remaining = index + 1
+        step = self.top_bit
+        tree = self.tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.capacity and tree[nxt] < remaining:
+                pos = nxt
+                remaining -= tree[nxt]
+            step >>= 1
+        return self.slots[pos]
+
+
+class PlaylistSongs:
+    """Read-only sequence of a playlist's songs, indexed through its OrderIndex."""
+
+    def __init__(self, playlist):
+        self.playlist = playlist
+
+    def __len__(self):
+        return len(self.playlist)
+
+    def __getitem__(self, index):
+        return self.playlist.node_at(index).song
+
 
 class PlaylistLinkedList:
     def __init__(self):
         self.head = None
         self.tail = None
         self.size = 0
+        self._by_path = {}  # filepath -> node
+        self._order = OrderIndex()
 
-    def append(self, song):
-        # Prevent duplicates
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, filepath):
+        return filepath in self._by_path
+
+    def __iter__(self):
         current = self.head
         while current:
-            if current.song.filepath == song.filepath:
-                return False
+            yield current
             current = current.next
+
+    def find(self, filepath):
+        return self._by_path.get(filepath)
+
+    def node_at(self, index):
+        return self._order.node_at(index)
+
+    def index_of(self, node):
+        return self._order.index_of(node)
+
+    def songs(self):
+        return PlaylistSongs(self)
+
+    def clear(self):
+        self.head = self.tail = None
+        self.size = 0
+        self._by_path = {}
+        self._order = OrderIndex()
+
+    def append(self, song):
+        # Prevent duplicates
+        if song.filepath in self._by_path:
+            return False
         new_node = Node(song)
+        self._order.append(new_node, compact_from=self.__iter__)
         if not self.head:
             self.head = self.tail = new_node
         else:
             new_node.prev = self.tail
             self.tail.next = new_node
             self.tail = new_node
+        self._by_path[song.filepath] = new_node
         self.size += 1
         return True
 
@@ -38,8 +167,43 @@ class PlaylistLinkedList:
             node.next.prev = node.prev
         else:
             self.tail = node.prev
+        if self._by_path.get(node.song.filepath) is node:
+            del self._by_path[node.song.filepath]
+        self._order.remove(node)
         self.size -= 1
 
+    def rename(self, old, new):
+        """Re-key a node after its song's file moved from `old` to `new`."""
+        node = self._by_path.pop(old, None)
+        if node is not None:
+            self._by_path[new] = node
+
+    def remove_path(self, filepath):
+        node = self._by_path.get(filepath)
+        if node is None:
+            return False
+        self.remove(node)
+        return True
+
+    def dedupe(self, key, keep=None):
+        """Remove songs whose `key(song)` repeats an earlier one; returns them.
+
+        `key` is e.g. a content hash lookup, so copies of one track under
+        different paths count as the same song. The node `keep` (the one
+        playing) survives even if an earlier copy exists.
+        """
+        keep_key = key(keep.song) if keep is not None else None
+        seen = set()
+        removed = []
+        for node in list(self):
+            k = key(node.song)
+            if k in seen or (k == keep_key and node is not keep):
+                self.remove(node)
+                removed.append(node.song)
+            else:
+                seen.add(k)
+        return removed
+
     def to_list(self):
         songs = []
         current = self.head
@@ -48,16 +212,58 @@ class PlaylistLinkedList:
             current = current.next
         return songs
 
-    def shuffle(self):
-        songs = self.to_list()
-        def recursive_shuffle(songs):
-            if len(songs) <= 1:
-                return songs
-            pivot = random.choice(songs)
-            remaining = [s for s in songs if s != pivot]
-            return [pivot] + recursive_shuffle(remaining)
-        shuffled = recursive_shuffle(songs)
-        self.head = self.tail = None
-        for s in shuffled:
-            self.append(s)
+    def shuffle(self, seed=None, spread_artists=False):
+        """Shuffle in place in O(n) by relinking the existing nodes.
+
+        Pass `seed` for a reproducible order. With `spread_artists` the order
+        avoids the same artist twice in a row wherever the mix allows it.
+        """
+        nodes = list(self)
+        if len(nodes) < 2:
+            return
+        rng = random.Random(seed)
+        if spread_artists:
+            nodes = _spread_by_artist(nodes, rng)
+        else:
+            rng.shuffle(nodes)
+        self._relink(nodes)
+
+    def _relink(self, nodes):
+        prev = None
+        for node in nodes:
+            node.prev = prev
+            if prev:
+                prev.next = node
+            prev = node
+        nodes[-1].next = None
+        self.head, self.tail = nodes[0], nodes[-1]
+        self._order.rebuild(nodes)
+
+
+def _spread_by_artist(nodes, rng):
+    """Order nodes so consecutive songs have different artists when possible.
+
+    Greedy: always take from the artist with the most songs left, skipping the
+    one just played. O(n log k) for k artists.
+    """
+    buckets = {}
+    for node in nodes:
+        buckets.setdefault(node.song.artist, []).append(node)
+    heap = []
+    for artist, bucket in buckets.items():
+        rng.shuffle(bucket)
+        heap.append((-len(bucket), rng.random(), artist))
+    heapq.heapify(heap)
 
+    order = []
+    held = None  # artist just played, kept out of the heap for one step
+    while heap:
+        count, tie, artist = heapq.heappop(heap)
+        order.append(buckets[artist].pop())
+        if held:
+            heapq.heappush(heap, held)
+        held = (count + 1, tie, artist) if count + 1 < 0 else None
+    if held:
+        # only one artist left: nothing to spread it against
+        order.extend(reversed(buckets[held[2]]))
+    return order
@@ -0,0 +1,384 @@
+# playlist_io.py
+"""Import and export M3U/M3U8, PLS and XSPF playlists, streaming.
+
+Readers yield one entry at a time (M3U and PLS line by line, XSPF through
+iterparse with finished elements cleared), a worker thread resolves them in
+batches of IMPORT_BATCH against the library, and the Tk thread appends each
+batch to the new playlist. The hand-over queue is bounded, so memory stays
+flat however long the file is. Writers stream the same way.
+"""
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+import perf
+from playlist import PlaylistLinkedList
+from song import Song
+
+IMPORT_BATCH = 1000   # entries resolved and applied together
+QUEUE_DEPTH = 8       # batches in flight between the worker and the UI
+POLL_MS = 50
+FORMATS = (("Playlists", "*.m3u *.m3u8 *.pls *.xspf"), ("M3U", "*.m3u *.m3u8"),
+           ("PLS", "*.pls"), ("XSPF", "*.xspf"))
+_PLS_FILE = re.compile(rb"^\s*file\d+\s*=", re.IGNORECASE)
+
+
+# ---------- readers: binary file -> (location, title, artist, seconds) ----------
+def _text(raw):
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")  # older players wrote .m3u in the local codepage
+
+
+def read_m3u(f):
+    title = artist = None
+    duration = 0
+    for raw in f:
+        if raw[:1] == b"#" and raw[:8].upper() != b"#EXTINF:":
+            continue  # other directives and comments
+        line = _text(raw).lstrip("\ufeff").strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            if line[:8].upper() == "#EXTINF:":
+                head, _, name = line[8:].partition(",")
+                try:
+                    duration = max(0, int(float(head.split()[0])))
+                except (ValueError, IndexError):
+                    duration = 0
+                artist, sep, title = name.partition(" - ")
+                if not sep:
+                    artist, title = None, name
+            continue
+        yield line, title or None, artist or None, duration
+        title = artist = None
+        duration = 0
+
+
+def read_pls(f):
+    # Title/Length lines may come after their File line, so only File is used:
+    # waiting for them would mean buffering the whole file
+    for raw in f:
+        if _PLS_FILE.match(raw):
+            yield _text(raw).split("=", 1)[1].strip(), None, None, 0
+
+
+def read_xspf(f):
+    track_list = None
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            if tag == "trackList":
+                track_list = elem
+            continue
+        if tag != "track":
+            continue
+        fields = {child.tag.rsplit("}", 1)[-1]: (child.text or "").strip() for child in elem}
+        try:
+            duration = int(fields.get("duration") or 0) // 1000
+        except ValueError:
+            duration = 0
+        location = fields.get("location")
+        if location:
+            if "://" not in location:
+                location = unquote(location)  # a relative URI reference
+            yield location, fields.get("title"), fields.get("creator"), duration
+        elem.clear()
+        if track_list is not None:
+            track_list.clear()  # drop finished tracks from the tree
+
+
+READERS = {".m3u": read_m3u, ".m3u8": read_m3u, ".pls": read_pls, ".xspf": read_xspf}
+
+
+# ---------- paths ----------
+def to_path(location, base):
+    """Local absolute path for a playlist location, or None for URLs.
+
+    Absolute Windows paths cannot exist here; they come back prefixed with
+    NUL so PathResolver only tries its suffix match on them.
+    """
+    if "://" in location:
+        parts = urlsplit(location)
+        if parts.scheme != "file":
+            return None
+        location = unquote(parts.path)
+        if location[2:3] == ":":
+            location = location[1:]  # file:///C:/...
+    if os.sep == "/" and ("\\" in location or location[1:2] == ":"):
+        # written on Windows: keep the components, the drive cannot match here
+        absolute = location[1:2] == ":" or location[:1] == "\\"
+        location = location.replace("\\", "/")
+        if location[1:2] == ":":
+            location = location[2:]
+        if not absolute:
+            return os.path.normpath(os.path.join(base, location))
+        return "\0" + location.lstrip("/")  # only a suffix match can resolve this
+    if location[:1] == "~":
+        location = os.path.expanduser(location)
+    path = os.path.join(base, location)  # `location` itself when absolute
+    if os.sep == "/" and "/." not in path and "//" not in path:
+        return path  # already normal; normpath is the slow part of an import
+    return os.path.normpath(path)
+
+
+class PathResolver:
+    """Maps playlist paths to library paths.
+
+    Exact hits are a set lookup; a path that is neither in the library nor
+    on disk (another machine's music folder, a Windows drive) falls back to
+    the library file with the same name sharing the longest run of trailing
+    directories, if exactly one does.
+    """
+
+    def __init__(self, library_paths):
+        self.known = set(library_paths)
+        self._by_name = None
+
+    def _names(self):
+        if self._by_name is None:
+            self._by_name = {}
+            for path in self.known:
+                self._by_name.setdefault(os.path.basename(path).casefold(), []).append(path)
+        return self._by_name
+
+    def resolve_many(self, paths):
+        return [self.resolve(p) if p is not None else None for p in paths]
+
+    def resolve(self, path):
+        if path in self.known:
+            return path
+        if not path.startswith("\0") and os.path.isfile(path):
+            return path
+        parts = path.lstrip("\0").replace("\\", "/").casefold().split("/")
+        best, best_score, tied = None, 0, False
+        for candidate in self._names().get(parts[-1], ()):
+            theirs = candidate.casefold().split(os.sep)
+            score = 0
+            while score < min(len(parts), len(theirs)) and parts[-1 - score] == theirs[-1 - score]:
+                score += 1
+            if score > best_score:
+                best, best_score, tied = candidate, score, False
+            elif score == best_score:
+                tied = True
+        return None if tied else best  # two equally good guesses: neither
+
+
+def read_batches(f, reader, resolver, base):
+    """Yield ([(path, title, artist, seconds), ...], entries not found) per IMPORT_BATCH entries."""
+    entries = reader(f)
+    while True:
+        batch = [entry for _, entry in zip(range(IMPORT_BATCH), entries)]
+        if not batch:
+            return
+        resolved = resolver.resolve_many([to_path(location, base) for location, _, _, _ in batch])
+        rows = [(path, title, artist, duration)
+                for path, (_, title, artist, duration) in zip(resolved, batch) if path is not None]
+        yield rows, len(batch) - len(rows)
+
+
+# ---------- writers: (binary file, songs, directory of the file) ----------
+def _location(path, base):
+    if path.startswith(os.path.join(base, "")):
+        return os.path.relpath(path, base)
+    return path
+
+
+def write_m3u(f, songs, base):
+    f.write(b"#EXTM3U\n")
+    for song in songs:
+        f.write(f"#EXTINF:{int(song.duration or -1)},{song.artist} - {song.title}\n"
+                f"{_location(song.filepath, base)}\n".encode("utf-8", "surrogateescape"))
+        yield
+
+
+def write_pls(f, songs, base):
+    f.write(b"[playlist]\n")
+    n = 0
+    for n, song in enumerate(songs, 1):
+        f.write(f"File{n}={_location(song.filepath, base)}\nTitle{n}={song.artist} - {song.title}\n"
+                f"Length{n}={int(song.duration or -1)}\n".encode("utf-8", "surrogateescape"))
+        yield
+    f.write(f"NumberOfEntries={n}\nVersion=2\n".encode())
+
+
+def write_xspf(f, songs, base):
+    f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+            b'<playlist version="1" xmlns="http://xspf.org/ns/0/">\n  <trackList>\n')
+    for song in songs:
+        location = _location(song.filepath, base)
+        uri = quote(location) if not os.path.isabs(location) else "file://" + quote(location)
+        duration = f"<duration>{int(song.duration * 1000)}</duration>" if song.duration else ""
+        f.write(f"    <track><location>{escape(uri)}</location><title>{escape(song.title)}</title>"
+                f"<creator>{escape(song.artist)}</creator>{duration}</track>\n"
+                .encode("utf-8", "surrogateescape"))
+        yield
+    f.write(b"  </trackList>\n</playlist>\n")
+
+
+WRITERS = {".m3u": write_m3u, ".m3u8": write_m3u, ".pls": write_pls, ".xspf": write_xspf}
+
+
+class PlaylistFiles:
+    """Runs imports and exports on a worker thread and shows their progress.
+
+    The worker posts ("batch", [(path, title, artist, seconds), ...],
+    bytes read, bytes total, missing) and finally ("done", ...) or
+    ("error", message, ...) on a queue of QUEUE_DEPTH batches; the Tk loop
+    drains it and builds the playlist.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.results = queue.Queue(maxsize=QUEUE_DEPTH)
+        self._thread = None
+        self._job = None
+        self._poll_id = None
+
+    def is_busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ---------- import ----------
+    def import_file(self, path):
+        """Start importing `path` into a new playlist; returns its name."""
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise ValueError(f"unsupported playlist format: {os.path.basename(path)}")
+        if self.is_busy():
+            raise RuntimeError("another playlist import or export is running")
+        name = base = os.path.splitext(os.path.basename(path))[0]
+        n = 2
+        while name in self.app.playlists:
+            name, n = f"{base} ({n})", n + 1
+        self.app.playlists[name] = PlaylistLinkedList()
+        self.app.playlist_listbox.insert("end", name)
+        self.app.persist.log_playlist_create(name)
+        # A snapshot of the library's paths for the worker (strings are shared)
+        resolver = PathResolver(list(self.app.library_manager.table.by_path))
+        self._job = {"name": name, "added": 0, "dupes": 0, "missing": 0, "started": time.perf_counter()}
+        self._start(self._import, path, reader, resolver)
+        return name
+
+    def _import(self, path, reader, resolver):
+        total = os.path.getsize(path)
+        missing = 0
+        with open(path, "rb") as f:
+            for rows, unresolved in read_batches(f, reader, resolver, os.path.dirname(os.path.abspath(path))):
+                missing += unresolved
+                self.results.put(("batch", rows, f.tell(), total, missing))  # blocks while the UI catches up
+        self.results.put(("done", None, total, total, missing))
+
+    def _apply_batch(self, rows):
+        job = self._job
+        playlist = self.app.playlists.get(job["name"])
+        if playlist is None:  # deleted while importing
+            return
+        table = self.app.library_manager.table
+        with self.app.engine.lock:
+            for path, title, artist, duration in rows:
+                song = table.find(path)
+                if song is None:
+                    song = table.add(Song(title or os.path.splitext(os.path.basename(path))[0],
+                                          sys.intern(artist or "Unknown"), path, duration=duration))
+                if playlist.append(song):
+                    job["added"] += 1
+                else:
+                    job["dupes"] += 1
+
+    # ---------- export ----------
+    def export_file(self, name, path):
+        writer = WRITERS.get(os.path.splitext(path)[1].lower())
+        if writer is None:
+            raise ValueError(f"unsupported playlist format: {os.path.basename(path)}")
+        if self.is_busy():
+            raise RuntimeError("another playlist import or export is running")
+        songs = self.app.playlists[name].to_list()  # references only; the worker may not walk live nodes
+        self._job = {"name": name, "export": path, "started": time.perf_counter(), "total": len(songs)}
+        self._start(self._export, path, writer, songs)
+
+    def _export(self, path, writer, songs):
+        tmp = path + ".tmp"
+        base = os.path.dirname(os.path.abspath(path))
+        try:
+            with open(tmp, "wb", buffering=1 << 20) as f:
+                for done, _ in enumerate(writer(f, songs, base), 1):
+                    if done % IMPORT_BATCH == 0:
+                        self.results.put(("batch", None, done, len(songs), 0))
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self.results.put(("done", None, len(songs), len(songs), 0))
+
+    # ---------- worker plumbing ----------
+    def _start(self, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:  # whatever it was, _poll needs a last message to stop
+                self.results.put(("error", str(e) or type(e).__name__, 0, 0, 0))
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        if not self._poll_id:
+            self._poll_id = self.app.root.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_id = None
+        job = self._job
+        finished = False
+        with perf.span("playlist_io.tick"):
+            for _ in range(QUEUE_DEPTH):
+                try:
+                    kind, rows, done, total, missing = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == "error":
+                    self._fail(job, rows)
+                    finished = True
+                    break
+                if rows:
+                    self._apply_batch(rows)
+                job["missing"] = missing
+                if kind == "done":
+                    finished = True
+                    break
+                percent = 100 * done / total if total else 100
+                verb = "Exporting" if "export" in job else "Importing"
+                self.app.library_status.config(text=f"{verb} {job['name']}: {percent:.0f}%")
+        if finished:
+            if kind != "error":
+                self._finish(job)
+            self._job = None
+            return
+        self._poll_id = self.app.root.after(POLL_MS, self._poll)
+
+    def _fail(self, job, error):
+        text = f"Playlist {job['name']}: {error}"
+        if "export" not in job:
+            # keep what was imported before the error, past a restart too
+            self.app.persist.compact()
+            text += f" ({job['added']} tracks imported)"
+        self.app.library_status.config(text=text)
+
+    def _finish(self, job):
+        elapsed = time.perf_counter() - job["started"]
+        if "export" in job:
+            text = f"Exported {job['total']} tracks to {os.path.basename(job['export'])} in {elapsed:.1f}s"
+        else:
+            text = (f"Imported {job['added']} tracks into {job['name']} in {elapsed:.1f}s"
+                    f" ({job['missing']} not found, {job['dupes']} repeated)")
+            # one snapshot instead of a journal entry per track
+            self.app.persist.compact()
+            if self.app.current_playlist_name == job["name"]:
+                self.app.display_playlist_songs()
+        self.app.library_status.config(text=text)
@@ -0,0 +1,185 @@
+# scanner.py
+import os
+import queue
+import threading
+import time
+
+import perf
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+SUPPORTED_EXT = (".mp3", ".wav", ".flac", ".ogg")
+
+
+def _scan_dir(path):
+    """List one directory: returns ([(filepath, mtime, size)], [subdirs])."""
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(SUPPORTED_EXT):
+                        st = entry.stat()
+                        files.append((entry.path, st.st_mtime, st.st_size))
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def walk(root, workers=8):
+    """Yield (filepath, mtime, size) for every supported file below root.
+
+    Directories are listed concurrently; each finished listing submits its
+    subdirectories back to the pool, so deep and wide trees both fan out.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for sub in subdirs:
+                    pending.add(pool.submit(_scan_dir, sub))
+                yield from files
+
+
+def _folder_deleted(folder):
+    """Whether a folder that cannot be found was really deleted.
+
+    Only a successful listing of the nearest surviving ancestor that lacks
+    the next folder down counts. An unreadable or empty ancestor (what an
+    unmounted drive's mount point looks like) leaves it unknown.
+    """
+    child = folder
+    while True:
+        parent = os.path.dirname(child)
+        if parent == child:
+            return False
+        try:
+            names = os.listdir(parent)
+        except FileNotFoundError:
+            child = parent
+            continue
+        except OSError:
+            return False
+        return bool(names) and os.path.basename(child) not in names
+
+
+def missing_paths(paths, workers=8):
+    """Yield lists of `paths` that no longer exist, one list per directory.
+
+    Each parent directory is listed once instead of stat()ing every file, and
+    directories are listed concurrently, since slow mounts are latency-bound.
+    A directory that cannot be listed (permissions, a drive that is not
+    mounted) is skipped: its files are unknown, not gone.
+    """
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    def check(item):
+        folder, group = item
+        try:
+            names = set(os.listdir(folder))
+        except FileNotFoundError:
+            return group if _folder_deleted(folder) else []
+        except OSError:
+            return []
+        return [p for p in group if os.path.basename(p) not in names]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for gone in pool.map(check, by_dir.items()):
+            if gone:
+                yield gone
+
+
+class LibraryScanner:
+    """Incremental background scanner.
+
+    Keeps a filepath -> (mtime, size) index of everything it has seen, so a
+    rescan only reports files that were added, changed or removed. Results are
+    streamed as batches onto `results`; the owner drains that queue from its
+    own thread (the Tk loop), which is also the only place the index changes.
+    """
+
+    def __init__(self, workers=8, batch_size=500):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.index = {}
+        self.results = queue.Queue()
+        self._roots = []
+        self._thread = None
+        self._checker = None
+
+    def is_scanning(self):
+        """True while a scan or an existence check is still producing batches."""
+        return self._walking() or (self._checker is not None and self._checker.is_alive())
+
+    def _walking(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, root):
+        """Scan `root` in the background (queued if a scan is running)."""
+        root = os.path.abspath(root)
+        if self._walking():
+            self._roots.append(root)
+            return
+        # The worker compares against a snapshot so it never reads the
+        # index while the UI thread is applying earlier batches to it.
+        known = dict(self.index)
+        self._thread = threading.Thread(target=self._run, args=(root, known), daemon=True)
+        self._thread.start()
+
+    def check_exists(self, paths):
+        """Report saved paths that are gone as removal batches, in the background."""
+        self._checker = threading.Thread(target=self._check, args=(list(paths),), daemon=True)
+        self._checker.start()
+
+    def _check(self, paths):
+        removed = []
+        for gone in missing_paths(paths, self.workers):
+            removed.extend(gone)
+            if len(removed) >= self.batch_size:
+                self.results.put(("batch", None, [], [], removed))
+                removed = []
+        if removed:
+            self.results.put(("batch", None, [], [], removed))
+
+    def start_next(self):
+        """Start the next queued root, if any. Call after a "done" message."""
+        if self._roots and not self._walking():
+            self.start(self._roots.pop(0))
+
+    def apply(self, added, changed, removed):
+        """Record a consumed batch in the index."""
+        for path, mtime, size in added:
+            self.index[path] = (mtime, size)
+        for path, mtime, size in changed:
+            self.index[path] = (mtime, size)
+        for path in removed:
+            self.index.pop(path, None)
+
+    def _run(self, root, known):
+        started = time.perf_counter()
+        added, changed = [], []
+        seen = set()
+        scanned = 0
+        for path, mtime, size in walk(root, self.workers):
+            scanned += 1
+            seen.add(path)
+            old = known.get(path)
+            if old == (mtime, size):
+                continue
+            (added if old is None else changed).append((path, mtime, size))
+            if len(added) + len(changed) >= self.batch_size:
+                self.results.put(("batch", root, added, changed, []))
+                added, changed = [], []
+
+        prefix = os.path.join(root, "")
+        removed = [p for p in known if p.startswith(prefix) and p not in seen]
+        self.results.put(("batch", root, added, changed, removed))
+        perf.record("scan.walk", time.perf_counter() - started)
+        self.results.put(("done", root, scanned))
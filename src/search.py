@@ -0,0 +1,312 @@
+# search.py
+import heapq
+import re
+from bisect import bisect_left, bisect_right, insort
+
+_TOKEN_RE = re.compile(r"\w+")
+MIN_QUERY = 2  # shorter terms would match most of the library
+ORDER_BLOCK = 512  # songs per block of the sorted order (split at twice this)
+WALK_BIAS = 200    # testing a song on the walk is ~this much cheaper than sorting one
+UNION_MAX = 65536  # postings unioned into one set for a term; past this, test per song
+RECENT_WORDS = 4096  # new words kept aside before merging into the sorted vocabulary
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def _trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _deletes(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a, b):
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la > lb:
+        a, b, la, lb = b, a, lb, la
+    i = 0
+    while i < la and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        # one substitution, or one adjacent transposition
+        return a[i + 1:] == b[i + 1:] or (
+            i + 1 < la and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:])
+    return a[i:] == b[i + 1:]
+
+
+def _sort_key(song):
+    return (song.artist, song.album, song.track, song.title)
+
+
+class _SortedSongs:
+    """Songs in _sort_key order, as a list of small sorted blocks.
+
+    Adding or removing a song bisects to its block and shifts only that
+    block, so the order stays current as songs come and go; walking the
+    blocks from the front yields songs already sorted. Each song remembers
+    the key it was filed under, so it can be found again after its tags
+    change.
+    """
+
+    def __init__(self):
+        self._keys = []    # per block: sorted keys
+        self._blocks = []  # per block: songs, parallel to _keys
+        self._maxes = []   # last key of each block
+        self.key_of = {}   # song -> key it is filed under
+
+    def __len__(self):
+        return len(self.key_of)
+
+    def blocks(self):
+        return iter(self._blocks)
+
+    def add(self, song):
+        key = self.key_of[song] = _sort_key(song)
+        if not self._maxes:
+            self._keys.append([key])
+            self._blocks.append([song])
+            self._maxes.append(key)
+            return
+        b = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        keys, block = self._keys[b], self._blocks[b]
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        block.insert(i, song)
+        self._maxes[b] = keys[-1]
+        if len(keys) > 2 * ORDER_BLOCK:
+            self._keys.insert(b + 1, keys[ORDER_BLOCK:])
+            self._blocks.insert(b + 1, block[ORDER_BLOCK:])
+            del keys[ORDER_BLOCK:], block[ORDER_BLOCK:]
+            self._maxes[b:b + 1] = [keys[-1], self._keys[b + 1][-1]]
+
+    def remove(self, song):
+        key = self.key_of.pop(song, None)
+        if key is None:
+            return
+        # songs with equal keys may run on into the following blocks
+        for b in range(bisect_left(self._maxes, key), len(self._maxes)):
+            keys, block = self._keys[b], self._blocks[b]
+            i = bisect_left(keys, key)
+            while i < len(keys) and keys[i] == key:
+                if block[i] is song:
+                    del keys[i], block[i]
+                    if keys:
+                        self._maxes[b] = keys[-1]
+                    else:
+                        del self._keys[b], self._blocks[b], self._maxes[b]
+                    return
+                i += 1
+
+
+class SearchIndex:
+    """Incremental word index over song title, artist and album.
+
+    Postings map each word to the songs containing it. Lookups work on the
+    (much smaller) vocabulary: a trigram -> words map answers substrings, a
+    sorted word list answers two-letter prefixes, and a one-deletion
+    neighbourhood map answers single typos. Adding or removing a song only
+    touches its own words. All songs are also kept in display order, so a
+    broad query can stop after the first `limit` matches instead of sorting
+    thousands.
+    """
+
+    def __init__(self):
+        self.postings = {}      # word -> set of songs
+        self._words = []        # sorted vocabulary for prefix ranges
+        self._recent = []       # sorted words added since, merged in RECENT_WORDS at a time
+        self._trigrams = {}     # trigram -> set of words
+        self._deletes = {}      # word with one char deleted -> set of words
+        self._song_words = {}   # song -> words it was indexed under
+        self._order = _SortedSongs()
+
+    def __len__(self):
+        return len(self._song_words)
+
+    # ---------- maintenance ----------
+    def add(self, song):
+        self.add_many([song])
+
+    def add_many(self, songs):
+        new_words = []
+        for song in songs:
+            if song in self._song_words:
+                self.remove(song)
+            words = set(tokenize(song.title)) | set(tokenize(song.artist)) | set(tokenize(song.album))
+            self._song_words[song] = words
+            self._order.add(song)
+            for word in words:
+                posting = self.postings.get(word)
+                if posting is None:
+                    posting = self.postings[word] = set()
+                    new_words.append(word)
+                posting.add(song)
+        if new_words:
+            # a small side list keeps the big one from being re-sorted for
+            # every few words a scan adds
+            recent = self._recent
+            if len(new_words) > RECENT_WORDS:
+                recent += new_words
+                recent.sort()
+            else:
+                for word in new_words:
+                    insort(recent, word)
+            if len(recent) > RECENT_WORDS:
+                self._words += recent
+                self._words.sort()  # two sorted runs: a merge
+                self._recent = []
+            for word in new_words:
+                self._index_word(word)
+
+    def remove(self, song):
+        self._order.remove(song)
+        for word in self._song_words.pop(song, ()):
+            songs = self.postings[word]
+            songs.discard(song)
+            if not songs:
+                del self.postings[word]
+                self._remove_word(word)
+
+    update = add
+
+    def _index_word(self, word):
+        for gram in _trigrams(word):
+            self._trigrams.setdefault(gram, set()).add(word)
+        if len(word) >= 4:
+            for d in _deletes(word) | {word}:
+                self._deletes.setdefault(d, set()).add(word)
+
+    def _remove_word(self, word):
+        for words in (self._recent, self._words):
+            i = bisect_left(words, word)
+            if i < len(words) and words[i] == word:
+                del words[i]
+                break
+        for gram in _trigrams(word):
+            words = self._trigrams.get(gram)
+            if words:
+                words.discard(word)
+                if not words:
+                    del self._trigrams[gram]
+        if len(word) >= 4:
+            for d in _deletes(word) | {word}:
+                words = self._deletes.get(d)
+                if words:
+                    words.discard(word)
+                    if not words:
+                        del self._deletes[d]
+
+    # ---------- queries ----------
+    def _prefix_words(self, term):
+        # every word starting with `term` sorts before term + U+10FFFF
+        end = term + "\U0010ffff"
+        words, recent = self._words, self._recent
+        found = words[bisect_left(words, term):bisect_left(words, end)]
+        if recent:
+            found += recent[bisect_left(recent, term):bisect_left(recent, end)]
+        return found
+
+    def _substring_words(self, term):
+        if len(term) < 3:
+            return set()
+        grams = sorted((self._trigrams.get(g, ()) for g in _trigrams(term)), key=len)
+        if not grams or not grams[0]:
+            return set()
+        return {w for w in grams[0] if term in w}
+
+    def _fuzzy_words(self, term):
+        if len(term) < 4:
+            return set()
+        candidates = set()
+        for d in _deletes(term) | {term}:
+            candidates |= self._deletes.get(d, set())
+        return {w for w in candidates if _within_one_edit(term, w)}
+
+    def _term_words(self, term):
+        """Vocabulary words matching one query term.
+
+        Terms of three or more letters match anywhere in a word (so prefixes
+        too); shorter ones only as a prefix. Falls back to one-typo matches.
+        """
+        if len(term) >= 3:
+            words = self._substring_words(term)
+        else:
+            words = set(self._prefix_words(term))
+        return words or self._fuzzy_words(term)
+
+    def search(self, query, limit=None):
+        """Songs matching every term of `query` (substring, prefix or one typo).
+
+        Matches come back sorted; with `limit`, only the first `limit` of
+        that order. Returns None for queries too short to narrow anything
+        down.
+        """
+        terms = [t for t in tokenize(query) if len(t) >= MIN_QUERY]
+        if not terms:
+            return None
+        term_words = [self._term_words(t) for t in terms]
+        if not all(term_words):
+            return []
+        postings = self.postings
+        cost = [sum(map(len, map(postings.__getitem__, words))) for words in term_words]
+        # Terms cheap to gather become one set each (a lone word's posting
+        # as is) and are intersected in C, smallest first. A term spread
+        # over too many songs to union is tested against each candidate's
+        # own (handful of) words instead.
+        sets = sorted((self._union(words) for words, c in zip(term_words, cost)
+                       if len(words) == 1 or c <= UNION_MAX), key=len)
+        spread = sorted(((c, words) for words, c in zip(term_words, cost)
+                         if len(words) > 1 and c > UNION_MAX), key=lambda t: t[0])
+        spread = [words for _, words in spread]
+        matches = None
+        for songs in sets:
+            matches = songs if matches is None else matches & songs
+            if not matches:
+                return []
+        estimate = len(matches) if matches is not None else len(self.postings) and min(cost)
+        if limit is not None and limit * len(self._order) < WALK_BIAS * estimate ** 2:
+            # So many songs match that walking the sorted library should find
+            # `limit` of them sooner than collecting and sorting them all. If
+            # the matches cluster late in the order (an artist's name), give
+            # up once the walk has cost as much as collecting would.
+            songs = self._walk_order(matches, spread, limit, WALK_BIAS * estimate)
+            if songs is not None:
+                return songs
+        if matches is None:
+            matches = self._union(spread.pop(0))
+        if spread:
+            song_words = self._song_words
+            matches = [s for s in matches if all(not song_words[s].isdisjoint(w) for w in spread)]
+        key = self._order.key_of.__getitem__
+        if limit is not None and len(matches) > limit:
+            return heapq.nsmallest(limit, matches, key=key)
+        return sorted(matches, key=key)
+
+    def _union(self, words):
+        if len(words) == 1:
+            return self.postings[next(iter(words))]  # read only: never modified here
+        return set().union(*(self.postings[w] for w in words))
+
+    def _walk_order(self, matches, spread, limit, budget):
+        """The first `limit` matches in order, or None past `budget` songs."""
+        song_words = self._song_words
+        songs = []
+        for block in self._order.blocks():
+            budget -= len(block)
+            if budget < 0:
+                return None
+            if matches is not None:
+                block = filter(matches.__contains__, block)  # in C
+            for words in spread:
+                block = [s for s in block if not song_words[s].isdisjoint(words)]
+            songs.extend(block)
+            if len(songs) >= limit:
+                del songs[limit:]
+                break
+        return songs
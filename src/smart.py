@@ -0,0 +1,255 @@
+# smart.py
+import heapq
+import re
+import shlex
+import time
+
+import perf
+from playlist import PlaylistLinkedList
+
+# What a clause reads; changes to a song are reported with these names
+META, VOTES, PLAYS, ADDED = "meta", "votes", "plays", "added"
+ALL = frozenset((META, VOTES, PLAYS, ADDED))
+
+EXPIRE_POLL_MS = 60 * 1000  # how often "added:" windows are slid forward
+
+_NUMBER = r"(\d+(?:\.\d+)?|\d+:\d{2})"
+_COMPARE = re.compile(rf"^(>=|<=|>|<|=)?{_NUMBER}$")
+_RANGE = re.compile(rf"^{_NUMBER}-{_NUMBER}$")
+_AGE = re.compile(r"^<?(\d+(?:\.\d+)?)([dhw]?)$")
+_AGE_UNITS = {"": 86400, "d": 86400, "h": 3600, "w": 7 * 86400}
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _number(text):
+    if ":" in text:  # m:ss
+        minutes, seconds = text.split(":")
+        return int(minutes) * 60 + int(seconds)
+    return float(text)
+
+
+def _numeric(field, text, get):
+    """Predicate for `field:>=3`, `field:3`, `field:120-300` (inclusive)."""
+    m = _RANGE.match(text)
+    if m:
+        low, high = _number(m.group(1)), _number(m.group(2))
+        return lambda song: low <= get(song) <= high
+    m = _COMPARE.match(text)
+    if not m:
+        raise QueryError(f"{field}: expected a number, range or comparison, got {text!r}")
+    op, value = m.group(1) or "=", _number(m.group(2))
+    return {
+        ">=": lambda song: get(song) >= value,
+        "<=": lambda song: get(song) <= value,
+        ">": lambda song: get(song) > value,
+        "<": lambda song: get(song) < value,
+        "=": lambda song: get(song) == value,
+    }[op]
+
+
+def compile_query(text, plays):
+    """Compile a smart playlist query into (match, depends, window).
+
+    The query is space-separated clauses that must all hold:
+
+        artist:"Daft Punk"      exact artist, case-insensitive; a|b for either
+        title:love              title contains the text (so does a bare word)
+        duration:3:00-5:00      seconds or m:ss; a range or >, >=, <, <=, =
+        upvotes:>=3             party-mode votes
+        plays:>10               times played (from the play history)
+        added:7d                added to the library in the last 7 days (h, d, w)
+
+    `plays(song)` returns a song's play count. `depends` is the set of change
+    kinds (META, VOTES, PLAYS, ADDED) that can flip the result, and `window`
+    the seconds of an added: clause (songs age out of it), or None.
+    """
+    try:
+        words = shlex.split(text)
+    except ValueError as e:
+        raise QueryError(str(e))
+    if not words:
+        raise QueryError("empty query")
+    preds, depends, window = [], set(), None
+    slow = set()  # predicates that call out (play counts, the clock)
+    for word in words:
+        field, sep, value = word.partition(":")
+        if not sep:
+            field, value = "title", word
+        field = field.lower()
+        if not value:
+            raise QueryError(f"{field}: missing value")
+        if field == "artist":
+            names = frozenset(v.casefold() for v in value.split("|"))
+            preds.append(lambda song, names=names: song.artist.casefold() in names)
+            depends.add(META)
+        elif field == "title":
+            needle = value.casefold()
+            preds.append(lambda song, needle=needle: needle in song.title.casefold())
+            depends.add(META)
+        elif field == "duration":
+            preds.append(_numeric(field, value, lambda song: song.duration or 0))
+            depends.add(META)
+        elif field == "upvotes":
+            preds.append(_numeric(field, value, lambda song: song.upvotes))
+            depends.add(VOTES)
+        elif field == "plays":
+            preds.append(_numeric(field, value, plays))
+            slow.add(preds[-1])
+            depends.add(PLAYS)
+        elif field == "added":
+            m = _AGE.match(value)
+            if not m:
+                raise QueryError(f"added: expected an age like 7d, 12h or 2w, got {value!r}")
+            seconds = float(m.group(1)) * _AGE_UNITS[m.group(2)]
+            window = seconds if window is None else min(window, seconds)
+            preds.append(lambda song, s=seconds: (song.added or 0) > time.time() - s)
+            slow.add(preds[-1])
+            depends.add(ADDED)
+        else:
+            raise QueryError(f"unknown field {field!r}")
+    # cheapest checks first, chained without a generator per song
+    preds.sort(key=lambda p: p in slow)
+    match = preds[0]
+    for pred in preds[1:]:
+        match = (lambda a, b: lambda song: a(song) and b(song))(match, pred)
+    return match, depends, window
+
+
+class SmartPlaylist:
+    """A saved query and the PlaylistLinkedList of library songs matching it."""
+
+    def __init__(self, name, query, playlist, plays):
+        self.name = name
+        self.query = query
+        self.match, self.depends, self.window = compile_query(query, plays)
+        self.playlist = playlist
+        self.ready = False   # evaluated against the library yet?
+        self._expiry = []    # (added + window, id, song) for members, with added: clauses
+
+    def _track(self, song):
+        if self.window is not None:
+            heapq.heappush(self._expiry, ((song.added or 0) + self.window, song.id, song))
+
+
+class SmartPlaylists:
+    """Keeps every smart playlist current as songs change.
+
+    A smart playlist is evaluated over the whole library once, the first time
+    it is shown or played. After that only changed songs are re-checked, and
+    only against playlists whose query reads what changed: a vote re-checks
+    the upvotes: playlists, a new tag the artist/title/duration ones. Songs
+    leave added: windows through a per-playlist heap of expiry times.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.smart = {}  # name -> SmartPlaylist
+        self._expire_id = None
+
+    def __contains__(self, name):
+        return name in self.smart
+
+    def _plays(self, song):
+        return self.app.history.play_count(song)
+
+    def add(self, name, query):
+        """Define (or redefine) a smart playlist; raises QueryError on a bad query."""
+        old = self.smart.get(name)
+        playlist = old.playlist if old else self.app.playlists.get(name)
+        if playlist is None:
+            playlist = PlaylistLinkedList()
+        sp = SmartPlaylist(name, query, playlist, self._plays)
+        with self.app.engine.lock:
+            playlist.clear()
+        self.smart[name] = sp
+        self.app.playlists[name] = playlist
+        return sp
+
+    def remove(self, name):
+        self.smart.pop(name, None)
+
+    def queries(self):
+        return {name: sp.query for name, sp in self.smart.items()}
+
+    def ensure(self, name):
+        """Evaluate a smart playlist over the library if it has not been yet."""
+        sp = self.smart.get(name)
+        if sp is None or sp.ready:
+            return
+        with self.app.engine.lock, perf.span("smart.evaluate"):
+            match = sp.match
+            for song in self.app.library_manager.songs:
+                if match(song):
+                    sp.playlist.append(song)
+                    sp._track(song)
+            sp.ready = True
+        if sp.window is not None and not self._expire_id:
+            self._expire_id = self.app.root.after(EXPIRE_POLL_MS, self._expire)
+
+    def update(self, songs, changed):
+        """Re-check `songs` after a change of the given kinds (see META etc.)."""
+        targets = [sp for sp in self.smart.values() if sp.ready and not sp.depends.isdisjoint(changed)]
+        if not targets:
+            return
+        songs = list(songs)
+        library = self.app.library_manager.by_path
+        touched = []
+        engine = self.app.engine
+        with engine.lock, perf.span("smart.update"):
+            for sp in targets:
+                match, playlist = sp.match, sp.playlist
+                added, removed = [], []
+                for song in songs:
+                    member = song.filepath in playlist
+                    wanted = library.get(song.filepath) is song and match(song)
+                    if wanted and not member:
+                        playlist.append(song)
+                        sp._track(song)
+                        added.append(song)
+                    elif member and not wanted:
+                        playlist.remove_path(song.filepath)
+                        removed.append(song)
+                if added or removed:
+                    touched.append(sp.name)
+                    self._sync_party(playlist, added, removed)
+        self._changed(touched)
+
+    def remove_songs(self, songs):
+        """Songs left the library: drop them from every smart playlist."""
+        touched = []
+        with self.app.engine.lock:
+            for sp in self.smart.values():
+                removed = [song for song in songs if sp.playlist.remove_path(song.filepath)]
+                if removed:
+                    touched.append(sp.name)
+                    self._sync_party(sp.playlist, [], removed)
+        self._changed(touched)
+
+    def _expire(self):
+        self._expire_id = None
+        now = time.time()
+        due = []
+        for sp in self.smart.values():
+            while sp._expiry and sp._expiry[0][0] <= now:
+                due.append(heapq.heappop(sp._expiry)[2])
+        if due:
+            self.update(due, {ADDED})
+        if any(sp.ready and sp.window is not None for sp in self.smart.values()):
+            self._expire_id = self.app.root.after(EXPIRE_POLL_MS, self._expire)
+
+    def _sync_party(self, playlist, added, removed):
+        engine = self.app.engine
+        if engine.party_mode and playlist is engine.playlist:
+            self.app.party_queue.extend(added)
+            for song in removed:
+                self.app.party_queue.remove(song.filepath)
+
+    def _changed(self, names):
+        if not names:
+            return
+        self.app.engine.refresh_upcoming()
+        if self.app.current_playlist_name in names:
+            self.app.display_playlist_songs()
@@ -1,6 +1,65 @@
+import sys
+
+
 class Song:
-    def __init__(self, title, artist, filepath):
+    __slots__ = ("id", "title", "artist", "filepath", "album", "track", "duration", "upvotes",
+                 "added", "gain")
+
+    def __init__(self, title, artist, filepath, album="", track=0, duration=0, id=None):
+        self.id = id  # stable SongTable id, assigned when the song is registered
         self.title = title
-        self.artist = artist
+        # a handful of artists/albums are shared by thousands of songs
+        self.artist = sys.intern(artist)
         self.filepath = filepath
+        self.album = sys.intern(album)
+        self.track = track
+        self.duration = duration  # seconds, 0 until metadata is read
         self.upvotes = 0  # For party mode
+        self.added = None  # unix time it joined the library (0 = before this was recorded)
+        self.gain = None   # ReplayGain-style track gain in dB, once analysed
+
+
+class SongTable:
+    """Every known song exactly once, by stable integer id and by filepath.
+
+    The library and all playlists hold the Song objects registered here, so
+    a track in many playlists is one object (and one set of upvotes), and
+    the saved files refer to it by id.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_path = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, song_id):
+        return self.by_id.get(song_id)
+
+    def find(self, filepath):
+        return self.by_path.get(filepath)
+
+    def add(self, song):
+        """Register `song`; returns the canonical Song for its filepath.
+
+        A song that already has a free id keeps it (loading saved data);
+        otherwise it gets the next unused one.
+        """
+        existing = self.by_path.get(song.filepath)
+        if existing is not None:
+            return existing
+        if song.id is None or song.id in self.by_id:
+            song.id = self.next_id
+        self.next_id = max(self.next_id, song.id + 1)
+        self.by_id[song.id] = song
+        self.by_path[song.filepath] = song
+        return song
+
+    def rename(self, song, filepath):
+        """Point `song` at a new file, keeping its id."""
+        if self.by_path.get(song.filepath) is song:
+            del self.by_path[song.filepath]
+        song.filepath = filepath
+        self.by_path[filepath] = song
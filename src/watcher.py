@@ -0,0 +1,439 @@
+# watcher.py
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from scanner import SUPPORTED_EXT
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+SETTLE = 0.3         # seconds of quiet before a burst of events is reported
+MAX_HOLD = 2.0       # ... but never hold events longer than this
+POLL_INTERVAL = 2.0  # seconds between directory checks in polling mode
+
+
+def _supported(path):
+    return path.lower().endswith(SUPPORTED_EXT)
+
+
+def stat_entry(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return path, st.st_mtime, st.st_size
+
+
+def _files_below(folder):
+    """Supported files under `folder` (a plain recursive scandir walk)."""
+    stack, files = [folder], []
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif _supported(entry.name):
+                        files.append(entry.path)
+        except OSError:
+            continue
+    return files
+
+
+class _Changes:
+    """One burst of filesystem changes, in scanner batch terms."""
+
+    def __init__(self):
+        self.added = {}      # path -> None (ordered set); stat'ed at flush
+        self.modified = {}   # rewritten in place; stat'ed at flush
+        self.removed = {}
+        self.created = set()  # files created in this burst, not yet written
+        self.renamed = {}    # old path -> new path
+        self.removed_dirs = []
+        self.rescan = False
+
+    def add(self, path):
+        self.removed.pop(path, None)
+        self.modified.pop(path, None)
+        self.added[path] = None
+
+    def modify(self, path):
+        if path not in self.added:
+            self.removed.pop(path, None)
+            self.modified[path] = None
+
+    def written(self, path):
+        """A file was closed after writing: new if created in this burst, else modified."""
+        if path in self.created:
+            self.created.discard(path)
+            self.add(path)
+        else:
+            self.modify(path)
+
+    def remove(self, path):
+        self.added.pop(path, None)
+        self.modified.pop(path, None)
+        self.removed[path] = None
+
+    def rename(self, old, new):
+        if old in self.modified:  # rewritten, then moved
+            del self.modified[old]
+            self.modified[new] = None
+        if old in self.added:  # created and moved within one burst
+            del self.added[old]
+            self.added[new] = None
+        elif _supported(old) and _supported(new):
+            self.renamed[old] = new
+        elif _supported(new):
+            self.add(new)
+        else:
+            self.remove(old)
+
+    def __bool__(self):
+        return bool(self.added or self.modified or self.removed or self.renamed
+                    or self.removed_dirs or self.rescan)
+
+
+class _Watcher:
+    """Shared plumbing: a thread that turns bursts of changes into messages.
+
+    Messages go onto `results` (the LibraryScanner's queue) in the form the
+    library already drains: ("batch", root, added, updated, removed) with
+    (path, mtime, size) tuples, plus ("rename", root, [(old, new)]),
+    ("remove_tree", root, folder) and ("rescan", root).
+    """
+
+    def __init__(self, root, results):
+        self.root = os.path.abspath(root)
+        self.results = results
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"watch {self.root}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _flush(self, changes):
+        root = self.root
+        if changes.rescan:
+            self.results.put(("rescan", root))
+        for folder in changes.removed_dirs:
+            self.results.put(("remove_tree", root, folder))
+        if changes.renamed:
+            self.results.put(("rename", root, list(changes.renamed.items())))
+        added = [e for e in map(stat_entry, filter(_supported, changes.added)) if e]
+        updated = [e for e in map(stat_entry, filter(_supported, changes.modified)) if e]
+        removed = [p for p in changes.removed if _supported(p)]
+        if added or updated or removed:
+            self.results.put(("batch", root, added, updated, removed))
+
+
+class InotifyWatcher(_Watcher):
+    """Linux inotify through ctypes: one watch per directory below root.
+
+    The watches are added on the watcher thread, so starting one never
+    walks the tree on the caller's. Where inotify is unavailable or runs out
+    of watches, that thread carries on as a PollingWatcher instead.
+    """
+
+    def __init__(self, root, results):
+        super().__init__(root, results)
+        self._libc = None
+        self._fd = -1
+        self._dirs = {}  # wd -> directory path
+
+    def _setup(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _add_watch(self, folder):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (28, 24):  # ENOSPC / EMFILE: out of watches, let the caller fall back
+                raise OSError(err, f"cannot watch {folder}: {os.strerror(err)}")
+            return None
+        self._dirs[wd] = folder
+        return wd
+
+    def _watch_tree(self, folder):
+        stack = [folder]
+        while stack:
+            path = stack.pop()
+            self._add_watch(path)
+            try:
+                with os.scandir(path) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def _moved_dir(self, old, new):
+        # wds below the old path now live below the new one
+        prefix = os.path.join(old, "")
+        for wd, path in self._dirs.items():
+            if path == old or path.startswith(prefix):
+                self._dirs[wd] = new + path[len(old):]
+
+    def _watch_new_dir(self, folder, changes):
+        try:
+            self._watch_tree(folder)
+        except OSError:
+            changes.rescan = True  # out of watches; the rescan still finds the files
+        # files may land before the watch exists; pick them up now
+        for f in _files_below(folder):
+            changes.add(f)
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def _run(self):
+        try:
+            self._setup()
+        except (OSError, AttributeError):
+            # not Linux, or out of inotify watches: poll on this thread instead
+            fallback = PollingWatcher(self.root, self.results)
+            fallback._stop = self._stop
+            fallback._run()
+            return
+        changes = _Changes()
+        moves = {}  # cookie -> (path, is_dir), waiting for the matching IN_MOVED_TO
+        first = last = 0.0
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([self._fd], [], [], SETTLE / 3)
+                now = time.monotonic()
+                if ready:
+                    if not (changes or moves):
+                        first = now
+                    for wd, mask, cookie, name in self._read():
+                        self._handle(wd, mask, cookie, name, changes, moves)
+                    last = now
+                if (changes or moves) and (now - last >= SETTLE or now - first >= MAX_HOLD):
+                    # unmatched moves left the tree
+                    for path, is_dir in moves.values():
+                        if is_dir:
+                            changes.removed_dirs.append(path)
+                        else:
+                            changes.remove(path)
+                    moves.clear()
+                    self._flush(changes)
+                    changes = _Changes()
+        finally:
+            os.close(self._fd)
+
+    def _handle(self, wd, mask, cookie, name, changes, moves):
+        if mask & IN_Q_OVERFLOW:
+            changes.rescan = True  # events were dropped; an incremental rescan catches up
+            return
+        folder = self._dirs.get(wd)
+        if folder is None:
+            return
+        if mask & IN_IGNORED:
+            del self._dirs[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            return  # reported (as delete/move) by the parent directory
+        path = os.path.join(folder, name)
+        is_dir = bool(mask & IN_ISDIR)
+        if mask & IN_MOVED_FROM:
+            moves[cookie] = (path, is_dir)
+        elif mask & IN_MOVED_TO:
+            source = moves.pop(cookie, None)
+            if source is None:  # moved in from outside the tree
+                if is_dir:
+                    self._watch_new_dir(path, changes)
+                else:
+                    changes.add(path)
+            elif is_dir:
+                old = source[0]
+                self._moved_dir(old, path)
+                for f in _files_below(path):
+                    changes.rename(old + f[len(path):], f)
+            else:
+                changes.rename(source[0], path)
+        elif mask & IN_CREATE:
+            if is_dir:
+                self._watch_new_dir(path, changes)
+            else:
+                changes.created.add(path)  # reported once written (IN_CLOSE_WRITE)
+        elif mask & IN_CLOSE_WRITE:
+            # a rewrite of an existing file must reach the library as a change,
+            # so what was derived from the old audio gets recomputed
+            changes.written(path)
+        elif mask & IN_DELETE:
+            if is_dir:
+                changes.removed_dirs.append(path)
+            else:
+                changes.remove(path)
+
+
+class PollingWatcher(_Watcher):
+    """Portable fallback: re-list only directories whose mtime changed.
+
+    Creating, deleting or renaming an entry bumps its directory's mtime, so
+    each pass costs one stat() per directory. Files and folders are matched
+    by inode to tell renames from delete + add. Rewriting an existing file in
+    place does not touch the directory and is left to the next rescan.
+    """
+
+    def __init__(self, root, results, interval=POLL_INTERVAL):
+        super().__init__(root, results)
+        self.interval = interval
+        self._dirs = {}  # folder -> (mtime_ns, {name: (inode, is_dir)})
+
+    def _list(self, folder):
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+            with os.scandir(folder) as it:
+                entries = {e.name: (e.inode(), e.is_dir(follow_symlinks=False)) for e in it}
+        except OSError:
+            return None
+        return mtime, entries
+
+    def _snapshot_tree(self, folder, files):
+        """Record `folder` and everything below it; appends its files to `files`."""
+        stack = [folder]
+        while stack:
+            path = stack.pop()
+            listing = self._list(path)
+            if listing is None:
+                continue
+            self._dirs[path] = listing
+            for name, (_, is_dir) in listing[1].items():
+                child = os.path.join(path, name)
+                if is_dir:
+                    stack.append(child)
+                elif _supported(name):
+                    files.append(child)
+
+    def _forget_tree(self, folder):
+        """Drop `folder` and its subfolders; returns {inode: path} of their files."""
+        gone = {}
+        prefix = os.path.join(folder, "")
+        for path in [p for p in self._dirs if p == folder or p.startswith(prefix)]:
+            for name, (inode, is_dir) in self._dirs.pop(path)[1].items():
+                if not is_dir:
+                    gone[inode] = os.path.join(path, name)
+        return gone
+
+    def _run(self):
+        self._snapshot_tree(self.root, [])  # the first listing, off the caller's thread
+        while not self._stop.wait(self.interval):
+            changes = self._poll()
+            if changes:
+                self._flush(changes)
+
+    def _poll(self):
+        changes = _Changes()
+        removed = {}   # inode -> path, files that disappeared this pass
+        added = {}     # inode -> path
+        removed_dirs = {}  # inode -> folder
+        added_dirs = {}
+        for folder in list(self._dirs):
+            old = self._dirs.get(folder)
+            if old is None:
+                continue  # dropped earlier in this pass
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue  # the parent reports it as removed
+            if mtime == old[0]:
+                continue
+            listing = self._list(folder)
+            if listing is None:
+                continue
+            self._dirs[folder] = listing
+            before, after = old[1], listing[1]
+            for name, (inode, is_dir) in before.items():
+                if after.get(name) != (inode, is_dir):
+                    path = os.path.join(folder, name)
+                    if is_dir:
+                        removed_dirs[inode] = path
+                    elif _supported(name):
+                        removed[inode] = path
+            for name, (inode, is_dir) in after.items():
+                if before.get(name) != (inode, is_dir):
+                    path = os.path.join(folder, name)
+                    if is_dir:
+                        added_dirs[inode] = path
+                    elif _supported(name):
+                        added[inode] = path
+
+        for inode, folder in removed_dirs.items():
+            old_files = self._forget_tree(folder)
+            new_folder = added_dirs.pop(inode, None)
+            if new_folder is None:
+                changes.removed_dirs.append(folder)
+                continue
+            # a renamed folder: its files moved with it
+            for path in old_files.values():
+                changes.rename(path, new_folder + path[len(folder):])
+            self._snapshot_tree(new_folder, [])
+        for folder in added_dirs.values():
+            files = []
+            self._snapshot_tree(folder, files)
+            for path in files:
+                changes.add(path)
+        for inode, path in removed.items():
+            new = added.pop(inode, None)
+            if new is None:
+                changes.remove(path)
+            else:
+                changes.rename(path, new)
+        for path in added.values():
+            changes.add(path)
+        return changes
+
+
+def watch(root, results):
+    """Start the best available watcher for `root`; returns at once.
+
+    The tree is walked on the watcher's own thread, which also falls back
+    to polling when inotify cannot be used.
+    """
+    return InotifyWatcher(root, results).start()
@@ -0,0 +1,253 @@
+# waveform.py
+"""Waveform overviews for the seek bar.
+
+Each track is reduced to a POINTS-long min/max peak envelope while it is
+decoded block by block, so the whole PCM is never in memory. Envelopes
+live in one flat file (waveforms.bin): a small header, then a fixed-size
+record per stable song id. Records are written in place and read
+through mmap as NumPy views, so showing a track copies nothing; slots that
+were never written stay holes in a sparse file.
+
+A record is POINTS bytes of minima then POINTS bytes of maxima, with -1..1
+mapped to 1..255; a leading 0 byte marks a slot with no envelope.
+Computing envelopes needs NumPy (see features.HAS_NUMPY).
+"""
+import mmap
+import os
+import queue
+import struct
+import threading
+
+import perf
+from features import decode_blocks
+
+WAVEFORMS_FILE = "waveforms.bin"  # lives next to library.json
+POINTS = 2048
+RECORD = 2 * POINTS
+MAGIC = b"MPWAVE01"
+HEADER = struct.Struct("<8sII")   # magic, points, reserved
+FIRST_BUCKET = 64                 # samples per envelope bucket before merging
+WAVEFORM_POLL_MS = 50             # how often finished envelopes are picked up
+
+
+def envelope(blocks, points=POINTS):
+    """(minima, maxima) of `points` buckets over streamed sample blocks, or None.
+
+    Buckets start FIRST_BUCKET samples wide and double (merging neighbours)
+    whenever there are 4 * points of them, so memory stays bounded whatever
+    the track length.
+    """
+    import numpy as np
+    bucket = FIRST_BUCKET
+    lo, hi = [], []
+    count = 0
+    carry = np.empty(0, dtype=np.float32)
+    for block in blocks:
+        if len(carry):
+            block = np.concatenate((carry, block))
+        n = len(block) - len(block) % bucket
+        frames = block[:n].reshape(-1, bucket)
+        lo.append(frames.min(axis=1))
+        hi.append(frames.max(axis=1))
+        count += len(frames)
+        carry = block[n:]
+        if count >= 4 * points:
+            lo, hi = np.concatenate(lo), np.concatenate(hi)
+            if count % 2:
+                lo, hi = np.append(lo, lo[-1]), np.append(hi, hi[-1])
+            lo, hi = [np.minimum(lo[0::2], lo[1::2])], [np.maximum(hi[0::2], hi[1::2])]
+            count = len(lo[0])
+            bucket *= 2
+    if len(carry):
+        lo.append(carry.min(keepdims=True))
+        hi.append(carry.max(keepdims=True))
+        count += 1
+    if not count:
+        return None
+    lo, hi = np.concatenate(lo), np.concatenate(hi)
+    if count >= points:
+        edges = np.arange(points) * count // points
+        lo, hi = np.minimum.reduceat(lo, edges), np.maximum.reduceat(hi, edges)
+    else:
+        # short file: stretch what there is
+        spread = np.arange(points) * count // points
+        lo, hi = lo[spread], hi[spread]
+    return np.clip(lo, -1, 1), np.clip(hi, -1, 1)
+
+
+def encode(lo, hi):
+    """One record (uint8, RECORD bytes) for an envelope."""
+    import numpy as np
+    return np.rint(np.concatenate((lo, hi)) * 127 + 128).astype(np.uint8)
+
+
+def compute(path):
+    """Encoded envelope of a file, or None if it cannot be decoded."""
+    try:
+        env = envelope(decode_blocks(path))
+    except (ValueError, MemoryError):
+        return None
+    return encode(*env) if env is not None else None
+
+
+def outline(record, width, height):
+    """Flat canvas polygon coordinates drawing a record `width` pixels wide."""
+    import numpy as np
+    edges = np.arange(width) * POINTS // width
+    lo = np.minimum.reduceat(record[:POINTS], edges).astype(np.float32)
+    hi = np.maximum.reduceat(record[POINTS:], edges).astype(np.float32)
+    mid = height / 2
+    scale = (mid - 1) / 127
+    x = np.arange(width, dtype=np.float32)
+    top = np.column_stack((x, mid - (hi - 128) * scale))
+    bottom = np.column_stack((x[::-1], mid - (lo[::-1] - 128) * scale))
+    return np.concatenate((top, bottom)).ravel().tolist()
+
+
+class WaveformStore:
+    """Envelope records in waveforms.bin, read zero-copy through mmap.
+
+    get() returns a view into the mapping; the mapping is replaced (never
+    closed) when the file has grown, so views handed out earlier stay valid.
+    """
+
+    def __init__(self, path=WAVEFORMS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self._file = None
+        self._map = None
+
+    def _open(self):
+        if self._file is None:
+            f = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+            head = f.read(HEADER.size)
+            if len(head) != HEADER.size or HEADER.unpack(head)[:2] != (MAGIC, POINTS):
+                f.truncate(0)  # missing, foreign or other resolution: start over
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, POINTS, 0))
+                f.flush()
+            self._file = f
+        return self._file
+
+    def _write(self, offset, data):
+        f = self._open()
+        f.seek(offset)
+        f.write(data)
+        f.flush()  # the mapping reads the file, not this buffer
+
+    def _mapping(self, end):
+        """A mapping that covers file offsets below `end`, or None."""
+        if self._map is None or len(self._map) < end:
+            fileno = self._open().fileno()
+            size = os.fstat(fileno).st_size
+            if size < end:
+                return None
+            self._map = mmap.mmap(fileno, size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def get(self, song_id):
+        """The record for a song as a uint8 view, or None if there is none."""
+        import numpy as np
+        if song_id is None:
+            return None
+        offset = HEADER.size + song_id * RECORD
+        with self.lock:
+            m = self._mapping(offset + RECORD)
+            if m is None or not m[offset]:
+                return None
+            return np.frombuffer(m, dtype=np.uint8, count=RECORD, offset=offset)
+
+    def has(self, song_id):
+        return self.get(song_id) is not None
+
+    def put(self, song_id, record):
+        with self.lock:
+            self._write(HEADER.size + song_id * RECORD, memoryview(record))
+
+    def forget(self, song_ids):
+        with self.lock:
+            size = os.fstat(self._open().fileno()).st_size
+            for song_id in song_ids:
+                if song_id is not None and HEADER.size + song_id * RECORD < size:
+                    self._write(HEADER.size + song_id * RECORD, b"\0")
+
+    def close(self):
+        with self.lock:
+            self._map = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class WaveformLoader:
+    """Computes envelopes on a background thread for the seek bar.
+
+    show() asks for the playing track (drawn as soon as it is ready),
+    prefetch() for the one after it, so by the time it starts its envelope
+    is usually on disk. The current track always goes first.
+    """
+
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+        self.current = None
+        self._jobs = queue.PriorityQueue()
+        self._results = queue.Queue()
+        self._pending = set()  # song ids queued or being computed
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._poll_id = None
+
+    def show(self, song):
+        self.current = song
+        record = self.store.get(song.id)
+        self.app.draw_waveform(record)
+        if record is None:
+            self._request(song, 0)
+
+    def prefetch(self, song):
+        if song.id is not None and not self.store.has(song.id):
+            self._request(song, 1)
+
+    def _request(self, song, priority):
+        if song.id is None:
+            return
+        if song.id not in self._pending:
+            self._pending.add(song.id)
+            self._seq += 1
+            with self._lock:
+                self._jobs.put((priority, self._seq, song.id, song.filepath))
+                if not self._running:
+                    self._running = True
+                    threading.Thread(target=self._run, daemon=True).start()
+        if not self._poll_id:
+            self._poll_id = self.app.root.after(WAVEFORM_POLL_MS, self._poll)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                try:
+                    _, _, song_id, path = self._jobs.get_nowait()
+                except queue.Empty:
+                    self._running = False
+                    return
+            with perf.span("waveform.compute"):
+                record = compute(path)
+            self._results.put((song_id, record))
+
+    def _poll(self):
+        self._poll_id = None
+        while True:
+            try:
+                song_id, record = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(song_id)
+            if record is None:
+                continue
+            self.store.put(song_id, record)
+            if self.current is not None and self.current.id == song_id:
+                self.app.draw_waveform(self.store.get(song_id))
+        if self._pending:
+            self._poll_id = self.app.root.after(WAVEFORM_POLL_MS, self._poll)
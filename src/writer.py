@@ -0,0 +1,117 @@
+# writer.py
+import json
+import os
+import threading
+import time
+
+import perf
+
+
+def write_json_atomic(path, data):
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class PersistWriter:
+    """Background thread that debounces and coalesces JSON file writes.
+
+    `request(path, data)` hands over a snapshot (plain lists/dicts captured on
+    the caller's thread). Requests for the same path within `delay` seconds
+    replace each other, so a burst of edits produces one write of the latest
+    snapshot; `max_delay` bounds how long a busy stream can postpone it.
+    Encoding and the temp-file + rename happen on the writer thread.
+    """
+
+    def __init__(self, delay=0.5, max_delay=5.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.written = 0
+        self.skipped = 0  # requests superseded before they were written
+        self.errors = 0
+        self._pending = {}  # path -> [data, callbacks, first_request, deadline]
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writing = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, path, data, on_written=None):
+        now = time.monotonic()
+        with self._cond:
+            job = self._pending.get(path)
+            if job:
+                self.skipped += 1
+                job[0] = data
+                job[3] = min(now + self.delay, job[2] + self.max_delay)
+            else:
+                job = self._pending[path] = [data, [], now, now + self.delay]
+            if on_written:
+                job[1].append(on_written)
+            self._cond.notify_all()
+
+    def counters(self):
+        with self._cond:
+            return {"pending": len(self._pending) + self._writing,
+                    "written": self.written, "skipped": self.skipped, "errors": self.errors}
+
+    def flush(self):
+        """Write everything pending now and wait until it is on disk."""
+        with self._cond:
+            for job in self._pending.values():
+                job[3] = 0
+            self._cond.notify_all()
+            while self._pending or self._writing:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    due = [p for p, job in self._pending.items() if job[3] <= now]
+                    if due:
+                        break
+                    timeout = min((job[3] for job in self._pending.values()), default=None)
+                    self._cond.wait(None if timeout is None else timeout - now)
+                jobs = [(p, self._pending.pop(p)) for p in due]
+                self._writing = len(jobs)
+            for path, (data, callbacks, _, _) in jobs:
+                ok = False
+                try:
+                    with perf.span("persist.write"):
+                        write_json_atomic(path, data)
+                    ok = True
+                    for callback in callbacks:
+                        callback(path)
+                except Exception:
+                    # a full disk or a snapshot json cannot encode: count it and
+                    # keep going, since flush() and close() wait on this thread
+                    pass
+                finally:
+                    with self._cond:
+                        if ok:
+                            self.written += 1
+                        else:
+                            self.errors += 1
+                        self._writing -= 1
+                        self._cond.notify_all()